@@ -0,0 +1,83 @@
+"""
+Write-behind buffer for users' last activity
+Handlers only remember when a user was active, a background job writes
+all collected timestamps with a single UPDATE statement.
+"""
+
+import datetime as dt
+import logging
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import DateTime, Integer, column, update, values
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session as SqaSession
+from telegram.ext import CallbackContext
+
+from app.database import Session, User
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_active: Dict[int, dt.datetime] = dict()
+
+    def __len__(self):
+        return len(self._last_active)
+
+    def touch(self, tg_id: int, when: Optional[dt.datetime] = None):
+        """ Remembers that the user was active """
+        when = when or dt.datetime.now()
+        with self._lock:
+            if self._last_active.get(tg_id, when) <= when:
+                self._last_active[tg_id] = when
+
+    def flush(self, session: Optional[SqaSession] = None) -> int:
+        """
+        Writes all collected timestamps to the database
+        :return: number of users, whose last activity was written
+        """
+        with self._lock:
+            pending, self._last_active = self._last_active, dict()
+        if not pending:
+            return 0
+
+        activity = (
+            values(column("tg_id", Integer), column("last_active", DateTime), name="activity")
+            .data(list(pending.items()))
+        )
+        stmt = (
+            update(User)
+            .where(User.tg_id == activity.c.tg_id)
+            .values(last_active=activity.c.last_active)
+            .execution_options(synchronize_session=False)
+        )
+
+        own_session = session is None
+        if own_session:
+            session = Session()
+        try:
+            session.execute(stmt)
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error("got error while writing users activity: %s", str(e))
+            # keep timestamps for the next attempt, unless newer ones were collected
+            for tg_id, when in pending.items():
+                self.touch(tg_id, when)
+            return 0
+        finally:
+            if own_session:
+                session.close()
+        return len(pending)
+
+
+activity_buffer = ActivityBuffer()
+
+
+def flush_activity(ctx: CallbackContext):
+    """ JobQueue callback """
+    activity_buffer.flush()
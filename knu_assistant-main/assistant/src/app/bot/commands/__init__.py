@@ -1,4 +1,5 @@
 from .basic import *
 from .moderation import *
+from .teacher import *
 from .timetable import *
 from .user import *
@@ -25,11 +25,17 @@ HELLO_MESSAGE = """
    /change_group - перейти в іншу групу/підгрупу
 
    <b>[ Розклад ]</b>
+   /now - поточне заняття
+   /next - наступне заняття
+   /month - на місяць
    /week - на тиждень
    /day - на день
+   /teacher - розклад викладача
+   /ics - експорт у календар
 
 <b>Ти - староста?</b>
 Повідом про це @iterlace та отримай привілеї.
+   /broadcast - повідомлення всій групі
 
 Якщо бажаєш підтримати проєкт: https://github.com/iterlace/knu_assistant
 Оригінальний розклад було завантажено з https://mytimetable.live
@@ -64,7 +70,6 @@ def start(update: Update, ctx: CallbackContext, session: Session, user: User):
 
 def end_callback(update: Update, ctx: CallbackContext, delete: bool = False):
     if update.callback_query is not None:
-        update.callback_query.answer()
         # bot.edit_message_text(
         #     chat_id=update.effective_user.id,
         #     message_id=update.callback_query.message.message_id,
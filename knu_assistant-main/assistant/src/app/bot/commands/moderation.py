@@ -1,15 +1,21 @@
 import logging
 
+from sqlalchemy import insert, literal, select
 from sqlalchemy.orm import Session
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update
+from telegram.constants import MAX_MESSAGE_LENGTH
 from telegram.ext import CallbackContext
 
+from app.bot.commands.utils import end
 from app.bot.decorators import acquire_user, db_session, moderators_only
 from app.bot.dictionaries import states
 from app.bot.dictionaries.phrases import *
 from app.bot.keyboards import build_keyboard_menu
 from app.bot.api import bot
-from app.database import Lesson, Request, User
+from app.core.celery import app as celery_app
+from app.database import BROADCAST_PENDING, Broadcast, BroadcastRecipient, Lesson, Request, User
+from app.timetable.cache import timetable_cache
+from app.timetable.fragments import lesson_fragments
 
 logger = logging.getLogger(__name__)
 
@@ -85,28 +91,31 @@ def accept_link_request(update: Update, ctx: CallbackContext, session: Session,
     if request is None or request.is_resolved \
             or request.meta.get("lesson_id", None) is None \
             or request.meta.get("link", None) is None:
-        update.callback_query.answer()
         bot.delete_message(update.effective_user.id, update.message.message_id)
         return
     lesson = session.query(Lesson).get(request.meta.get("lesson_id", None))
     if lesson is None:
         request.is_resolved = True
         session.commit()
-        update.callback_query.answer()
         bot.delete_message(update.effective_user.id, update.message.message_id)
+        return
 
     lesson.link = request.meta["link"]
     request.is_resolved = True
+    # read before commit expires the request, to not load it again
+    message, initiator_id = request.message, request.initiator_id
+    lesson_id, students_group_id = lesson.id, lesson.students_group_id
     session.commit()
-    update.callback_query.answer()
+    lesson_fragments.invalidate(lesson_id)
+    timetable_cache.invalidate_groups([students_group_id])
     update.callback_query.edit_message_text(
-        text=f"{E_ACCEPT} {request.message}",
+        text=f"{E_ACCEPT} {message}",
         reply_markup=None,
         parse_mode=ParseMode.HTML,
     )
     bot.send_message(
-        request.initiator.tg_id,
-        text=f"{E_ACCEPT} Ваш запит #{request.id} було підтверджено!",
+        initiator_id,
+        text=f"{E_ACCEPT} Ваш запит #{request_id} було підтверджено!",
         parse_mode=ParseMode.HTML,
     )
 
@@ -118,21 +127,84 @@ def reject_link_request(update: Update, ctx: CallbackContext, session: Session,
     request_id = ctx.match.group(1)
     request: Request = session.query(Request).get(request_id)
     if request is None or request.is_resolved:
-        update.callback_query.answer()
         bot.delete_message(update.effective_user.id, update.message.message_id)
         return
 
     request.is_resolved = True
+    # read before commit expires the request, to not load it again
+    message, initiator_id = request.message, request.initiator_id
     session.commit()
 
-    update.callback_query.answer()
     update.callback_query.edit_message_text(
-        text=f"{E_CANCEL} {request.message}",
+        text=f"{E_CANCEL} {message}",
         reply_markup=None,
         parse_mode=ParseMode.HTML,
     )
     bot.send_message(
-        request.initiator.tg_id,
-        text=f"{E_CANCEL} Ваш запит #{request.id} було відхилено!",
+        initiator_id,
+        text=f"{E_CANCEL} Ваш запит #{request_id} було відхилено!",
         parse_mode=ParseMode.HTML,
     )
+
+
+# the task is sent by name, as app.tasks imports bot commands
+SEND_BROADCAST_TASK = "app.tasks.broadcast.send_broadcast"
+# leaves room for the header, which is added to broadcasts
+MAX_BROADCAST_LENGTH = MAX_MESSAGE_LENGTH - 100
+
+
+@db_session
+@acquire_user
+@moderators_only
+def broadcast(update: Update, ctx: CallbackContext, session: Session, user: User):
+    update.message.reply_text(
+        text="Введіть повідомлення для всіх студентів вашої групи:",
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton(text=P_CANCEL, callback_data=states.END)
+        ]]),
+    )
+    return states.BroadcastWait
+
+
+@db_session
+@acquire_user
+@moderators_only
+def broadcast_message(update: Update, ctx: CallbackContext, session: Session, user: User):
+    """ Queues the message for delivery to every student of moderator's group """
+    message = update.message.text
+    if len(message) > MAX_BROADCAST_LENGTH:
+        update.message.reply_text(
+            text="Повідомлення задовге (максимум {} символів), спробуйте ще раз:"
+                 .format(MAX_BROADCAST_LENGTH),
+        )
+        return states.BroadcastWait
+    if user.students_group_id is None:
+        update.message.reply_text(text="Спершу оберіть свою групу: /change_group")
+        return end(update=update, ctx=ctx)
+
+    item = Broadcast(students_group_id=user.students_group_id, author_id=user.tg_id,
+                     message=message)
+    session.add(item)
+    session.flush()
+    # recipients are created with a single INSERT ... SELECT
+    recipients = session.execute(
+        insert(BroadcastRecipient).from_select(
+            ["broadcast_id", "user_id", "status"],
+            select(literal(item.id), User.tg_id, literal(BROADCAST_PENDING))
+            .where((User.students_group_id == user.students_group_id) &
+                   (User.tg_id != user.tg_id)),
+        )
+    ).rowcount
+    if not recipients:
+        session.rollback()
+        update.message.reply_text(text="У вашій групі поки немає інших студентів")
+        return end(update=update, ctx=ctx)
+
+    broadcast_id = item.id
+    session.commit()
+    celery_app.send_task(SEND_BROADCAST_TASK, args=(broadcast_id,))
+    update.message.reply_text(
+        text=f"{E_ACCEPT} Повідомлення #{broadcast_id} буде надіслано {recipients} студентам. "
+             f"Після завершення ви отримаєте звіт.",
+    )
+    return end(update=update, ctx=ctx)
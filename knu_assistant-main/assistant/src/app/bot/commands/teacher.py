@@ -0,0 +1,171 @@
+import datetime as dt
+import logging
+from itertools import groupby
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, List
+
+from sqlalchemy.orm import Session
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import MAX_MESSAGE_LENGTH
+from telegram.ext import CallbackContext
+
+from app.bot.commands.timetable import WEEK_DAY_HEADER
+from app.bot.commands.utils import reply_or_edit, split_message
+from app.bot.decorators import acquire_cached_user, db_read_session, db_session
+from app.bot.dictionaries import states, week
+from app.bot.dictionaries.phrases import *
+from app.bot.keyboards import build_keyboard_menu
+from app.bot.users import UserSnapshot
+from app.timetable.models import SingleLessonRow, TeacherRow
+from app.timetable.teachers import (
+    get_groups_names,
+    get_teacher,
+    get_teacher_lessons_between,
+    search_teachers,
+)
+from app.utils import get_monday
+
+logger = logging.getLogger(__name__)
+__all__ = [
+    "show_teacher_timetable",
+]
+
+DAY = "day"
+WEEK = "week"
+
+TRUNCATED_NOTE = "<i>…розклад не вміщується в повідомлення, перегляньте його по днях</i>"
+
+
+def _slot(lesson: SingleLessonRow):
+    """ Lessons with the same slot are given to a few groups at once """
+    return (lesson.date, lesson.starts_at, lesson.ends_at, lesson.lesson.name,
+            lesson.lesson.lesson_format)
+
+
+def teacher_day_lines(lessons: Iterable[SingleLessonRow],
+                      groups_names: Dict[int, str]) -> Iterator[str]:
+    for idx, (_, slot_lessons) in enumerate(groupby(lessons, key=_slot)):
+        slot_lessons = list(slot_lessons)
+        lesson = slot_lessons[0]
+        if idx:
+            yield ""  # an empty line between lessons
+        yield "{} - {}".format(lesson.starts_at.strftime("%H:%M"),
+                               lesson.ends_at.strftime("%H:%M"))
+        yield "{} <b>{}</b> ({})".format(E_BOOKS, lesson.lesson.name,
+                                         lesson.lesson.represent_lesson_format())
+        yield "{} {}".format(E_GROUP, ", ".join(sorted(
+            groups_names.get(sl.lesson.students_group_id, "?") for sl in slot_lessons)))
+
+
+def teacher_week_lines(lessons: List[SingleLessonRow],
+                       groups_names: Dict[int, str]) -> Iterator[str]:
+    for idx, (date, day_lessons) in enumerate(groupby(lessons, key=attrgetter("date"))):
+        if idx:
+            yield ""  # an empty line between days
+        yield WEEK_DAY_HEADER.format(day=week.LIST[date.weekday()].name)
+        yield from teacher_day_lines(day_lessons, groups_names)
+
+
+def build_teacher_timetable(session: Session, teacher: TeacherRow, kind: str,
+                            date: dt.date) -> str:
+    """
+    :param kind: DAY or WEEK
+    :param date: the day or any day of the week
+    """
+    if kind == WEEK:
+        date_from = get_monday(date)
+        date_to = date_from + dt.timedelta(days=6)
+        header = "{} - {}".format(date_from.strftime("%d.%m"), date_to.strftime("%d.%m"))
+    else:
+        date_from = date_to = date
+        header = "{} ({})".format(week.LIST[date.weekday()].name, date.strftime("%d.%m"))
+
+    lessons = get_teacher_lessons_between(session, teacher.id, date_from, date_to)
+    groups_names = get_groups_names(
+        session, (lesson.lesson.students_group_id for lesson in lessons))
+    if kind == WEEK:
+        body = "\n".join(teacher_week_lines(lessons, groups_names))
+    else:
+        body = "\n".join(teacher_day_lines(lessons, groups_names))
+
+    text = "{} <b>{}</b>\n{}\n\n{}".format(E_TEACHER, teacher.full_name, header,
+                                           body or "Заняття відсутні")
+    if len(text) <= MAX_MESSAGE_LENGTH:
+        return text
+    # a week of a lecturer of many groups may not fit into a message
+    limit = MAX_MESSAGE_LENGTH - len(TRUNCATED_NOTE) - 2
+    return split_message(text, limit)[0] + "\n\n" + TRUNCATED_NOTE
+
+
+def build_teacher_keyboard(teacher_id: int, kind: str, date: dt.date) -> InlineKeyboardMarkup:
+    if kind == WEEK:
+        date = get_monday(date)
+        step, other_kind, other_text = dt.timedelta(days=7), DAY, "День"
+        # the day view of the current week starts from today
+        today = dt.date.today()
+        other_date = today if get_monday(today) == date else date
+    else:
+        step, other_kind, other_text = dt.timedelta(days=1), WEEK, "Тиждень"
+        other_date = date
+    previous, following = date - step, date + step
+    kb_buttons = [
+        InlineKeyboardButton(
+            text="< {}".format(previous.strftime("%d.%m.%Y")),
+            callback_data=states.TimetableTeacherSelection.build(
+                teacher_id, kind, previous.isoformat()),
+        ),
+        InlineKeyboardButton(
+            text=other_text,
+            callback_data=states.TimetableTeacherSelection.build(
+                teacher_id, other_kind, other_date.isoformat()),
+        ),
+        InlineKeyboardButton(
+            text="{} >".format(following.strftime("%d.%m.%Y")),
+            callback_data=states.TimetableTeacherSelection.build(
+                teacher_id, kind, following.isoformat()),
+        ),
+    ]
+    return InlineKeyboardMarkup(build_keyboard_menu(kb_buttons, 3))
+
+
+# `session` is used by acquire_cached_user only, to upsert the user on a cache miss;
+# a session connects lazily, so a cache hit never checks out a primary connection
+@db_session
+@db_read_session
+@acquire_cached_user
+def show_teacher_timetable(update: Update, ctx: CallbackContext, session: Session,
+                           read_session: Session, user: UserSnapshot):
+    """ /teacher <name>: teacher's timetable across all groups """
+    if update.callback_query:
+        requested = states.TimetableTeacherSelection.parse(update.callback_query.data)
+        if requested is None:
+            return None
+        teacher = get_teacher(read_session, int(requested.group(1)))
+        if teacher is None:
+            return None
+        kind = requested.group(2)
+        date = dt.datetime.strptime(requested.group(3), "%Y-%m-%d").date()
+    else:
+        query = " ".join(ctx.args or [])
+        if not query:
+            update.message.reply_text(text="Введіть прізвище викладача, наприклад:\n"
+                                           "/teacher Шевченко")
+            return None
+        teachers = search_teachers(read_session, query)
+        if not teachers:
+            update.message.reply_text(text="Викладача не знайдено")
+            return None
+        if len(teachers) > 1:
+            today = dt.date.today().isoformat()
+            keyboard = [[InlineKeyboardButton(
+                text=teacher.full_name,
+                callback_data=states.TimetableTeacherSelection.build(teacher.id, WEEK, today),
+            )] for teacher in teachers]
+            update.message.reply_text(text="Оберіть викладача:",
+                                      reply_markup=InlineKeyboardMarkup(keyboard))
+            return states.TimetableTeacherSelection
+        teacher, kind, date = teachers[0], WEEK, dt.date.today()
+
+    text = build_teacher_timetable(read_session, teacher, kind, date)
+    reply_or_edit(update, ctx, text, build_teacher_keyboard(teacher.id, kind, date))
+    return states.TimetableTeacherSelection
@@ -6,6 +6,7 @@ from telethon.tl.custom.message import Message
 
 from app.core.config import settings
 from app.bot.commands.tests.utils import flatten_keyboard
+from app.bot.dictionaries import states
 from app.database import User
 from app.tests.factories import (
     FacultyFactory,
@@ -54,7 +55,7 @@ class TestStart:
             kb = flatten_keyboard(r.buttons)
             assert "курс" in r.raw_text.lower()
             assert len(kb) == 1  # only 1st course is present
-            await r.click(data=b"1")
+            await r.click(data=states.UserSelectCourse.build(1).encode("utf-8"))
 
             # faculty choice
             r = await conv.get_edit()
@@ -62,7 +63,7 @@ class TestStart:
             assert "факультет" in r.raw_text.lower()
             assert len(kb) == 1  # only CSC is present
             # select "CSC"
-            await r.click(data=str(csc.id).encode("utf-8"))
+            await r.click(data=states.UserSelectFaculty.build(csc.id).encode("utf-8"))
 
             # group choice
             r = await conv.get_edit()
@@ -70,7 +71,7 @@ class TestStart:
             assert "груп" in r.raw_text.lower()
             assert len(kb) == 1  # ensure extra_groups are excluded from this list
             # select group
-            await r.click(data=str(group.id).encode("utf-8"))
+            await r.click(data=states.UserSelectGroup.build(group.id).encode("utf-8"))
 
             r = await conv.get_edit()
             assert r.text == "Групу встановлено!"
@@ -1,9 +1,14 @@
 import re
 
+import mock
+
 from app.bot.dictionaries import states
 from app.bot.dictionaries.phrases import *
 from app.bot.api import bot
-from app.tests.factories import RequestFactory, StudentsGroupFactory, UserFactory
+from app.tests.factories import LessonFactory, RequestFactory, StudentsGroupFactory, UserFactory
+from app.core.celery import app as celery_app
+from app.database import BroadcastRecipient
+from app.tests.queries import query_budget
 
 AcceptState = states.State("accept", "accept_{}", re.compile(r"^accept_(\d+)$"))
 RejectState = states.State("reject", "reject_{}", re.compile(r"^reject_(\d+)$"))
@@ -48,3 +53,92 @@ class TestSendRequest:
 #
 #     def test_accept(self, db_session):
 #         from app.bot.commands.moderation import accept_link_request
+
+
+class TestLinkRequestQueries:
+
+    def make_request(self, db_session):
+        group = StudentsGroupFactory()
+        moderator = UserFactory(students_group=group, is_group_moderator=True)
+        lesson = LessonFactory(students_group=group)
+        request = RequestFactory(
+            initiator=UserFactory(students_group=group),
+            moderator=moderator,
+            students_group=group,
+            meta={"lesson_id": lesson.id, "link": "https://zoom.us"},
+        )
+        db_session.commit()
+        ctx = mock.MagicMock()
+        ctx.match.group.return_value = str(request.id)
+        return request, moderator, ctx
+
+    def test_accept(self, db_session, mocker):
+        from app.bot.commands.moderation import accept_link_request
+        request, moderator, ctx = self.make_request(db_session)
+        send_message = mocker.patch.object(bot, "send_message")
+
+        # request, lesson and the commit
+        with query_budget(6):
+            accept_link_request(update=mock.MagicMock(), ctx=ctx,
+                                session=db_session, user=moderator)
+        assert send_message.call_args.args[0] == request.initiator_id
+
+    def test_reject(self, db_session, mocker):
+        from app.bot.commands.moderation import reject_link_request
+        request, moderator, ctx = self.make_request(db_session)
+        send_message = mocker.patch.object(bot, "send_message")
+
+        # request and the commit
+        with query_budget(5):
+            reject_link_request(update=mock.MagicMock(), ctx=ctx,
+                                session=db_session, user=moderator)
+        assert send_message.call_args.args[0] == request.initiator_id
+
+
+class TestBroadcast:
+
+    def test_broadcast_message(self, db_session, mocker):
+        from app.bot.commands.moderation import SEND_BROADCAST_TASK, broadcast_message
+        group = StudentsGroupFactory()
+        moderator = UserFactory(students_group=group, is_group_moderator=True)
+        students = [UserFactory(students_group=group) for _ in range(2)]
+        # another group
+        UserFactory()
+        db_session.commit()
+        send_task = mocker.patch.object(celery_app, "send_task")
+
+        update = mock.MagicMock()
+        update.message.text = "Пари не буде"
+        result = broadcast_message(update=update, ctx=mock.MagicMock(), session=db_session,
+                                   user=moderator)
+        assert result == states.END
+
+        broadcast_id = send_task.call_args.kwargs["args"][0]
+        assert send_task.call_args.args[0] == SEND_BROADCAST_TASK
+        recipients = db_session.query(BroadcastRecipient.user_id) \
+            .filter_by(broadcast_id=broadcast_id).all()
+        assert sorted(r.user_id for r in recipients) == sorted(s.tg_id for s in students)
+
+    def test_not_moderator(self, db_session, mocker):
+        from app.bot.commands.moderation import broadcast_message
+        user = UserFactory()
+        db_session.commit()
+        send_task = mocker.patch.object(celery_app, "send_task")
+
+        broadcast_message(update=mock.MagicMock(), ctx=mock.MagicMock(), session=db_session,
+                          user=user)
+        assert send_task.call_count == 0
+
+    def test_without_group(self, db_session, mocker):
+        from app.bot.commands.moderation import broadcast_message
+        moderator = UserFactory(students_group=None, is_group_moderator=True)
+        db_session.commit()
+        send_task = mocker.patch.object(celery_app, "send_task")
+
+        update = mock.MagicMock()
+        update.message.text = "Пари не буде"
+        result = broadcast_message(update=update, ctx=mock.MagicMock(), session=db_session,
+                                   user=moderator)
+        assert result == states.END
+        assert send_task.call_count == 0
+        assert "/change_group" in update.message.reply_text.call_args.kwargs["text"]
@@ -0,0 +1,88 @@
+import datetime as dt
+
+import mock
+
+from app.bot.dictionaries import states
+from app.bot.dictionaries.phrases import *
+from app.bot.users import UserSnapshot
+from app.tests.factories import (
+    LessonFactory,
+    SingleLessonFactory,
+    StudentsGroupFactory,
+    TeacherFactory,
+    UserFactory,
+)
+
+
+class TestTeacherTimetable:
+
+    def call(self, db_session, user, update, args=None):
+        from app.bot.commands.teacher import show_teacher_timetable
+        ctx = mock.MagicMock(args=args or [], chat_data={})
+        return show_teacher_timetable(update=update, ctx=ctx, session=db_session,
+                                      read_session=db_session,
+                                      user=UserSnapshot.from_user(db_session, user))
+
+    def test_week(self, db_session):
+        teacher = TeacherFactory(last_name="Шевченко")
+        groups = [StudentsGroupFactory(name="К-24"), StudentsGroupFactory(name="К-25")]
+        for group in groups:
+            SingleLessonFactory(lesson=LessonFactory(name="Math", students_group=group,
+                                                     teachers=[teacher]),
+                                date=dt.date.today(),
+                                starts_at=dt.time(8, 40), ends_at=dt.time(10, 15))
+        user = UserFactory(students_group=groups[0])
+        db_session.commit()
+
+        update = mock.MagicMock(callback_query=None)
+        result = self.call(db_session, user, update, ["шевченко"])
+        assert result == states.TimetableTeacherSelection
+        text = update.message.reply_text.call_args.kwargs["text"]
+        assert teacher.full_name in text
+        # a lecture of two groups is shown once
+        assert text.count("Math") == 1
+        assert f"{E_GROUP} К-24, К-25" in text
+
+    def test_truncated(self, db_session):
+        from app.bot.commands.teacher import TRUNCATED_NOTE
+        teacher = TeacherFactory(last_name="Шевченко")
+        for idx in range(10):
+            SingleLessonFactory(lesson=LessonFactory(name="Lesson {}".format(idx),
+                                                     teachers=[teacher]),
+                                date=dt.date.today(),
+                                starts_at=dt.time(8 + idx), ends_at=dt.time(9 + idx))
+        user = UserFactory()
+        db_session.commit()
+
+        update = mock.MagicMock(callback_query=None)
+        with mock.patch("app.bot.commands.teacher.MAX_MESSAGE_LENGTH", 300):
+            self.call(db_session, user, update, ["Шевченко"])
+        text = update.message.reply_text.call_args.kwargs["text"]
+        assert len(text) <= 300
+        assert text.endswith(TRUNCATED_NOTE)
+        assert "Lesson 0" in text
+        assert "Lesson 9" not in text
+
+    def test_day(self, db_session):
+        teacher = TeacherFactory()
+        user = UserFactory()
+        db_session.commit()
+
+        update = mock.MagicMock()
+        update.callback_query.data = states.TimetableTeacherSelection.build(
+            teacher.id, "day", "2021-02-01")
+        self.call(db_session, user, update)
+        text = update.callback_query.edit_message_text.call_args.kwargs["text"]
+        assert "Понеділок (01.02)" in text
+        assert "Заняття відсутні" in text
+
+    def test_many_teachers(self, db_session):
+        TeacherFactory(last_name="Шевченко")
+        TeacherFactory(last_name="Шевчук")
+        user = UserFactory()
+        db_session.commit()
+
+        update = mock.MagicMock(callback_query=None)
+        self.call(db_session, user, update, ["Шевч"])
+        keyboard = update.message.reply_text.call_args.kwargs["reply_markup"].inline_keyboard
+        assert len(keyboard) == 2
@@ -11,10 +11,13 @@ from app.bot.commands.tests.utils import flatten_keyboard
 from app.bot.commands.timetable import (
     build_timetable_day,
     build_timetable_lesson,
+    build_timetable_range,
     build_timetable_week,
+    split_days,
 )
 from app.bot.dictionaries import states
 from app.bot.dictionaries.phrases import *
+from app.bot.users import UserSnapshot
 from app.tests.factories import (
     LessonFactory,
     SingleLessonFactory,
@@ -22,6 +25,7 @@ from app.tests.factories import (
     TeacherFactory,
     UserFactory,
 )
+from app.tests.queries import query_budget
 
 
 class TestTimetableBuilders:
@@ -33,10 +37,9 @@ class TestTimetableBuilders:
             ends_at=dt.time(hour=11, minute=30, second=0),
         )
         lesson = single_lesson.lesson
-        user = UserFactory(students_group=single_lesson.lesson.students_group)
         db_session.commit()
 
-        result = build_timetable_lesson(db_session, user, single_lesson)
+        result = build_timetable_lesson(single_lesson)
 
         assert result == f"""\
 10:00 - 11:30
@@ -106,6 +109,24 @@ class TestTimetableBuilders:
 Встановити посилання: /link@{programming_1.id}\
 """
 
+    def test_build_timetable_day_queries(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        date = dt.date(year=2021, month=1, day=26)
+        for hour in range(8, 14):
+            SingleLessonFactory(
+                lesson=LessonFactory(teachers=[TeacherFactory(), TeacherFactory()],
+                                     students_group=group),
+                date=date,
+                starts_at=dt.time(hour),
+                ends_at=dt.time(hour, 45),
+            )
+        db_session.commit()
+
+        # lessons and their teachers, regardless of the number of lessons
+        with query_budget(2):
+            build_timetable_day(db_session, user, date)
+
     def test_build_timetable_week(self, db_session):
         group = StudentsGroupFactory()
         user = UserFactory(students_group=group)
@@ -123,11 +144,9 @@ class TestTimetableBuilders:
         )
         db_session.commit()
 
-        with mock.patch("app.bot.commands.timetable.build_timetable_day",
-                        side_effect=build_timetable_day) as build_day_mock:
-            # from app.bot.commands.timetable import build_timetable_week, build_timetable_day
+        # a single range query (and teachers of its lessons) for the whole week
+        with query_budget(2):
             result = build_timetable_week(db_session, user, monday)
-            assert build_day_mock.call_count == 7
         assert result == f"""\
 [ <b>Понеділок</b> ]
 08:40 - 10:15
@@ -136,6 +155,247 @@ class TestTimetableBuilders:
 Встановити посилання: /link@{math.id}\
 """
 
+    def test_build_timetable_range(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        math = LessonFactory(name="M", lesson_format=0, students_group=group)
+        for date in [dt.date(2021, 2, 1), dt.date(2021, 2, 28), dt.date(2021, 3, 1)]:
+            SingleLessonFactory(lesson=math, date=date,
+                                starts_at=dt.time(8, 40), ends_at=dt.time(10, 15))
+        db_session.commit()
+
+        with query_budget(2):
+            result = build_timetable_range(db_session, user,
+                                           dt.date(2021, 2, 1), dt.date(2021, 2, 28))
+        lesson = f"""\
+08:40 - 10:15
+{E_BOOKS} <b>M</b> ({math.represent_lesson_format()})
+{E_TEACHER} {math.teachers[0].short_name}
+Встановити посилання: /link@{math.id}\
+"""
+        assert result == \
+            f"[ <b>Понеділок</b>, 01.02 ]\n{lesson}\n\n[ <b>Неділя</b>, 28.02 ]\n{lesson}"
+
+
+class TestSplitDays:
+
+    def test_whole_days(self):
+        first = "[ <b>Пн</b> ]\n08:00\n\n10:00"
+        second = "[ <b>Вт</b> ]\n08:00"
+        text = "\n\n".join([first, second])
+        assert split_days(text, limit=100) == [text]
+        assert split_days(text, limit=len(first) + 1) == [first, second]
+        assert split_days("", limit=100) == []
+
+    def test_long_day(self):
+        text = "[ <b>Пн</b> ]\n08:00\n\n10:00\n\n12:00\n\n[ <b>Вт</b> ]\n08:00"
+        assert split_days(text, limit=30) == [
+            "[ <b>Пн</b> ]\n08:00\n\n10:00",
+            "[ <b>Пн</b> ]\n12:00",
+            "[ <b>Вт</b> ]\n08:00",
+        ]
+
+
+class TestMonthTimetable:
+
+    def show(self, db_session, user: UserSnapshot, data=None):
+        from app.bot.commands.timetable import show_month_timetable
+        update = mock.MagicMock()
+        if data is None:
+            update.callback_query = None
+        else:
+            update.callback_query.data = data
+        output = show_month_timetable(update=update, ctx=mock.MagicMock(), session=db_session,
+                                      read_session=db_session, user=user)
+        assert output == states.TimetableMonthSelection
+        message = update.message.reply_text if data is None \
+            else update.callback_query.edit_message_text
+        return message.call_args.kwargs
+
+    def test_month(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        lesson = LessonFactory(name="M", students_group=group)
+        for day in [1, 15]:
+            SingleLessonFactory(lesson=lesson, date=dt.date(2021, 2, day))
+        db_session.commit()
+        user = UserSnapshot.from_user(db_session, user)
+
+        with query_budget(2):
+            message = self.show(db_session, user,
+                                states.TimetableMonthSelection.build("2021-02", 0))
+        assert message["text"].startswith(
+            "<b>Лютий 2021</b>\n\n[ <b>Понеділок</b>, 01.02 ]")
+        assert "[ <b>Понеділок</b>, 15.02 ]" in message["text"]
+        buttons = flatten_keyboard(message["reply_markup"].inline_keyboard)
+        assert [b.callback_data for b in buttons] == [
+            states.TimetableMonthSelection.build("2021-01", 0),
+            states.TimetableMonthSelection.build(dt.date.today().strftime("%Y-%m"), 0),
+            states.TimetableMonthSelection.build("2021-03", 0),
+        ]
+
+    def test_pages(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        lesson = LessonFactory(name="M" * 200, students_group=group)
+        for day in range(1, 29):
+            for hour in [8, 10, 12]:
+                SingleLessonFactory(lesson=lesson, date=dt.date(2021, 2, day),
+                                    starts_at=dt.time(hour), ends_at=dt.time(hour + 1))
+        db_session.commit()
+        user = UserSnapshot.from_user(db_session, user)
+
+        first_page = self.show(db_session, user,
+                               states.TimetableMonthSelection.build("2021-02", 0))
+        assert len(first_page["text"]) <= 4096
+        assert first_page["text"].startswith("<b>Лютий 2021</b> (1/")
+        page_button = first_page["reply_markup"].inline_keyboard[0][0]
+        assert page_button.callback_data == states.TimetableMonthSelection.build("2021-02", 1)
+
+        # pages are served from the cache
+        with query_budget(0):
+            second_page = self.show(db_session, user, page_button.callback_data)
+        assert second_page["text"].startswith("<b>Лютий 2021</b> (2/")
+        # a page never starts in the middle of a day
+        assert second_page["text"].split("\n\n", 1)[1].startswith("[ <b>")
+
+    def test_empty_month(self, db_session):
+        user = UserFactory(students_group=StudentsGroupFactory())
+        db_session.commit()
+        message = self.show(db_session, UserSnapshot.from_user(db_session, user))
+        assert message["text"].endswith("В цьому місяці немає занять")
+
+
+class TestNowNext:
+
+    def call(self, handler, db_session, user, now: dt.datetime):
+        update = mock.MagicMock()
+        with mock.patch("app.bot.commands.timetable.dt") as dt_mock:
+            dt_mock.datetime.now.return_value = now
+            handler(update=update, ctx=mock.MagicMock(), session=db_session,
+                    read_session=db_session, user=UserSnapshot.from_user(db_session, user))
+        return update.message.reply_text.call_args.kwargs["text"]
+
+    def test_now_and_next(self, db_session):
+        from app.bot.commands.timetable import show_current_lesson, show_next_lesson
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        math = LessonFactory(name="M", students_group=group)
+        # another subgroup
+        LessonFactory(name="P", subgroup="2", students_group=group)
+        SingleLessonFactory(lesson=math, date=dt.date(2021, 2, 1),
+                            starts_at=dt.time(8, 40), ends_at=dt.time(10, 15))
+        SingleLessonFactory(lesson=math, date=dt.date(2021, 2, 3),
+                            starts_at=dt.time(10, 35), ends_at=dt.time(12, 10))
+        db_session.commit()
+
+        monday_morning = dt.datetime(2021, 2, 1, 9)
+        text = self.call(show_current_lesson, db_session, user, monday_morning)
+        assert text.startswith("<b>Зараз</b>\n\n08:40 - 10:15\n")
+
+        text = self.call(show_next_lesson, db_session, user, monday_morning)
+        assert text.startswith("<b>Наступне заняття</b> (Середа, 03.02)\n\n10:35 - 12:10\n")
+
+        text = self.call(show_current_lesson, db_session, user, dt.datetime(2021, 2, 1, 11))
+        assert text == "Зараз занять немає"
+        text = self.call(show_next_lesson, db_session, user, dt.datetime(2021, 2, 3, 13))
+        assert text == "Найближчого тижня занять немає"
+
+
+class TestPrefetch:
+
+    def test_day_prefetch(self, db_session, mocker):
+        from app.bot.commands.timetable import (
+            prefetch_timetables,
+            render_day_message,
+            show_day_timetable,
+        )
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        tomorrow = dt.date.today() + dt.timedelta(days=1)
+        SingleLessonFactory(lesson=LessonFactory(name="Math", students_group=group),
+                            date=tomorrow)
+        db_session.commit()
+        snapshot = UserSnapshot.from_user(db_session, user)
+
+        update = mock.MagicMock(callback_query=None)
+        ctx = mock.MagicMock()
+        show_day_timetable(update=update, ctx=ctx, session=db_session,
+                           read_session=db_session, user=snapshot)
+        func, *args = ctx.dispatcher.run_async.call_args.args
+        assert func is prefetch_timetables
+        assert args == [render_day_message, snapshot,
+                        (dt.date.today() - dt.timedelta(days=1), tomorrow)]
+
+        session_scope = mocker.patch("app.bot.commands.timetable.session_scope")
+        session_scope.return_value.__enter__.return_value = db_session
+        prefetch_timetables(*args)
+
+        # the next day is served from the cache
+        with query_budget(0):
+            assert "Math" in render_day_message(db_session, snapshot, tomorrow)
+
+
+class TestInlineQuery:
+
+    def call(self, db_session, user, query: str) -> mock.MagicMock:
+        from app.bot.commands.timetable import timetable_inline_query
+        update = mock.MagicMock()
+        update.inline_query.query = query
+        timetable_inline_query(update=update, ctx=mock.MagicMock(), session=db_session,
+                               read_session=db_session,
+                               user=UserSnapshot.from_user(db_session, user))
+        return update.inline_query.answer
+
+    def test_results(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        lesson = LessonFactory(name="Math", students_group=group)
+        SingleLessonFactory(lesson=lesson, date=dt.date.today(),
+                            starts_at=dt.time(8, 40), ends_at=dt.time(10, 15))
+        db_session.commit()
+
+        answer = self.call(db_session, user, "")
+        results = answer.call_args.args[0]
+        assert [result.id for result in results] == ["day", "tomorrow", "week"]
+        assert answer.call_args.kwargs["is_personal"] is True
+        assert "Math" in results[0].input_message_content.message_text
+        assert "Заняття відсутні" in results[1].input_message_content.message_text
+        assert "Math" in results[2].input_message_content.message_text
+
+        results = self.call(db_session, user, "Зав").call_args.args[0]
+        assert [result.id for result in results] == ["tomorrow"]
+
+    def test_no_group(self, db_session):
+        user = UserFactory(students_group=None)
+        db_session.commit()
+
+        answer = self.call(db_session, user, "")
+        assert answer.call_args.args[0] == []
+        assert answer.call_args.kwargs["switch_pm_parameter"] == "start"
+
+
+class TestSendCalendar:
+
+    def test_send_calendar(self, db_session):
+        from app.bot.commands.timetable import send_calendar
+        from app.timetable.ics import calendar_token
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        SingleLessonFactory(lesson=LessonFactory(students_group=group), date=dt.date.today())
+        db_session.commit()
+
+        update = mock.MagicMock()
+        with mock.patch.object(settings, "CALENDAR_URL", "https://example.com/"):
+            send_calendar(update=update, ctx=mock.MagicMock(), session=db_session,
+                          read_session=db_session,
+                          user=UserSnapshot.from_user(db_session, user))
+        kwargs = update.message.reply_document.call_args.kwargs
+        assert kwargs["document"].filename == "timetable.ics"
+        assert kwargs["document"].input_file_content.count(b"BEGIN:VEVENT") == 1
+        assert "https://example.com/calendar/{}/{}.ics".format(
+            user.tg_id, calendar_token(user.tg_id)) in kwargs["caption"]
+
 
 class TestTimetableCommands:
 
@@ -1,11 +1,14 @@
 import asyncio
 
+import mock
 from pytest import mark
 from telethon import TelegramClient
 from telethon.tl.custom.message import Message
 
 from app.core.config import settings
+from app.bot.api import bot
 from app.bot.commands.tests.utils import flatten_keyboard
+from app.bot.dictionaries import states
 from app.database import LessonSubgroupMember
 from app.tests.factories import (
     FacultyFactory,
@@ -14,6 +17,7 @@ from app.tests.factories import (
     TeacherFactory,
     UserFactory,
 )
+from app.tests.queries import query_budget
 
 
 class TestChangeGroup:
@@ -61,7 +65,7 @@ class TestChangeGroup:
             kb = flatten_keyboard(r.buttons)
             assert "курс" in r.raw_text.lower()
             assert len(kb) == 2 + 1  # 1st and 2nd courses + END button
-            await r.click(data=b"1")
+            await r.click(data=states.UserSelectCourse.build(1).encode("utf-8"))
 
             # faculty choice
             r = await conv.get_edit()
@@ -69,7 +73,7 @@ class TestChangeGroup:
             assert "факультет" in r.raw_text.lower()
             assert len(kb) == 2 + 1  # csc and extra_faculty + END button
             # select "CSC"
-            await r.click(data=str(csc.id).encode("utf-8"))
+            await r.click(data=states.UserSelectFaculty.build(csc.id).encode("utf-8"))
 
             # group choice
             r = await conv.get_edit()
@@ -77,7 +81,7 @@ class TestChangeGroup:
             assert "груп" in r.raw_text.lower()
             assert len(kb) == 1 + 1  # ensure extra_groups are excluded from this list + END button
             # select group
-            await r.click(data=str(group.id).encode("utf-8"))
+            await r.click(data=states.UserSelectGroup.build(group.id).encode("utf-8"))
 
             r = await conv.get_edit()
             assert r.text == "Групу встановлено!"
@@ -140,19 +144,19 @@ class TestChangeGroup:
             # course choice
             r = await conv.get_response()
             kb = flatten_keyboard(r.buttons)
-            await r.click(data=b"1")
+            await r.click(data=states.UserSelectCourse.build(1).encode("utf-8"))
 
             # faculty choice
             r = await conv.get_edit()
             kb = flatten_keyboard(r.buttons)
             # select "CSC"
-            await r.click(data=str(csc.id).encode("utf-8"))
+            await r.click(data=states.UserSelectFaculty.build(csc.id).encode("utf-8"))
 
             # group choice
             r = await conv.get_edit()
             kb = flatten_keyboard(r.buttons)
             # select group
-            await r.click(data=str(group.id).encode("utf-8"))
+            await r.click(data=states.UserSelectGroup.build(group.id).encode("utf-8"))
 
             r = await conv.get_edit()
             assert r.text == "Групу встановлено!"
@@ -184,15 +188,15 @@ class TestChangeGroup:
 
             # course choice
             r = await conv.get_response()
-            await r.click(data=b"1")
+            await r.click(data=states.UserSelectCourse.build(1).encode("utf-8"))
 
             # faculty choice
             r = await conv.get_edit()
-            await r.click(data=str(csc.id).encode("utf-8"))
+            await r.click(data=states.UserSelectFaculty.build(csc.id).encode("utf-8"))
 
             # group choice
             r = await conv.get_edit()
-            await r.click(data=str(group.id).encode("utf-8"))
+            await r.click(data=states.UserSelectGroup.build(group.id).encode("utf-8"))
 
             # "Group was set" notification
             r = await conv.get_edit()
@@ -219,3 +223,105 @@ class TestChangeGroup:
             # Ensure user left the conversation and is able to send /change_group command once again
             await conv.send_message("/change_group")
             await conv.get_response()
+
+
+class TestSelectSubgroups:
+
+    def test_queries(self, db_session, mocker):
+        from app.bot.commands.user import select_subgroups
+        group = StudentsGroupFactory()
+        for subgroup in ["1", "2", "3"]:
+            LessonFactory(teachers=[TeacherFactory(), TeacherFactory()], subgroup=subgroup,
+                          name="M", lesson_format=1, students_group=group)
+        user = UserFactory(students_group=None)
+        db_session.commit()
+
+        update = mock.MagicMock()
+        update.callback_query = None
+        ctx = mock.MagicMock()
+        ctx.user_data = {"group_id": group.id}
+        send_message = mocker.patch.object(bot, "send_message")
+
+        # remaining lessons, subgroups of the first one and their teachers
+        with query_budget(3):
+            select_subgroups(update=update, ctx=ctx, session=db_session, user=user)
+
+        keyboard = send_message.call_args.kwargs["reply_markup"].inline_keyboard
+        assert len(flatten_keyboard(keyboard)) == 3
+
+    def test_attach_queries(self, db_session):
+        from app.bot.commands.user import select_subgroups
+        group = StudentsGroupFactory()
+        lessons = [LessonFactory(subgroup=subgroup, name=name, lesson_format=1,
+                                 students_group=group)
+                   for name in ["M", "P"] for subgroup in ["1", "2"]]
+        user = UserFactory(students_group=None)
+        db_session.commit()
+
+        update = mock.MagicMock()
+        update.callback_query = None
+        ctx = mock.MagicMock()
+        ctx.user_data = {"group_id": group.id, "subgroups": [lessons[0], lessons[2]]}
+
+        # chosen lessons are attached with a single query, however many there are
+        with query_budget(8):
+            select_subgroups(update=update, ctx=ctx, session=db_session, user=user)
+
+        db_session.refresh(user)
+        assert user.students_group == group
+        assert sorted(lesson.id for lesson in user.subgroups) == [lessons[0].id, lessons[2].id]
+
+
+class TestSearchGroup:
+
+    def call(self, db_session, user, text, user_data=None):
+        from app.bot.commands.user import search_group
+        update = mock.MagicMock()
+        update.message.text = text
+        update.effective_user.id = user.tg_id
+        ctx = mock.MagicMock(user_data=user_data if user_data is not None else {})
+        with query_budget(1):
+            result = search_group(update=update, ctx=ctx, session=db_session,
+                                  read_session=db_session, user=user)
+        return result, update.message.reply_text
+
+    def test_search(self, db_session):
+        faculty = FacultyFactory(shortcut="CSC")
+        group = StudentsGroupFactory(name="К-24", course=2, faculty=faculty)
+        StudentsGroupFactory(name="К-25", faculty=faculty)
+        user = UserFactory(students_group=None)
+        db_session.commit()
+
+        result, reply_text = self.call(db_session, user, "к24")
+        assert result == states.UserSelectGroup
+        keyboard = flatten_keyboard(reply_text.call_args.kwargs["reply_markup"].inline_keyboard)
+        # the exact match goes first
+        assert keyboard[0].text == "К-24 (2 курс, CSC)"
+        assert keyboard[0].callback_data == states.UserSelectGroup.build(group.id)
+
+    def test_previous_keyboard_removed(self, db_session, mocker):
+        StudentsGroupFactory(name="К-24")
+        user = UserFactory(students_group=None)
+        db_session.commit()
+        edit_message_reply_markup = mocker.patch.object(bot, "edit_message_reply_markup")
+
+        user_data = {"wizard_message_id": 10}
+        _, reply_text = self.call(db_session, user, "К-24", user_data)
+        # courses, offered by the previous message, can not be selected anymore
+        edit_message_reply_markup.assert_called_once_with(user.tg_id, 10, reply_markup=None)
+        assert user_data["wizard_message_id"] == reply_text.return_value.message_id
+
+    def test_stale_course_button(self):
+        """ A course button is not taken for a group with the same id """
+        data = states.UserSelectCourse.build(1)
+        assert states.UserSelectCourse.parse(data).group(1) == "1"
+        assert states.UserSelectFaculty.parse(data) is None
+        assert states.UserSelectGroup.parse(data) is None
+
+    def test_not_found(self, db_session):
+        user = UserFactory(students_group=None)
+        db_session.commit()
+
+        result, reply_text = self.call(db_session, user, "Ж-99")
+        assert result is None
+        assert reply_text.call_args.args[0] == "Такої групи не знайдено, спробуй ще раз"
@@ -12,3 +12,65 @@ class TestEnd:
         result = end(update=update, ctx=ctx)
         assert ctx.user_data.clear.call_count == 1
         assert result == states.END
+
+
+class TestSplitMessage:
+
+    def test_short(self):
+        from app.bot.commands.utils import split_message
+        assert split_message("a\n\nb") == ["a\n\nb"]
+        assert split_message("") == []
+
+    def test_by_paragraphs(self):
+        from app.bot.commands.utils import split_message
+        text = "\n\n".join(["aaa", "bbb", "ccc\nddd", "eee"])
+        assert split_message(text, limit=10) == ["aaa\n\nbbb", "ccc\nddd", "eee"]
+
+    def test_long_paragraph(self):
+        from app.bot.commands.utils import split_message
+        assert split_message("a\n\n" + "b" * 25, limit=10) == ["a", "b" * 10, "b" * 10, "b" * 5]
+
+
+class TestReplyOrEdit:
+
+    def make_callback(self, message_id=1):
+        update = mock.MagicMock()
+        update.callback_query.message.message_id = message_id
+        ctx = mock.MagicMock(chat_data={})
+        return update, ctx
+
+    def test_skips_unchanged(self):
+        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+        from app.bot.commands.utils import reply_or_edit
+        update, ctx = self.make_callback()
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("a", callback_data="a")]])
+
+        assert reply_or_edit(update, ctx, "text", keyboard)
+        assert not reply_or_edit(update, ctx, "text", keyboard)
+        assert update.callback_query.edit_message_text.call_count == 1
+
+        # the keyboard is a part of the message
+        other_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("b", callback_data="b")]])
+        assert reply_or_edit(update, ctx, "text", other_keyboard)
+        assert update.callback_query.edit_message_text.call_count == 2
+
+    def test_reply_is_remembered(self):
+        from telegram import InlineKeyboardMarkup
+        from app.bot.commands.utils import reply_or_edit
+        update, ctx = self.make_callback()
+        update.callback_query = None
+        update.message.reply_text.return_value.message_id = 1
+        assert reply_or_edit(update, ctx, "text", InlineKeyboardMarkup([]))
+
+        update, _ = self.make_callback()
+        assert not reply_or_edit(update, ctx, "text", InlineKeyboardMarkup([]))
+        assert update.callback_query.edit_message_text.call_count == 0
+
+    def test_fingerprints_are_bounded(self):
+        from telegram import InlineKeyboardMarkup
+        from app.bot.commands.utils import MAX_FINGERPRINTS, reply_or_edit
+        ctx = mock.MagicMock(chat_data={})
+        for message_id in range(MAX_FINGERPRINTS + 5):
+            update, _ = self.make_callback(message_id)
+            reply_or_edit(update, ctx, "text", InlineKeyboardMarkup([]))
+        assert list(ctx.chat_data["fingerprints"]) == list(range(5, MAX_FINGERPRINTS + 5))
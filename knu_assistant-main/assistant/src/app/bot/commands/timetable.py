@@ -1,102 +1,392 @@
 import datetime as dt
+import io
 import logging
 import random
-import re
+from itertools import groupby
+from operator import attrgetter
+from typing import Callable, Iterable, Iterator, List, Optional
 
-import telegram as tg
 from sqlalchemy.orm import Session
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputFile,
+    InputTextMessageContent,
+    ParseMode,
+    Update,
+)
+from telegram.constants import MAX_MESSAGE_LENGTH
 from telegram.ext import CallbackContext
 
 from app.bot.commands.moderation import send_request
-from app.bot.commands.utils import end
-from app.bot.decorators import acquire_user, db_session
-from app.bot.dictionaries import states, week
+from app.bot.commands.utils import end, reply_or_edit, split_message
+from app.bot.decorators import acquire_cached_user, acquire_user, db_read_session, db_session
+from app.bot.dictionaries import months, states, week
 from app.bot.dictionaries.phrases import *
 from app.bot.keyboards import build_keyboard_menu
-from app.database import Lesson, LessonSubgroupMember, Request, SingleLesson, User
-from app.utils import get_monday
+from app.bot.users import UserSnapshot
+from app.core.config import settings
+from app.database import (
+    Lesson,
+    LessonSubgroupMember,
+    ReadSession,
+    Request,
+    User,
+    session_scope,
+)
+from app.timetable.cache import DAY, MONTH, WEEK, timetable_cache
+from app.timetable.calendar_server import CALENDAR_NAME, calendar_path
+from app.timetable.fragments import lesson_fragments
+from app.timetable.ics import build_feed, calendar_token, encode_lines
+from app.timetable.index import lessons_index
+from app.timetable.models import LessonRow, SingleLessonRow
+from app.timetable.queries import get_day_lessons, get_lessons_between
+from app.utils import get_monday, get_month_bounds
 
 logger = logging.getLogger(__name__)
-__all__ = ["show_week_timetable", "show_day_timetable", "link", "set_lesson_link", "build_timetable_day"]
-
-ENDING_SPACES_MASK = re.compile(r"^(.*)(?<!\s)(\s+)$", flags=re.S)
-
-
-def build_timetable_lesson(session: Session, user: User, lesson: SingleLesson):
-    teachers_names = [t.short_name for t in lesson.lesson.teachers]
-    teachers_formatted = "{emoji} {teachers}".format(emoji=E_TEACHER,
-                                                     teachers=f"{E_TEACHER} ".join(teachers_names))
-    result_str = """\
-{starts_at} - {ends_at}
-{e_books} <b>{name}</b> ({format})
-{teachers}\n\
-""".format(
-        e_clock=E_CLOCK, starts_at=lesson.starts_at.strftime("%H:%M"),
-        ends_at=lesson.ends_at.strftime("%H:%M"),
-        e_books=E_BOOKS, name=lesson.lesson.name, format=lesson.lesson.represent_lesson_format(),
-        teachers=teachers_formatted
-    )
-    if lesson.lesson.link:
-        result_str += "<a href=\"{}\"><u><i>Посилання на урок</i></u></a>. Змінити: /link@{}\n" \
-            .format(lesson.lesson.link, lesson.lesson_id)
+__all__ = [
+    "timetable_inline_query",
+    "send_calendar",
+    "show_current_lesson",
+    "show_next_lesson",
+    "show_month_timetable",
+    "show_week_timetable",
+    "show_day_timetable",
+    "link",
+    "set_lesson_link",
+    "build_timetable_day",
+]
+
+
+# Renderers produce lines, which are joined once, so the output is never copied
+# and has no trailing whitespace by construction
+def render_lesson_body(lesson: LessonRow) -> str:
+    """ Part of a lesson, which does not depend on the date and time """
+    lines = [
+        "{} <b>{}</b> ({})".format(E_BOOKS, lesson.name, lesson.represent_lesson_format()),
+        "{} {}".format(E_TEACHER, f"{E_TEACHER} ".join(t.short_name for t in lesson.teachers)),
+    ]
+    if lesson.link:
+        lines.append("<a href=\"{}\"><u><i>Посилання на урок</i></u></a>. Змінити: /link@{}"
+                     .format(lesson.link, lesson.id))
     else:
-        result_str += "Встановити посилання: /link@{}\n" \
-            .format(lesson.lesson_id)
+        lines.append("Встановити посилання: /link@{}".format(lesson.id))
+    return "\n".join(lines)
+
+
+def lesson_lines(lesson: SingleLessonRow) -> Iterator[str]:
+    yield "{} - {}".format(lesson.starts_at.strftime("%H:%M"), lesson.ends_at.strftime("%H:%M"))
+    yield lesson_fragments.get_or_render(lesson.lesson, render_lesson_body)
 
     # if lesson.comment:
-    #     result_str += "<i>{} (/comment@{})</i>".format(lesson.comment, lesson.id)
+    #     yield "<i>{} (/comment@{})</i>".format(lesson.comment, lesson.id)
     # else:
-    #     result_str += "Додати коментар: /comment@{}".format(lesson.id)
-    result_str = ENDING_SPACES_MASK.sub(r"\1", result_str)  # remove \n in the ending
-    return result_str
+    #     yield "Додати коментар: /comment@{}".format(lesson.id)
+
+
+def day_lines(lessons: Iterable[SingleLessonRow]) -> Iterator[str]:
+    for idx, lesson in enumerate(lessons):
+        if idx:
+            yield ""  # an empty line between lessons
+        yield from lesson_lines(lesson)
+
+
+WEEK_DAY_HEADER = "[ <b>{day}</b> ]"
+MONTH_DAY_HEADER = "[ <b>{day}</b>, {date} ]"
+
+
+def week_lines(lessons: Iterable[SingleLessonRow],
+               day_header: str = WEEK_DAY_HEADER) -> Iterator[str]:
+    """
+    :param lessons: lessons, ordered by date
+    :param day_header: format of days headers with `day` (name) and `date` arguments
+    """
+    for idx, (date, day_lessons) in enumerate(groupby(lessons, key=attrgetter("date"))):
+        if idx:
+            yield ""  # an empty line between days
+        yield day_header.format(day=week.LIST[date.weekday()].name, date=date.strftime("%d.%m"))
+        yield from day_lines(day_lessons)
+
+
+def split_days(timetable_str: str, limit: int) -> List[str]:
+    """
+    Splits a timetable, rendered by week_lines, into pages of whole days, so every page
+    starts with a day header. A day, longer than a page, is split by lessons
+    and its header is repeated on the following pages.
+    """
+    days = []
+    for paragraph in timetable_str.split("\n\n"):
+        if paragraph.startswith("[ <b>") or not days:
+            days.append([paragraph])
+        else:
+            days[-1].append(paragraph)
+
+    pages = []
+    for day in days:
+        day_str = "\n\n".join(day)
+        if pages and len(pages[-1]) + 2 + len(day_str) <= limit:
+            pages[-1] += "\n\n" + day_str
+            continue
+        day_header = day[0].split("\n", 1)[0]
+        pages.append(day[0])
+        for lesson in day[1:]:
+            if len(pages[-1]) + 2 + len(lesson) <= limit:
+                pages[-1] += "\n\n" + lesson
+            else:
+                pages.append("{}\n{}".format(day_header, lesson))
+    # a lesson is hardly ever longer than a page, but the limit must hold anyway
+    return [chunk for page in pages for chunk in split_message(page, limit=limit)]
+
+
+def build_timetable_lesson(lesson: SingleLessonRow):
+    return "\n".join(lesson_lines(lesson))
+
+
+def build_timetable_day(session: Session, user: User, date: dt.date,
+                        lessons: Optional[List[SingleLessonRow]] = None):
+    """
+    :param lessons: user's lessons on the date, if they are already loaded
+        (e.g. in bulk for many users)
+    """
+    if lessons is None:
+        lessons = get_day_lessons(session, user, date)
+    return "\n".join(day_lines(lessons))
 
 
-def build_timetable_day(session: Session, user: User, date: dt.date):
-    lessons = (
-        session.query(SingleLesson)
-        # join user's subgroups
-        .outerjoin(
-            LessonSubgroupMember,
-            LessonSubgroupMember.c.user_id == user.tg_id
-        )
-        # join user's not subdivided lessons
-        .join(
-            Lesson,
-            (Lesson.id == SingleLesson.lesson_id) &
-            ((Lesson.subgroup == None) | (Lesson.id == LessonSubgroupMember.c.lesson_id)) &
-            (Lesson.students_group_id == user.students_group_id)
-        )
-        .filter(
-            SingleLesson.date == date
-        )
-        .order_by("starts_at")
-        .all()
+def build_timetable_week(session: Session, user: User, monday: dt.date):
+    # the whole week is loaded at once, rows are ordered by date
+    lessons = get_lessons_between(session, user, monday, monday + dt.timedelta(days=6))
+    return "\n".join(week_lines(lessons))
+
+
+def build_timetable_range(session: Session, user: User, date_from: dt.date, date_to: dt.date):
+    """ Timetable from date_from to date_to inclusive, loaded with a single query """
+    lessons = get_lessons_between(session, user, date_from, date_to)
+    return "\n".join(week_lines(lessons, day_header=MONTH_DAY_HEADER))
+
+
+def render_day_message(session: Session, user: UserSnapshot, date: dt.date) -> str:
+    """ Day timetable with a header, served from the cache """
+    header = "<b>{day_name}</b> ({date})".format(day_name=week.LIST[date.weekday()].name,
+                                                 date=date.strftime("%d.%m"))
+    timetable_str = timetable_cache.get_or_render(
+        DAY, user.students_group_id, user.subgroups_ids, date,
+        lambda: build_timetable_day(session, user, date),
     )
-    result_str = ""
-    for lesson in lessons:
-        result_str += "{}\n\n".format(build_timetable_lesson(session, user, lesson))
-    result_str = ENDING_SPACES_MASK.sub(r"\1", result_str)  # remove \n in the ending
-    return result_str
+    if timetable_str.strip() == "":
+        timetable_str = "Заняття відсутні"
+    return "{header}\n\n{body}".format(header=header, body=timetable_str)
 
 
-def build_timetable_week(session: Session, user: User, monday: dt.date):
-    result_str = ""
-    for day_idx in range(7):
-        date = monday + dt.timedelta(days=day_idx)
-        lesson_details = build_timetable_day(session, user, date)
-        if lesson_details:
-            result_str += "[ <b>{day}</b> ]\n{lesson_details}\n\n".format(
-                day=week.LIST[date.weekday()].name,
-                lesson_details=lesson_details,
-            )
-    result_str = ENDING_SPACES_MASK.sub(r"\1", result_str)  # remove \n in the ending
-    return result_str
+def render_week_message(session: Session, user: UserSnapshot, monday: dt.date) -> str:
+    """ Week timetable, served from the cache """
+    timetable_str = timetable_cache.get_or_render(
+        WEEK, user.students_group_id, user.subgroups_ids, monday,
+        lambda: build_timetable_week(session, user, monday),
+    )
+    if timetable_str.strip() == "":
+        timetable_str = "На цьому тижні немає занять"
+    return timetable_str
+
+
+def prefetch_timetables(render: Callable[[Session, UserSnapshot, dt.date], str],
+                        user: UserSnapshot, dates: Iterable[dt.date]):
+    """
+    Renders timetables into the cache in advance, so a following navigation click
+    is served from the cache. Runs asynchronously with its own read session.
+    """
+    try:
+        with session_scope(ReadSession) as session:
+            for date in dates:
+                render(session, user, date)
+    except Exception:
+        logger.exception("failed to prefetch timetables of user %s", user.tg_id)
+
+
+# (result id, title, keywords) of inline query results
+INLINE_TIMETABLES = [
+    (DAY, "Сьогодні", ("сьогодні", "today", "day", "день")),
+    ("tomorrow", "Завтра", ("завтра", "tomorrow")),
+    (WEEK, "Тиждень", ("тиждень", "week")),
+]
 
 
 @db_session
-@acquire_user
-def show_week_timetable(update: Update, ctx: CallbackContext, session: Session, user: User):
+@db_read_session
+@acquire_cached_user
+def timetable_inline_query(update: Update, ctx: CallbackContext, session: Session,
+                           read_session: Session, user: UserSnapshot):
+    """ Shares user's timetable into any chat: @bot today | tomorrow | week """
+    if user.students_group_id is None:
+        update.inline_query.answer([], cache_time=0, is_personal=True,
+                                   switch_pm_text="Оберіть свою групу",
+                                   switch_pm_parameter="start")
+        return
+
+    query = update.inline_query.query.strip().lower()
+    today = dt.date.today()
+    results = []
+    for result_id, title, keywords in INLINE_TIMETABLES:
+        if query and not any(keyword.startswith(query) for keyword in keywords):
+            continue
+        if result_id == WEEK:
+            text = render_week_message(read_session, user, get_monday(today))
+        else:
+            date = today if result_id == DAY else today + dt.timedelta(days=1)
+            text = render_day_message(read_session, user, date)
+        results.append(InlineQueryResultArticle(
+            id=result_id,
+            title=title,
+            input_message_content=InputTextMessageContent(
+                # a message can not be split here, so too long timetables are cut
+                split_message(text)[0],
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True,
+            ),
+        ))
+    # timetables are personal (subgroups), but Telegram may reuse them for the same user
+    update.inline_query.answer(results, cache_time=settings.INLINE_QUERY_CACHE_TIME,
+                               is_personal=True)
+
+
+@db_session
+@db_read_session
+@acquire_cached_user
+def send_calendar(update: Update, ctx: CallbackContext, session: Session,
+                  read_session: Session, user: UserSnapshot):
+    """ Sends user's timetable as an .ics file and a link to subscribe to it """
+    if user.students_group_id is None:
+        update.message.reply_text(text="Спершу оберіть свою групу: /start")
+        return
+
+    feed = build_feed(read_session, timetable_cache, user, CALENDAR_NAME)
+    document = io.BytesIO()
+    for chunk in encode_lines(feed.lines):
+        document.write(chunk)
+    document.seek(0)
+
+    caption = "Імпортуйте файл у свій календар."
+    if settings.CALENDAR_URL:
+        url = settings.CALENDAR_URL.rstrip("/") + calendar_path(user.tg_id,
+                                                                calendar_token(user.tg_id))
+        caption += "\nАбо підпишіться на розклад, щоб він оновлювався автоматично:\n" + url
+    update.message.reply_document(
+        document=InputFile(document, filename="timetable.ics"),
+        caption=caption,
+    )
+
+
+@db_session
+@db_read_session
+@acquire_cached_user
+def show_current_lesson(update: Update, ctx: CallbackContext, session: Session,
+                        read_session: Session, user: UserSnapshot):
+    lessons = []
+    if user.students_group_id is not None:
+        lessons = lessons_index.current_lessons(read_session, user.students_group_id,
+                                                user.subgroups_ids, dt.datetime.now())
+    if lessons:
+        text = "<b>Зараз</b>\n\n{}".format("\n\n".join(
+            "\n".join(lesson_lines(lesson)) for lesson in lessons))
+    else:
+        text = "Зараз занять немає"
+    update.message.reply_text(text=text, parse_mode=ParseMode.HTML,
+                              disable_web_page_preview=True)
+
+
+@db_session
+@db_read_session
+@acquire_cached_user
+def show_next_lesson(update: Update, ctx: CallbackContext, session: Session,
+                     read_session: Session, user: UserSnapshot):
+    lesson = None
+    if user.students_group_id is not None:
+        lesson = lessons_index.next_lesson(read_session, user.students_group_id,
+                                           user.subgroups_ids, dt.datetime.now())
+    if lesson is not None:
+        text = "<b>Наступне заняття</b> ({day}, {date})\n\n{lesson}".format(
+            day=week.LIST[lesson.date.weekday()].name,
+            date=lesson.date.strftime("%d.%m"),
+            lesson="\n".join(lesson_lines(lesson)),
+        )
+    else:
+        text = "Найближчого тижня занять немає"
+    update.message.reply_text(text=text, parse_mode=ParseMode.HTML,
+                              disable_web_page_preview=True)
+
+
+@db_session
+@db_read_session
+@acquire_cached_user
+def show_month_timetable(update: Update, ctx: CallbackContext, session: Session,
+                         read_session: Session, user: UserSnapshot):
+    if not update.callback_query:
+        requested_date, page = dt.date.today(), 0
+    else:
+        requested = states.TimetableMonthSelection.parse(update.callback_query.data)
+        if requested is None:
+            return None
+        requested_date = dt.datetime.strptime(requested.group(1), "%Y-%m").date()
+        page = int(requested.group(2))
+
+    first_day, last_day = get_month_bounds(requested_date)
+    previous_month = get_month_bounds(first_day - dt.timedelta(days=1))[0]
+    next_month = last_day + dt.timedelta(days=1)
+
+    # the whole month is rendered once and then split into pages
+    timetable_str = timetable_cache.get_or_render(
+        MONTH, user.students_group_id, user.subgroups_ids, first_day,
+        lambda: build_timetable_range(read_session, user, first_day, last_day),
+    )
+    header = "<b>{month} {year}</b>".format(month=months.LIST[first_day.month - 1],
+                                            year=first_day.year)
+    pages = split_days(timetable_str, limit=MAX_MESSAGE_LENGTH - len(header) - 20) \
+        or ["В цьому місяці немає занять"]
+    page = min(page, len(pages) - 1)
+    if len(pages) > 1:
+        header += " ({}/{})".format(page + 1, len(pages))
+    timetable_str = "{header}\n\n{body}".format(header=header, body=pages[page])
+
+    month_key = first_day.strftime("%Y-%m")
+    kb_header = []
+    if page > 0:
+        kb_header.append(InlineKeyboardButton(
+            text="< Стор. {}".format(page),
+            callback_data=states.TimetableMonthSelection.build(month_key, page - 1),
+        ))
+    if page < len(pages) - 1:
+        kb_header.append(InlineKeyboardButton(
+            text="Стор. {} >".format(page + 2),
+            callback_data=states.TimetableMonthSelection.build(month_key, page + 1),
+        ))
+    kb_buttons = [
+        InlineKeyboardButton(
+            text="< {}".format(previous_month.strftime("%m.%Y")),
+            callback_data=states.TimetableMonthSelection.build(
+                previous_month.strftime("%Y-%m"), 0),
+        ),
+        InlineKeyboardButton(
+            text="Сьогодні",
+            callback_data=states.TimetableMonthSelection.build(
+                dt.date.today().strftime("%Y-%m"), 0),
+        ),
+        InlineKeyboardButton(
+            text="{} >".format(next_month.strftime("%m.%Y")),
+            callback_data=states.TimetableMonthSelection.build(next_month.strftime("%Y-%m"), 0),
+        ),
+    ]
+    keyboard = build_keyboard_menu(kb_buttons, 3, header_buttons=kb_header)
+
+    reply_or_edit(update, ctx, timetable_str, InlineKeyboardMarkup(keyboard))
+    return states.TimetableMonthSelection
+
+
+@db_session
+@db_read_session
+@acquire_cached_user
+def show_week_timetable(update: Update, ctx: CallbackContext, session: Session,
+                        read_session: Session, user: UserSnapshot):
     if not update.callback_query:
         requested_date = dt.date.today()
     else:
@@ -129,36 +419,21 @@ def show_week_timetable(update: Update, ctx: CallbackContext, session: Session,
     ]
     keyboard = build_keyboard_menu(kb_buttons, 3)
 
-    timetable_str = build_timetable_week(session, user, requested_monday)
-    if timetable_str.strip() == "":
-        timetable_str = "На цьому тижні немає занять"
+    timetable_str = render_week_message(read_session, user, requested_monday)
 
-    if not update.callback_query:
-        update.message.reply_text(
-            text=timetable_str,
-            parse_mode=ParseMode.HTML,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            disable_web_page_preview=True,
-        )
-    else:
-        update.callback_query.answer()
-        try:
-            update.callback_query.edit_message_text(
-                text=timetable_str,
-                parse_mode=ParseMode.HTML,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                disable_web_page_preview=True,
-            )
-        except tg.TelegramError as e:
-            # FIXME
-            if "Message is not modified" not in str(e):
-                raise e
+    reply_or_edit(update, ctx, timetable_str, InlineKeyboardMarkup(keyboard))
+
+    if user.students_group_id is not None:
+        ctx.dispatcher.run_async(prefetch_timetables, render_week_message, user,
+                                 (previous_monday, next_monday))
     return states.TimetableWeekSelection
 
 
 @db_session
-@acquire_user
-def show_day_timetable(update: Update, ctx: CallbackContext, session: Session, user: User):
+@db_read_session
+@acquire_cached_user
+def show_day_timetable(update: Update, ctx: CallbackContext, session: Session,
+                       read_session: Session, user: UserSnapshot):
     if not update.callback_query:
         requested_date = dt.date.today()
     else:
@@ -188,33 +463,13 @@ def show_day_timetable(update: Update, ctx: CallbackContext, session: Session, u
     ]
     keyboard = build_keyboard_menu(kb_buttons, 3)
 
-    header = "<b>{day_name}</b> ({date})".format(day_name=week.LIST[requested_date.weekday()].name,
-                                                 date=requested_date.strftime("%d.%m"))
-    timetable_str = build_timetable_day(session, user, requested_date)
-    if timetable_str.strip() == "":
-        timetable_str = "Заняття відсутні"
-    timetable_str = "{header}\n\n{body}".format(header=header, body=timetable_str)
+    timetable_str = render_day_message(read_session, user, requested_date)
 
-    if not update.callback_query:
-        update.message.reply_text(
-            text=timetable_str,
-            parse_mode=ParseMode.HTML,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            disable_web_page_preview=True,
-        )
-    else:
-        update.callback_query.answer()
-        try:
-            update.callback_query.edit_message_text(
-                text=timetable_str,
-                parse_mode=ParseMode.HTML,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                disable_web_page_preview=True,
-            )
-        except tg.TelegramError as e:
-            # FIXME
-            if "Message is not modified" not in str(e):
-                raise e
+    reply_or_edit(update, ctx, timetable_str, InlineKeyboardMarkup(keyboard))
+
+    if user.students_group_id is not None:
+        ctx.dispatcher.run_async(prefetch_timetables, render_day_message, user,
+                                 (yesterday, tomorrow))
     return states.TimetableDaySelection
 
 
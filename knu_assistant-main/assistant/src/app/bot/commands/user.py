@@ -2,24 +2,28 @@ import logging
 
 import sqlalchemy as sqa
 from sqlalchemy import func
-from sqlalchemy.orm import Session
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update
+from sqlalchemy.orm import Session, selectinload
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, TelegramError, Update
 from telegram.ext import CallbackContext
 
 from app.bot.commands.utils import end
-from app.bot.decorators import acquire_user, db_session
+from app.bot.decorators import acquire_user, db_read_session, db_session
 from app.bot.dictionaries import states
 from app.bot.dictionaries.phrases import *
 from app.bot.keyboards import build_keyboard_menu
+from app.bot.users import user_cache
 from app.bot.api import bot
 from app.database import Faculty, Lesson, StudentsGroup, User
+from app.timetable.groups import search_groups
 
 logger = logging.getLogger(__name__)
 
 
 @db_session
+@db_read_session
 @acquire_user
-def change_group(update: Update, ctx: CallbackContext, session: Session, user: User):
+def change_group(update: Update, ctx: CallbackContext, session: Session,
+                 read_session: Session, user: User):
     # Ask for a course
 
     if user.is_group_moderator:
@@ -31,11 +35,11 @@ def change_group(update: Update, ctx: CallbackContext, session: Session, user: U
         )
 
     kb_buttons = []
-    for course in session.query(StudentsGroup.course).distinct(StudentsGroup.course).order_by(
+    for course in read_session.query(StudentsGroup.course).distinct(StudentsGroup.course).order_by(
             StudentsGroup.course):
         kb_buttons.append(InlineKeyboardButton(
             text=course[0],
-            callback_data=course[0],
+            callback_data=states.UserSelectCourse.build(course[0]),
         ))
 
     kb_footer = None
@@ -43,26 +47,75 @@ def change_group(update: Update, ctx: CallbackContext, session: Session, user: U
         kb_footer = [InlineKeyboardButton(text=P_CANCEL, callback_data=states.END)]
 
     keyboard = build_keyboard_menu(kb_buttons, 4, footer_buttons=kb_footer)
-    bot.send_message(update.effective_user.id, "На якому курсі ти навчаєшся?",
-                     reply_markup=InlineKeyboardMarkup(keyboard))
+    message = bot.send_message(update.effective_user.id,
+                               "На якому курсі ти навчаєшся?\n"
+                               "Або просто напиши назву своєї групи, наприклад: К-24",
+                               reply_markup=InlineKeyboardMarkup(keyboard))
+    # the message is edited by further steps, until a group is searched by its name
+    ctx.user_data["wizard_message_id"] = message.message_id
     return states.UserSelectCourse
 
 
+def remove_wizard_keyboard(update: Update, ctx: CallbackContext):
+    """ Removes buttons of the previous step, which are replaced by a new message """
+    message_id = ctx.user_data.pop("wizard_message_id", None)
+    if message_id is None:
+        return
+    try:
+        bot.edit_message_reply_markup(update.effective_user.id, message_id, reply_markup=None)
+    except TelegramError as e:
+        # e.g. the message was deleted by the user
+        logger.warning("failed to remove keyboard of message %s: %s", message_id, str(e))
+
+
 @db_session
+@db_read_session
 @acquire_user
-def select_course(update: Update, ctx: CallbackContext, session: Session, user: User):
-    is_valid = session.query(
-        sqa.exists().where(StudentsGroup.course == update.callback_query.data)).scalar()
+def search_group(update: Update, ctx: CallbackContext, session: Session,
+                 read_session: Session, user: User):
+    """ Offers groups, matching the typed name, instead of selecting a course and a faculty """
+    groups = search_groups(read_session, update.message.text)
+    if not groups:
+        update.message.reply_text("Такої групи не знайдено, спробуй ще раз")
+        return None
+
+    kb_buttons = []
+    for group in groups:
+        kb_buttons.append(InlineKeyboardButton(
+            text="{} ({} курс, {})".format(group.name, group.course, group.faculty_shortcut),
+            callback_data=states.UserSelectGroup.build(group.id),
+        ))
+
+    kb_footer = None
+    if user.students_group_id is not None:
+        kb_footer = [InlineKeyboardButton(text=P_CANCEL, callback_data=states.END)]
+
+    keyboard = build_keyboard_menu(kb_buttons, 1, footer_buttons=kb_footer)
+    remove_wizard_keyboard(update, ctx)
+    message = update.message.reply_text("Обери свою групу",
+                                        reply_markup=InlineKeyboardMarkup(keyboard))
+    ctx.user_data["wizard_message_id"] = message.message_id
+    return states.UserSelectGroup
+
+
+@db_session
+@db_read_session
+@acquire_user
+def select_course(update: Update, ctx: CallbackContext, session: Session,
+                  read_session: Session, user: User):
+    course = states.UserSelectCourse.parse(update.callback_query.data).group(1)
+    is_valid = read_session.query(
+        sqa.exists().where(StudentsGroup.course == course)).scalar()
     if not is_valid:
         return  # TODO: handle error
-    ctx.user_data["course"] = update.callback_query.data
+    ctx.user_data["course"] = course
 
     # Ask for a faculty
     kb_buttons = []
-    for faculty in session.query(Faculty).order_by(Faculty.id):
+    for faculty in read_session.query(Faculty).order_by(Faculty.id):
         kb_buttons.append(InlineKeyboardButton(
             text=faculty.name,
-            callback_data=faculty.id,
+            callback_data=states.UserSelectFaculty.build(faculty.id),
         ))
 
     kb_footer = None
@@ -70,7 +123,6 @@ def select_course(update: Update, ctx: CallbackContext, session: Session, user:
         kb_footer = [InlineKeyboardButton(text=P_CANCEL, callback_data=states.END)]
 
     keyboard = build_keyboard_menu(kb_buttons, 4, footer_buttons=kb_footer)
-    update.callback_query.answer()
     update.callback_query.edit_message_text(
         "На якому факультеті?",
         reply_markup=InlineKeyboardMarkup(keyboard),
@@ -79,28 +131,31 @@ def select_course(update: Update, ctx: CallbackContext, session: Session, user:
 
 
 @db_session
+@db_read_session
 @acquire_user
-def select_faculty(update: Update, ctx: CallbackContext, session: Session, user: User):
-    is_valid = session.query(sqa.exists().where(Faculty.id == update.callback_query.data)).scalar()
+def select_faculty(update: Update, ctx: CallbackContext, session: Session,
+                   read_session: Session, user: User):
+    faculty_id = states.UserSelectFaculty.parse(update.callback_query.data).group(1)
+    is_valid = read_session.query(
+        sqa.exists().where(Faculty.id == faculty_id)).scalar()
     if not is_valid:
         return  # TODO: handle error
-    ctx.user_data["faculty_id"] = update.callback_query.data
+    ctx.user_data["faculty_id"] = faculty_id
 
     # Ask for a group
     kb_buttons = []
-    for group in session.query(StudentsGroup) \
+    for group in read_session.query(StudentsGroup) \
             .filter_by(faculty_id=ctx.user_data["faculty_id"], course=ctx.user_data["course"]) \
             .order_by(StudentsGroup.name):
         kb_buttons.append(InlineKeyboardButton(
             text=group.name,
-            callback_data=group.id,
+            callback_data=states.UserSelectGroup.build(group.id),
         ))
 
     kb_footer = None
     if user.students_group_id is not None:
         kb_footer = [InlineKeyboardButton(text=P_CANCEL, callback_data=states.END)]
 
-    update.callback_query.answer()
     keyboard = build_keyboard_menu(kb_buttons, 4, footer_buttons=kb_footer)
     update.callback_query.edit_message_text(
         "Обери свою групу",
@@ -112,13 +167,14 @@ def select_faculty(update: Update, ctx: CallbackContext, session: Session, user:
 @db_session
 @acquire_user
 def select_group(update: Update, ctx: CallbackContext, session: Session, user: User):
+    group_id = states.UserSelectGroup.parse(update.callback_query.data).group(1)
     is_valid = session.query(
-        sqa.exists().where(StudentsGroup.id == update.callback_query.data)).scalar()
+        sqa.exists().where(StudentsGroup.id == group_id)).scalar()
     if not is_valid:
         return None  # TODO: handle error
-    ctx.user_data["group_id"] = update.callback_query.data
+    ctx.user_data["group_id"] = group_id
+    ctx.user_data.pop("wizard_message_id", None)
 
-    update.callback_query.answer()
     update.callback_query.edit_message_text("Групу встановлено!", reply_markup=None)
     update.callback_query = None
     return select_subgroups(update=update, ctx=ctx, session=session, user=user)
@@ -147,7 +203,6 @@ def select_subgroups(update: Update, ctx: CallbackContext, session: Session, use
         if not lesson:
             return None  # TODO: handle error
         ctx.user_data["subgroups"].append(lesson)
-        update.callback_query.answer()
 
     # filters to exclude already selected groups from the InputKeyboard
     filters = []
@@ -178,6 +233,7 @@ def select_subgroups(update: Update, ctx: CallbackContext, session: Session, use
         for subgroup in session.query(Lesson) \
                 .filter_by(students_group_id=ctx.user_data["group_id"],
                            name=lesson_name, lesson_format=lesson_format) \
+                .options(selectinload(Lesson.teachers)) \
                 .order_by(Lesson.subgroup):
             teachers = []
             for teacher in subgroup.teachers:
@@ -217,11 +273,13 @@ def select_subgroups(update: Update, ctx: CallbackContext, session: Session, use
 
     user.is_group_moderator = False
 
-    user.subgroups.clear()
-    for lesson in ctx.user_data["subgroups"]:
-        lesson = session.merge(lesson)
-        user.subgroups.append(lesson)
+    # chosen lessons are loaded at once, rather than merged one by one
+    subgroups_ids = [lesson.id for lesson in ctx.user_data["subgroups"]]
+    user.subgroups = []
+    if subgroups_ids:
+        user.subgroups = session.query(Lesson).filter(Lesson.id.in_(subgroups_ids)).all()
     session.commit()
+    user_cache.invalidate(user.tg_id)
     if update.callback_query is not None and len(user.subgroups) > 0:
         update.callback_query.edit_message_text(
             text="Підгрупи визначено!",
@@ -1,9 +1,87 @@
-from telegram import Update
+import hashlib
+import logging
+from typing import List
+
+import telegram as tg
+from telegram import InlineKeyboardMarkup, ParseMode, Update
+from telegram.constants import MAX_MESSAGE_LENGTH
 from telegram.ext import CallbackContext
 
 from app.bot.dictionaries import states
 
+logger = logging.getLogger(__name__)
+
+# number of the latest messages in a chat, whose fingerprints are remembered
+MAX_FINGERPRINTS = 20
+
 
 def end(update: Update, ctx: CallbackContext):
     ctx.user_data.clear()
     return states.END
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """ Splits the text into chunks of at most `limit` characters by empty lines """
+    chunks = []
+    paragraphs = []
+    size = 0
+    for paragraph in text.split("\n\n"):
+        # a paragraph is a lesson or a few lines, so it is hardly ever that long
+        while len(paragraph) > limit:
+            chunks.extend(["\n\n".join(paragraphs)] if paragraphs else [])
+            chunks.append(paragraph[:limit])
+            paragraphs, size, paragraph = [], 0, paragraph[limit:]
+        if not paragraph:
+            continue
+        if paragraphs and size + 2 + len(paragraph) > limit:
+            chunks.append("\n\n".join(paragraphs))
+            paragraphs, size = [], 0
+        size += len(paragraph) + (2 if paragraphs else 0)
+        paragraphs.append(paragraph)
+    if paragraphs:
+        chunks.append("\n\n".join(paragraphs))
+    return chunks
+
+
+def message_fingerprint(text: str, reply_markup: InlineKeyboardMarkup) -> str:
+    data = text + "\0" + reply_markup.to_json()
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def remember_fingerprint(ctx: CallbackContext, message_id: int, fingerprint: str):
+    fingerprints = ctx.chat_data.setdefault("fingerprints", {})
+    # re-insert to keep the dict ordered from the least recently shown message
+    fingerprints.pop(message_id, None)
+    fingerprints[message_id] = fingerprint
+    while len(fingerprints) > MAX_FINGERPRINTS:
+        del fingerprints[next(iter(fingerprints))]
+
+
+def reply_or_edit(update: Update, ctx: CallbackContext, text: str,
+                  reply_markup: InlineKeyboardMarkup) -> bool:
+    """
+    Sends a new HTML message in reply to a command or edits the message of a callback query.
+    Edits, which would not change the message, are skipped without calling Bot API.
+    :return: whether the message was sent or edited
+    """
+    fingerprint = message_fingerprint(text, reply_markup)
+    kwargs = dict(text=text, parse_mode=ParseMode.HTML, reply_markup=reply_markup,
+                  disable_web_page_preview=True)
+
+    if not update.callback_query:
+        message = update.message.reply_text(**kwargs)
+        remember_fingerprint(ctx, message.message_id, fingerprint)
+        return True
+
+    message_id = update.callback_query.message.message_id
+    if ctx.chat_data.get("fingerprints", {}).get(message_id) == fingerprint:
+        logger.debug("message %s is not modified, the edit is skipped", message_id)
+        return False
+    try:
+        update.callback_query.edit_message_text(**kwargs)
+    except tg.TelegramError as e:
+        # the message was shown before its fingerprint could be remembered (e.g. before restart)
+        if "Message is not modified" not in str(e):
+            raise e
+    remember_fingerprint(ctx, message_id, fingerprint)
+    return True
@@ -1,37 +1,92 @@
-import datetime as dt
 import logging
 from functools import wraps
 
+from sqlalchemy.exc import DBAPIError, OperationalError
 from sqlalchemy.orm import Session as SqaSession
 from telegram import Update
 
-from app.database import Session, User
+from app.bot.activity import activity_buffer
+from app.bot.users import SOURCE_EXISTING, UserSnapshot, upsert_user, user_cache
+from app.database import ReadSession, Session, User, replica_router, session_scope
 
 logger = logging.getLogger()
 
 
 def db_session(func):
-    """ Pushes 'session' argument to a function """
+    """
+    Pushes 'session' argument to a function.
+    The session is rolled back if the function raises and is closed in any case,
+    so no update can leak a pooled connection.
+    """
 
     @wraps(func)
     def inner(*args, **kwargs):
         if "session" in kwargs:
             return func(*args, **kwargs)
-        session = Session()
-        kwargs.update({
-            "session": session,
-        })
-        output = func(*args, **kwargs)
-        session.close()
-        return output
+        with session_scope() as session:
+            kwargs.update({
+                "session": session,
+            })
+            return func(*args, **kwargs)
 
     return inner
 
 
+def db_read_session(func):
+    """
+    Pushes 'read_session' argument to a function.
+    The session is bound to a read replica (or the primary, if none is available),
+    so it must be used for read-only queries only.
+    If the replica fails while the update is handled, it is excluded from routing
+    and the function is run once again with a session of the primary.
+    """
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        if "read_session" in kwargs:
+            return func(*args, **kwargs)
+        engine = replica_router.primary
+        try:
+            with session_scope(ReadSession) as read_session:
+                engine = read_session.get_bind()
+                kwargs.update({
+                    "read_session": read_session,
+                })
+                return func(*args, **kwargs)
+        except DBAPIError as e:
+            is_connection_error = isinstance(e, OperationalError) or e.connection_invalidated
+            if engine is replica_router.primary or not is_connection_error:
+                raise e
+            logger.warning("replica %s failed, retrying on the primary: %s",
+                           engine.url.host, str(e))
+            replica_router.exclude(engine)
+
+        with session_scope(Session) as read_session:
+            kwargs.update({
+                "read_session": read_session,
+            })
+            return func(*args, **kwargs)
+
+    return inner
+
+
+def _acquire_user(session: SqaSession, update: Update) -> User:
+    """ Creates or updates User if needed, using a single statement """
+    user, source = upsert_user(session, update.effective_user.id,
+                               update.effective_user.username)
+    if user is None:
+        # the user has been created concurrently, so now they can be selected
+        user, source = upsert_user(session, update.effective_user.id,
+                                   update.effective_user.username)
+    if source != SOURCE_EXISTING:
+        session.commit()
+    return user
+
+
 def acquire_user(func):
     """
     Pushes 'user' argument to a function.
-    Creates or updates User if needed.
+    Creates or updates User if needed, using a single statement.
     """
 
     @wraps(func)
@@ -44,21 +99,44 @@ def acquire_user(func):
             update = args[0]
         session: SqaSession = kwargs.get("session")
 
-        user = session.query(User).get(update.effective_user.id)
-        if user is None:
-            user = User(
-                tg_id=update.effective_user.id,
-                tg_username=update.effective_user.username,
-            )
-            session.add(user)
-            session.commit()
+        user = _acquire_user(session, update)
 
-        if user.tg_username != update.effective_user.username:
-            user.tg_username = update.effective_user.username
-            session.commit()
+        # written in background in batches, see app.bot.activity
+        activity_buffer.touch(user.tg_id)
 
-        user.last_active = dt.datetime.now()
-        session.commit()
+        kwargs.update({
+            "user": user,
+        })
+        return func(*args, **kwargs)
+
+    return inner
+
+
+def acquire_cached_user(func):
+    """
+    Pushes 'user' argument to a function as a UserSnapshot.
+    The database is not queried at all, if the user is cached and their username is unchanged.
+    'session' is required to upsert the user on a miss; on a hit it never connects.
+    Must be used only by handlers, which do not modify the user.
+    """
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        if "user" in kwargs:
+            return func(*args, **kwargs)
+
+        update: Update = kwargs.get("update", None)
+        if update is None:
+            update = args[0]
+
+        user = user_cache.get(update.effective_user.id)
+        if user is None or user.tg_username != update.effective_user.username:
+            session: SqaSession = kwargs.get("session")
+            user = UserSnapshot.from_user(session, _acquire_user(session, update))
+            user_cache.set(user)
+
+        # written in background in batches, see app.bot.activity
+        activity_buffer.touch(user.tg_id)
 
         kwargs.update({
             "user": user,
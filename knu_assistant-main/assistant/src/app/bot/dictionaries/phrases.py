@@ -12,5 +12,6 @@ E_QUESTION = u"\U00002753"
 E_BOOKS = u"\U0001F4DA"
 E_PERSON = u"\U0001F9D4"
 E_TEACHER = u"\U0001F9D1\U0000200D\U0001F3EB"
+E_GROUP = u"\U0001F465"
 
 P_CANCEL = "{} Скасувати".format(E_CANCEL)
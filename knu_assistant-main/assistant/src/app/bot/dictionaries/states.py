@@ -68,19 +68,20 @@ class State(str):
 EmptyStep = State('')
 
 # User selects their course
+# (steps' callbacks differ, so a button of a previous step can not be taken for another one)
 UserSelectCourse = State("select_student_course",
-                         "{}",
-                         re.compile(r"^(\d+)$"))
+                         "course_{}",
+                         re.compile(r"^course_(\d+)$"))
 
 # User selects their faculty
 UserSelectFaculty = State("select_student_faculty",
-                          "{}",
-                          re.compile(r"^(\d+)$"))
+                          "faculty_{}",
+                          re.compile(r"^faculty_(\d+)$"))
 
 # User selects their group
 UserSelectGroup = State("select_student_group",
-                        "{}",
-                        re.compile(r"^(\d+)$"))
+                        "group_{}",
+                        re.compile(r"^group_(\d+)$"))
 
 # User selects their subgroups
 UserSelectSubgroups = State("select_subgroups",
@@ -95,6 +96,16 @@ TimetableDaySelection = State("timetable_day_selection",
                               "tt_day_selection_{}",
                               re.compile(r"^tt_day_selection_(\d{4}-\d{2}-\d{2})$"))
 
+# month and page of the month timetable
+TimetableMonthSelection = State("timetable_month_selection",
+                                "tt_month_selection_{}_{}",
+                                re.compile(r"^tt_month_selection_(\d{4}-\d{2})_(\d+)$"))
+
+# teacher, "day" or "week" and a date of the teacher's timetable
+TimetableTeacherSelection = State("timetable_teacher_selection",
+                                  "tt_teacher_{}_{}_{}",
+                                  re.compile(r"^tt_teacher_(\d+)_(day|week)_(\d{4}-\d{2}-\d{2})$"))
+
 # ========= Moderation Requests =========
 
 # Change Lesson link
@@ -102,6 +113,11 @@ LinkWait = State("link_wait",
                  "{}",
                  re.compile(r"^.*$"))
 
+# Moderator's message to the group
+BroadcastWait = State("broadcast_wait",
+                      "{}",
+                      re.compile(r"^.*$"))
+
 ModeratorAcceptLink = State("moderator_accept_lesson_link",
                             "moderator_accept_lesson_link_{}",
                             re.compile(r"^moderator_accept_lesson_link_(\d+)$"))
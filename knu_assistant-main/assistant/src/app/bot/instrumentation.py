@@ -0,0 +1,206 @@
+"""
+Per-handler instrumentation: latency, database time, number of queries and Telegram API time
+of each update are recorded as Prometheus metrics.
+
+Usage:
+>>> install_query_listeners(db)
+>>> acknowledge_callback_queries(updater.dispatcher)
+>>> instrument_handlers(updater.dispatcher)
+"""
+
+import logging
+import threading
+import time
+from functools import wraps
+from typing import Callable, Iterable, Iterator, Optional
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from telegram import TelegramError, Update
+from telegram.ext import CallbackQueryHandler, ConversationHandler, Dispatcher, Handler
+from telegram.utils.request import Request
+
+from app.core.config import settings
+
+__all__ = [
+    "HandlerStats",
+    "acknowledge",
+    "acknowledge_callback_queries",
+    "InstrumentedRequest",
+    "current_stats",
+    "install_query_listeners",
+    "instrument",
+    "instrument_handlers",
+]
+
+logger = logging.getLogger(__name__)
+
+handler_latency = Histogram(
+    "bot_handler_latency_seconds", "Time spent handling an update", ["handler"],
+)
+handler_db_time = Histogram(
+    "bot_handler_db_seconds", "Time spent executing SQL statements per update", ["handler"],
+)
+handler_queries = Histogram(
+    "bot_handler_queries", "SQL statements executed per update", ["handler"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+handler_telegram_time = Histogram(
+    "bot_handler_telegram_seconds", "Time spent in Telegram Bot API requests per update",
+    ["handler"],
+)
+callback_ack_time = Histogram(
+    "bot_callback_ack_seconds", "Time spent acknowledging a callback query", ["handler"],
+)
+callback_work_time = Histogram(
+    "bot_callback_work_seconds",
+    "Time between acknowledging a callback query and finishing its handling", ["handler"],
+)
+handler_errors = Counter(
+    "bot_handler_errors_total", "Updates, which handling raised an exception", ["handler"],
+)
+
+
+class HandlerStats:
+    """ Resources, used while handling a single update """
+
+    __slots__ = ("db_time", "queries", "telegram_time")
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.queries = 0
+        self.telegram_time = 0.0
+
+
+# stats of the update, which is being handled by the current thread
+_local = threading.local()
+
+
+def current_stats() -> Optional[HandlerStats]:
+    return getattr(_local, "stats", None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started_at"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info.pop("query_started_at", None)
+    stats = current_stats()
+    if stats is not None and started_at is not None:
+        stats.db_time += time.perf_counter() - started_at
+        stats.queries += 1
+
+
+def install_query_listeners(engine: Engine):
+    """ Attributes SQL statements, executed by the engine, to the handler being run """
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class InstrumentedRequest(Request):
+    """ telegram.utils.request.Request, which attributes Bot API time to the handler being run """
+
+    def _request_wrapper(self, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return super()._request_wrapper(*args, **kwargs)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.telegram_time += time.perf_counter() - started_at
+
+
+def instrument(callback: Callable, name: Optional[str] = None) -> Callable:
+    """ Wraps a handler callback to record its metrics and log it, if it is slow """
+    if getattr(callback, "__instrumented__", False):
+        return callback
+    name = name or callback.__name__
+
+    @wraps(callback)
+    def inner(*args, **kwargs):
+        outer_stats = current_stats()
+        stats = _local.stats = HandlerStats()
+        started_at = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        except Exception:
+            handler_errors.labels(handler=name).inc()
+            raise
+        finally:
+            latency = time.perf_counter() - started_at
+            _local.stats = outer_stats
+
+            handler_latency.labels(handler=name).observe(latency)
+            handler_db_time.labels(handler=name).observe(stats.db_time)
+            handler_queries.labels(handler=name).observe(stats.queries)
+            handler_telegram_time.labels(handler=name).observe(stats.telegram_time)
+            if latency >= settings.SLOW_HANDLER_THRESHOLD:
+                logger.warning(
+                    "slow handler %s: %.3fs total, %.3fs in %d queries, %.3fs in Telegram API",
+                    name, latency, stats.db_time, stats.queries, stats.telegram_time,
+                )
+
+    inner.__instrumented__ = True
+    return inner
+
+
+def acknowledge(callback: Callable, name: Optional[str] = None) -> Callable:
+    """
+    Wraps a callback query handler to answer the query before the handler is run,
+    so the client stops showing a spinner without waiting for the database and rendering
+    """
+    if getattr(callback, "__acknowledged__", False):
+        return callback
+    name = name or callback.__name__
+
+    @wraps(callback)
+    def inner(update, *args, **kwargs):
+        query = update.callback_query if isinstance(update, Update) else None
+        if query is None:
+            return callback(update, *args, **kwargs)
+
+        started_at = time.perf_counter()
+        try:
+            query.answer()
+        except TelegramError as e:
+            # e.g. the query is too old, the handler still has to update the message
+            logger.warning("failed to answer callback query in %s: %s", name, str(e))
+        answered_at = time.perf_counter()
+        callback_ack_time.labels(handler=name).observe(answered_at - started_at)
+        try:
+            return callback(update, *args, **kwargs)
+        finally:
+            callback_work_time.labels(handler=name).observe(time.perf_counter() - answered_at)
+
+    inner.__acknowledged__ = True
+    return inner
+
+
+def _iter_handlers(handlers: Iterable[Handler]) -> Iterator[Handler]:
+    """ Handlers, including nested into conversations """
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _iter_handlers(handler.entry_points + handler.fallbacks)
+            for state_handlers in handler.states.values():
+                yield from _iter_handlers(state_handlers)
+        else:
+            yield handler
+
+
+def acknowledge_callback_queries(dispatcher: Dispatcher):
+    """ Makes every callback query handler, registered in the dispatcher, answer immediately """
+    for handlers in dispatcher.handlers.values():
+        for handler in _iter_handlers(handlers):
+            if isinstance(handler, CallbackQueryHandler):
+                handler.callback = acknowledge(handler.callback)
+
+
+def instrument_handlers(dispatcher: Dispatcher):
+    """ Instruments every handler, registered in the dispatcher, including nested ones """
+    for handlers in dispatcher.handlers.values():
+        for handler in _iter_handlers(handlers):
+            handler.callback = instrument(handler.callback)
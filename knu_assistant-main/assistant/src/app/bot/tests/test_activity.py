@@ -0,0 +1,41 @@
+import datetime as dt
+
+from app.bot.activity import ActivityBuffer
+from app.tests.factories import UserFactory
+
+
+class TestActivityBuffer:
+
+    def test_touch(self):
+        buffer = ActivityBuffer()
+        earlier = dt.datetime(2021, 2, 1, 10, 0)
+        later = dt.datetime(2021, 2, 1, 11, 0)
+
+        buffer.touch(1, later)
+        buffer.touch(1, earlier)  # the latest timestamp is kept
+        buffer.touch(2, earlier)
+        assert len(buffer) == 2
+        assert buffer._last_active == {1: later, 2: earlier}
+
+    def test_flush(self, db_session):
+        john = UserFactory(last_active=dt.datetime(2021, 1, 1))
+        jack = UserFactory(last_active=dt.datetime(2021, 1, 1))
+        inactive = UserFactory(last_active=dt.datetime(2021, 1, 1))
+        db_session.commit()
+
+        buffer = ActivityBuffer()
+        buffer.touch(john.tg_id, dt.datetime(2021, 2, 1, 10, 0))
+        buffer.touch(jack.tg_id, dt.datetime(2021, 2, 1, 11, 0))
+
+        assert buffer.flush(db_session) == 2
+        assert len(buffer) == 0
+
+        db_session.expire_all()
+        assert john.last_active == dt.datetime(2021, 2, 1, 10, 0)
+        assert jack.last_active == dt.datetime(2021, 2, 1, 11, 0)
+        assert inactive.last_active == dt.datetime(2021, 1, 1)
+
+    def test_flush_empty(self, db_session, mocker):
+        execute = mocker.patch.object(db_session, "execute")
+        assert ActivityBuffer().flush(db_session) == 0
+        assert execute.call_count == 0
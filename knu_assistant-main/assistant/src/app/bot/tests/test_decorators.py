@@ -1,7 +1,9 @@
 import mock
+import pytest
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import sessionmaker
 
-from app.database import Session
+from app.database import ReadSession, Session, User, db
 from app.tests.factories import UserFactory
 
 
@@ -17,6 +19,20 @@ class TestDbSession:
         with mock.patch.object(sessionmaker, "__call__") as session_mock:
             func()
             assert session_mock.call_count == 1
+            assert session_mock.return_value.close.call_count == 1
+
+    def test_error(self):
+        from app.bot.decorators import db_session
+
+        @db_session
+        def func(session):
+            raise ValueError()
+
+        with mock.patch.object(sessionmaker, "__call__") as session_mock:
+            with pytest.raises(ValueError):
+                func()
+            assert session_mock.return_value.rollback.call_count == 1
+            assert session_mock.return_value.close.call_count == 1
 
     def test_already_passed_session(self):
         from app.bot.decorators import db_session
@@ -32,6 +48,67 @@ class TestDbSession:
             assert session_mock.call_count == 0
 
 
+class TestDbReadSession:
+
+    def test_db_read_session(self):
+        from app.bot.decorators import db_read_session
+
+        @db_read_session
+        def func(read_session):
+            assert read_session is not None
+
+        with mock.patch.object(sessionmaker, "__call__") as session_mock:
+            func()
+            assert session_mock.call_count == 1
+            assert session_mock.return_value.close.call_count == 1
+
+    def test_already_passed_read_session(self):
+        from app.bot.decorators import db_read_session
+
+        @db_read_session
+        def func(read_session):
+            assert read_session is not None
+
+        s = ReadSession()
+
+        with mock.patch.object(sessionmaker, "__call__") as session_mock:
+            func(read_session=s)
+            assert session_mock.call_count == 0
+
+    def test_replica_failure(self):
+        from app.bot.decorators import db_read_session
+        sessions = []
+
+        @db_read_session
+        def func(read_session):
+            sessions.append(read_session)
+            if len(sessions) == 1:
+                raise OperationalError("SELECT 1", {}, Exception("server closed the connection"))
+            return "result"
+
+        replica = mock.MagicMock()
+        with mock.patch("app.bot.decorators.ReadSession") as read_session_mock, \
+                mock.patch("app.bot.decorators.Session") as session_mock, \
+                mock.patch("app.bot.decorators.replica_router") as router_mock:
+            read_session_mock.return_value.get_bind.return_value = replica
+            # the update is handled on the primary, the replica is not used anymore
+            assert func() == "result"
+            assert sessions == [read_session_mock.return_value, session_mock.return_value]
+            router_mock.exclude.assert_called_once_with(replica)
+
+    def test_query_error_not_retried(self):
+        from app.bot.decorators import db_read_session
+        func = mock.MagicMock(__name__="func",
+                              side_effect=ProgrammingError("SELECT", {}, Exception("syntax")))
+
+        with mock.patch("app.bot.decorators.ReadSession"), \
+                mock.patch("app.bot.decorators.replica_router") as router_mock:
+            with pytest.raises(ProgrammingError):
+                db_read_session(func)()
+            assert func.call_count == 1
+            assert router_mock.exclude.call_count == 0
+
+
 class TestAcquireUser:
 
     def test_non_existent_user(self, db_session):
@@ -46,9 +123,10 @@ class TestAcquireUser:
         update.effective_user.id = 10000000
         update.effective_user.username = "john"
 
-        with mock.patch.object(db_session, "add") as session_add_mock:
+        with mock.patch.object(db_session, "execute", wraps=db_session.execute) as execute_mock:
             handler(update=update, session=db_session)
-            assert session_add_mock.call_count == 1
+            assert execute_mock.call_count == 1  # a single upsert statement
+        assert db_session.query(User).get(10000000) is not None
 
     def test_already_passed_user(self, db_session):
         """ Test if user argument is already passed to the function """
@@ -79,12 +157,117 @@ class TestAcquireUser:
 
         @acquire_user
         def handler(update, session, user):
+            assert user is user_
             assert user.tg_username == "john"
 
         with mock.patch.object(db_session, "add") as session_add_mock:
             handler(update=update, session=db_session)
             assert session_add_mock.call_count == 0
 
+    def test_no_writes(self, db_session):
+        """ Test acquire_user does not write anything for an up-to-date user """
+        from app.bot.activity import activity_buffer
+        from app.bot.decorators import acquire_user
+
+        update = mock.MagicMock()
+        update.effective_user.id = 10000000
+        update.effective_user.username = "john"
+        UserFactory(tg_id=update.effective_user.id, tg_username="john")
+        db_session.commit()
+
+        @acquire_user
+        def handler(update, session, user):
+            assert user.tg_id == 10000000
+
+        with mock.patch.object(db_session, "commit") as session_commit_mock, \
+                mock.patch.object(activity_buffer, "touch") as touch_mock:
+            handler(update=update, session=db_session)
+            assert session_commit_mock.call_count == 0
+            touch_mock.assert_called_once_with(10000000)
+
+
+class TestAcquireCachedUser:
+
+    def test_cache_miss(self, db_session):
+        from app.bot.decorators import acquire_cached_user
+        from app.bot.users import UserSnapshot, user_cache
+
+        update = mock.MagicMock()
+        update.effective_user.id = 10000000
+        update.effective_user.username = "john"
+        user_ = UserFactory(tg_id=update.effective_user.id, tg_username="john")
+        db_session.commit()
+
+        @acquire_cached_user
+        def handler(update, session, user):
+            assert isinstance(user, UserSnapshot)
+            assert user.students_group_id == user_.students_group_id
+
+        handler(update=update, session=db_session)
+        assert user_cache.get(user_.tg_id) is not None
+
+    def test_cache_hit(self, db_session):
+        from app.bot.decorators import acquire_cached_user
+        from app.bot.users import UserSnapshot, user_cache
+
+        update = mock.MagicMock()
+        update.effective_user.id = 10000000
+        update.effective_user.username = "john"
+        snapshot = UserSnapshot(tg_id=10000000, tg_username="john", students_group_id=1,
+                                subgroups_ids=frozenset(), is_admin=False,
+                                is_group_moderator=False)
+        user_cache.set(snapshot)
+
+        @acquire_cached_user
+        def handler(update, session, user):
+            assert user is snapshot
+
+        with mock.patch.object(db_session, "execute") as execute_mock:
+            handler(update=update, session=db_session)
+            assert execute_mock.call_count == 0
+
+    def test_cache_hit_without_connection(self):
+        """ A write session, opened for a cache miss, does not check out a connection on a hit """
+        from app.bot.decorators import acquire_cached_user, db_session
+        from app.bot.users import UserSnapshot, user_cache
+
+        update = mock.MagicMock()
+        update.effective_user.id = 10000001
+        update.effective_user.username = "john"
+        user_cache.set(UserSnapshot(tg_id=10000001, tg_username="john", students_group_id=1,
+                                    subgroups_ids=frozenset(), is_admin=False,
+                                    is_group_moderator=False))
+
+        @db_session
+        @acquire_cached_user
+        def handler(update, session, user):
+            return user.tg_id
+
+        with mock.patch.object(db.pool, "connect") as connect_mock:
+            assert handler(update=update) == 10000001
+            assert connect_mock.call_count == 0
+
+    def test_updated_username(self, db_session):
+        """ Test cached user is re-acquired, if their username was changed """
+        from app.bot.decorators import acquire_cached_user
+        from app.bot.users import UserSnapshot, user_cache
+
+        update = mock.MagicMock()
+        update.effective_user.id = 10000000
+        update.effective_user.username = "john"
+        UserFactory(tg_id=update.effective_user.id, tg_username="michael")
+        db_session.commit()
+        user_cache.set(UserSnapshot(tg_id=10000000, tg_username="michael", students_group_id=1,
+                                    subgroups_ids=frozenset(), is_admin=False,
+                                    is_group_moderator=False))
+
+        @acquire_cached_user
+        def handler(update, session, user):
+            assert user.tg_username == "john"
+
+        handler(update=update, session=db_session)
+        assert user_cache.get(10000000).tg_username == "john"
+
 
 class TestModeratorsOnly:
 
@@ -0,0 +1,147 @@
+import mock
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from telegram import TelegramError, Update
+from telegram.ext import CallbackQueryHandler, CommandHandler, ConversationHandler, Dispatcher
+
+from app.bot.instrumentation import (
+    InstrumentedRequest,
+    acknowledge,
+    acknowledge_callback_queries,
+    current_stats,
+    install_query_listeners,
+    instrument,
+    instrument_handlers,
+)
+
+
+def callback(update, ctx):
+    return 1
+
+
+class TestInstrument:
+
+    def test_queries(self):
+        engine = create_engine("sqlite://")
+        install_query_listeners(engine)
+        install_query_listeners(engine)  # listeners are installed once
+
+        def count_queries(update, ctx):
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+            return current_stats().queries
+
+        assert instrument(count_queries)(None, None) == 2
+        assert REGISTRY.get_sample_value(
+            "bot_handler_queries_count", {"handler": "count_queries"}) == 1
+        assert REGISTRY.get_sample_value(
+            "bot_handler_latency_seconds_count", {"handler": "count_queries"}) == 1
+        assert current_stats() is None
+
+        # queries outside of handlers are not attributed
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    def test_telegram_time(self):
+        def send(update, ctx):
+            request = InstrumentedRequest()
+            with mock.patch("telegram.utils.request.Request._request_wrapper",
+                            return_value=b"{}"):
+                request._request_wrapper("POST", "https://api.telegram.org")
+            return current_stats().telegram_time
+
+        assert instrument(send)(None, None) > 0
+
+    def test_error(self):
+        def fail(update, ctx):
+            raise ValueError()
+
+        with pytest.raises(ValueError):
+            instrument(fail)(None, None)
+        assert REGISTRY.get_sample_value("bot_handler_errors_total", {"handler": "fail"}) == 1
+
+    def test_slow_handler(self, caplog):
+        with mock.patch("app.bot.instrumentation.settings.SLOW_HANDLER_THRESHOLD", 0):
+            assert instrument(callback, name="test_slow_handler")(None, None) == 1
+        assert "slow handler test_slow_handler" in caplog.text
+
+    def test_instrument_twice(self):
+        instrumented = instrument(callback)
+        assert instrument(instrumented) is instrumented
+
+
+def test_instrument_handlers():
+    dispatcher = Dispatcher(mock.MagicMock(), None)
+    nested = CallbackQueryHandler(callback)
+    conversation = ConversationHandler(
+        entry_points=[CommandHandler("start", callback)],
+        states={1: [nested]},
+        fallbacks=[CallbackQueryHandler(callback)],
+    )
+    dispatcher.add_handler(conversation)
+    dispatcher.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("other", callback)],
+        states=conversation.states,
+        fallbacks=[],
+    ))
+    dispatcher.add_handler(CommandHandler("help", callback), group=1)
+
+    instrument_handlers(dispatcher)
+
+    handlers = [
+        *conversation.entry_points, nested, *conversation.fallbacks,
+        *dispatcher.handlers[1],
+    ]
+    for handler in handlers:
+        assert handler.callback.__instrumented__
+        assert handler.callback.__wrapped__ is callback
+
+
+class TestAcknowledge:
+
+    def make_update(self):
+        update = mock.MagicMock(spec=Update)
+        calls = update.calls = []
+        update.callback_query.answer.side_effect = lambda: calls.append("answer")
+        return update
+
+    def test_answers_before_handling(self):
+        update = self.make_update()
+
+        def handle(update, ctx):
+            update.calls.append("handle")
+            return 1
+
+        assert acknowledge(handle)(update, None) == 1
+        assert update.calls == ["answer", "handle"]
+        assert REGISTRY.get_sample_value("bot_callback_ack_seconds_count", {"handler": "handle"}) == 1
+        assert REGISTRY.get_sample_value("bot_callback_work_seconds_count", {"handler": "handle"}) == 1
+
+    def test_answer_error(self):
+        update = self.make_update()
+        update.callback_query.answer.side_effect = TelegramError("Query is too old")
+        assert acknowledge(callback, name="test_answer_error")(update, None) == 1
+
+    def test_not_callback_query(self):
+        update = mock.MagicMock(spec=Update, callback_query=None)
+        assert acknowledge(callback, name="test_not_callback_query")(update, None) == 1
+        assert REGISTRY.get_sample_value(
+            "bot_callback_ack_seconds_count", {"handler": "test_not_callback_query"}) is None
+
+
+def test_acknowledge_callback_queries():
+    dispatcher = Dispatcher(mock.MagicMock(), None)
+    nested = CallbackQueryHandler(callback)
+    command = CommandHandler("start", callback)
+    dispatcher.add_handler(ConversationHandler(
+        entry_points=[command],
+        states={1: [nested]},
+        fallbacks=[],
+    ))
+
+    acknowledge_callback_queries(dispatcher)
+
+    assert nested.callback.__acknowledged__
+    assert command.callback is callback
@@ -0,0 +1,90 @@
+from app.bot.users import (
+    SOURCE_EXISTING,
+    SOURCE_INSERTED,
+    SOURCE_UPDATED,
+    UserCache,
+    UserSnapshot,
+    upsert_user,
+)
+from app.database import User
+from app.tests.factories import LessonFactory, UserFactory
+
+
+class TestUpsertUser:
+
+    def test_insert(self, db_session):
+        user, source = upsert_user(db_session, 10000000, "john")
+        assert source == SOURCE_INSERTED
+        assert user.tg_id == 10000000
+        assert user.tg_username == "john"
+        assert user.is_admin is False
+        assert user.is_group_moderator is False
+        assert user.last_active is not None
+        assert db_session.query(User).get(10000000) is user
+
+    def test_update_username(self, db_session):
+        user_ = UserFactory(tg_id=10000000, tg_username="michael")
+        db_session.commit()
+
+        user, source = upsert_user(db_session, 10000000, "john")
+        assert source == SOURCE_UPDATED
+        assert user is user_
+        assert user.tg_username == "john"
+
+    def test_existing(self, db_session):
+        user_ = UserFactory(tg_id=10000000, tg_username="john")
+        db_session.commit()
+
+        user, source = upsert_user(db_session, 10000000, "john")
+        assert source == SOURCE_EXISTING
+        assert user is user_
+        assert user.students_group_id == user_.students_group_id
+
+
+class TestUserSnapshot:
+
+    def test_from_user(self, db_session):
+        user = UserFactory(is_group_moderator=True)
+        programming_1 = LessonFactory(subgroup="1", students_group=user.students_group)
+        english_2 = LessonFactory(subgroup="2", students_group=user.students_group)
+        user.subgroups.extend([programming_1, english_2])
+        db_session.commit()
+
+        snapshot = UserSnapshot.from_user(db_session, user)
+        assert snapshot == UserSnapshot(
+            tg_id=user.tg_id,
+            tg_username=user.tg_username,
+            students_group_id=user.students_group_id,
+            subgroups_ids=frozenset({programming_1.id, english_2.id}),
+            is_admin=False,
+            is_group_moderator=True,
+        )
+
+
+class TestUserCache:
+
+    def snapshot(self, tg_id=1):
+        return UserSnapshot(tg_id=tg_id, tg_username="john", students_group_id=1,
+                            subgroups_ids=frozenset(), is_admin=False, is_group_moderator=False)
+
+    def test_get_set(self):
+        cache = UserCache(maxsize=10, ttl=60)
+        assert cache.get(1) is None
+        cache.set(self.snapshot())
+        assert cache.get(1) == self.snapshot()
+
+    def test_invalidate(self):
+        cache = UserCache(maxsize=10, ttl=60)
+        cache.set(self.snapshot(1))
+        cache.set(self.snapshot(2))
+        cache.invalidate(1)
+        cache.invalidate(3)  # not cached
+        assert cache.get(1) is None
+        assert cache.get(2) is not None
+
+    def test_maxsize(self):
+        cache = UserCache(maxsize=2, ttl=60)
+        for tg_id in range(3):
+            cache.set(self.snapshot(tg_id))
+        assert cache.get(0) is None
+        assert cache.get(2) is not None
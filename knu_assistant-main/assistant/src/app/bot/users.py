@@ -0,0 +1,170 @@
+"""
+Users acquisition
+A user is created, their username is synced and the row is returned by a single statement.
+Users' state, needed by most handlers, is cached in-process as UserSnapshot.
+"""
+
+import datetime as dt
+import logging
+import threading
+from typing import FrozenSet, NamedTuple, Optional, Tuple
+
+from cachetools import TTLCache
+
+from sqlalchemy import (
+    DateTime,
+    Integer,
+    String,
+    bindparam,
+    column,
+    exists,
+    false,
+    literal,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.orm import Session as SqaSession
+
+from app.core.config import settings
+from app.database import LessonSubgroupMember, User
+
+logger = logging.getLogger(__name__)
+
+# Where the row returned by UPSERT_USER_STATEMENT comes from
+SOURCE_INSERTED = "inserted"
+SOURCE_UPDATED = "updated"
+SOURCE_EXISTING = "existing"
+
+
+def _build_upsert_user_statement():
+    """
+    WITH existing AS (SELECT ... WHERE tg_id = :tg_id),
+         inserted AS (INSERT ... SELECT ... WHERE NOT EXISTS (existing)
+                      ON CONFLICT (tg_id) DO NOTHING RETURNING ...),
+         updated AS (UPDATE ... WHERE tg_id = :tg_id AND tg_username IS DISTINCT FROM :tg_username
+                     RETURNING ...)
+    SELECT ... FROM updated
+    UNION ALL SELECT ... FROM inserted
+    UNION ALL SELECT ... FROM existing WHERE NOT EXISTS (updated)
+
+    Unlike INSERT ... ON CONFLICT DO UPDATE, it neither writes nor locks the row
+    of an existing user with an unchanged username.
+    Parameters: tg_id, tg_username, last_active
+    """
+    users = User.__table__
+    tg_id = bindparam("tg_id", type_=Integer)
+    tg_username = bindparam("tg_username", type_=String)
+    last_active = bindparam("last_active", type_=DateTime)
+
+    existing = select(users).where(users.c.tg_id == tg_id).cte("existing")
+    inserted = (
+        pg.insert(users)
+        .from_select(
+            ["tg_id", "tg_username", "is_admin", "is_group_moderator", "last_active"],
+            select(tg_id, tg_username, false(), false(), last_active)
+            .where(~exists(existing.select())),
+        )
+        .on_conflict_do_nothing(index_elements=["tg_id"])
+        .returning(*users.c)
+        .cte("inserted")
+    )
+    updated = (
+        update(users)
+        .where((users.c.tg_id == tg_id) & users.c.tg_username.is_distinct_from(tg_username))
+        .values(tg_username=tg_username)
+        .returning(*users.c)
+        .cte("updated")
+    )
+    return union_all(
+        select(updated, literal(SOURCE_UPDATED).label("source")),
+        select(inserted, literal(SOURCE_INSERTED).label("source")),
+        select(existing, literal(SOURCE_EXISTING).label("source"))
+        .where(~exists(updated.select())),
+    )
+
+
+UPSERT_USER_STATEMENT = _build_upsert_user_statement()
+
+
+def upsert_user(session: SqaSession, tg_id: int,
+                tg_username: Optional[str]) -> Tuple[Optional[User], Optional[str]]:
+    """
+    Creates a user or syncs their username with a single statement
+    :return: (User, source), where source is one of SOURCE_* constants.
+        (None, None) is returned if the user was created concurrently
+        between the statement snapshot and the insert.
+    """
+    stmt = (
+        select(User, column("source", String))
+        .from_statement(UPSERT_USER_STATEMENT)
+        .execution_options(populate_existing=True)
+    )
+    params = {
+        "tg_id": tg_id,
+        "tg_username": tg_username,
+        "last_active": dt.datetime.now(),
+    }
+    row = session.execute(stmt, params).first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+class UserSnapshot(NamedTuple):
+    """ Detached immutable copy of user's state """
+    tg_id: int
+    tg_username: Optional[str]
+    students_group_id: Optional[int]
+    # Lesson.id of user's subgroups
+    subgroups_ids: FrozenSet[int]
+    is_admin: bool
+    is_group_moderator: bool
+
+    @classmethod
+    def from_user(cls, session: SqaSession, user: User) -> "UserSnapshot":
+        subgroups_ids = session.execute(
+            select(LessonSubgroupMember.c.lesson_id)
+            .where(LessonSubgroupMember.c.user_id == user.tg_id)
+        ).scalars().all()
+        return cls(
+            tg_id=user.tg_id,
+            tg_username=user.tg_username,
+            students_group_id=user.students_group_id,
+            subgroups_ids=frozenset(subgroups_ids),
+            is_admin=user.is_admin,
+            is_group_moderator=user.is_group_moderator,
+        )
+
+
+class UserCache:
+    """
+    Bounded in-process cache of UserSnapshot, keyed by tg_id.
+    Entries expire after `ttl` seconds, so changes made outside of the bot
+    (e.g. granted moderator rights) are picked up eventually.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._lock = threading.Lock()
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, tg_id: int) -> Optional[UserSnapshot]:
+        with self._lock:
+            return self._cache.get(tg_id, None)
+
+    def set(self, snapshot: UserSnapshot):
+        with self._lock:
+            self._cache[snapshot.tg_id] = snapshot
+
+    def invalidate(self, tg_id: int):
+        """ Must be called whenever user's group, subgroups or rights are changed """
+        with self._lock:
+            self._cache.pop(tg_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+user_cache = UserCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
@@ -1,38 +1,58 @@
 import logging
 
+import prometheus_client
+from telegram import Bot
 from telegram.ext import (
     CallbackQueryHandler,
     CommandHandler,
     ConversationHandler,
     Filters,
+    InlineQueryHandler,
     MessageHandler,
     Updater,
 )
 
 from app.core.config import settings
 from app.bot import commands
+from app.bot.activity import activity_buffer, flush_activity
 from app.bot.dictionaries import states
+from app.bot.instrumentation import (
+    InstrumentedRequest,
+    acknowledge_callback_queries,
+    install_query_listeners,
+    instrument_handlers,
+)
+from app.database import db, replicas
+from app.timetable import calendar_server
 
 logger = logging.getLogger(__name__)
 
 
 def run():
-    updater = Updater(settings.TELEGRAM_BOT_TOKEN, workers=settings.TELEGRAM_BOT_WORKERS)
+    workers = settings.TELEGRAM_BOT_WORKERS or 4
+    # Bot API calls are timed to attribute them to handlers; the pool size is the Updater's default
+    bot = Bot(settings.TELEGRAM_BOT_TOKEN, request=InstrumentedRequest(con_pool_size=workers + 4))
+    updater = Updater(bot=bot, workers=workers)
     dispatcher = updater.dispatcher
 
     # /change_group
+    # a group can be typed by its name instead of selecting a course and a faculty
+    group_search_handler = MessageHandler(Filters.text & ~Filters.command, commands.search_group)
     select_group_handler = ConversationHandler(
         entry_points=[CommandHandler("change_group", commands.change_group)],
         states={
             states.UserSelectCourse: [
                 CallbackQueryHandler(commands.select_course,
-                                     pattern=states.UserSelectCourse.parse_pattern)],
+                                     pattern=states.UserSelectCourse.parse_pattern),
+                group_search_handler],
             states.UserSelectFaculty: [
                 CallbackQueryHandler(commands.select_faculty,
-                                     pattern=states.UserSelectFaculty.parse_pattern)],
+                                     pattern=states.UserSelectFaculty.parse_pattern),
+                group_search_handler],
             states.UserSelectGroup: [
                 CallbackQueryHandler(commands.select_group,
-                                     pattern=states.UserSelectGroup.parse_pattern)],
+                                     pattern=states.UserSelectGroup.parse_pattern),
+                group_search_handler],
             states.UserSelectSubgroups: [
                 CallbackQueryHandler(commands.select_subgroups,
                                      pattern=states.UserSelectSubgroups.parse_pattern)]
@@ -78,6 +98,40 @@ def run():
         allow_reentry=True,
     ))
 
+    # @bot today | tomorrow | week
+    dispatcher.add_handler(InlineQueryHandler(commands.timetable_inline_query))
+
+    # /teacher <name>
+    dispatcher.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("teacher", commands.show_teacher_timetable)],
+        states={
+            states.TimetableTeacherSelection: [
+                CallbackQueryHandler(commands.show_teacher_timetable,
+                                     pattern=states.TimetableTeacherSelection.parse_pattern)],
+        },
+        fallbacks=[],
+        allow_reentry=True,
+    ))
+
+    # /ics
+    dispatcher.add_handler(CommandHandler("ics", commands.send_calendar))
+
+    # /now, /next
+    dispatcher.add_handler(CommandHandler("now", commands.show_current_lesson))
+    dispatcher.add_handler(CommandHandler("next", commands.show_next_lesson))
+
+    # /month
+    dispatcher.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("month", commands.show_month_timetable)],
+        states={
+            states.TimetableMonthSelection: [
+                CallbackQueryHandler(commands.show_month_timetable,
+                                     pattern=states.TimetableMonthSelection.parse_pattern)],
+        },
+        fallbacks=[],
+        allow_reentry=True,
+    ))
+
     # /link@lesson_id
     dispatcher.add_handler(ConversationHandler(
         entry_points=[MessageHandler(Filters.text & Filters.regex(r"/link@(\d+)"), commands.link)],
@@ -96,11 +150,38 @@ def run():
     dispatcher.add_handler(CallbackQueryHandler(commands.reject_link_request,
                                                 pattern=states.ModeratorRejectLink.parse_pattern))
 
+    # Messages to the whole group
+    dispatcher.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("broadcast", commands.broadcast)],
+        states={
+            states.BroadcastWait: [
+                MessageHandler(Filters.text & ~Filters.command, commands.broadcast_message)],
+        },
+        fallbacks=[
+            CallbackQueryHandler(commands.end_callback, pattern=r"^{}$".format(states.END)),
+        ],
+    ))
+
+    # must go after all handlers are registered
+    for engine in [db, *replicas]:
+        install_query_listeners(engine)
+    acknowledge_callback_queries(dispatcher)
+    instrument_handlers(dispatcher)
+
+    updater.job_queue.run_repeating(flush_activity, interval=settings.ACTIVITY_FLUSH_INTERVAL)
+
+    if settings.METRICS_PORT:
+        prometheus_client.start_http_server(settings.METRICS_PORT)
+    if settings.CALENDAR_PORT:
+        calendar_server.start_http_server(settings.CALENDAR_PORT)
+
     updater.start_polling()
 
     try:
         # Bot gracefully stops on SIGINT, SIGTERM or SIGABRT.
         updater.idle()
+        # write activity, collected since the last flush
+        activity_buffer.flush()
     except ValueError as e:
         if "signal only works in main thread" in str(e):
             print(e)
@@ -30,7 +30,12 @@ from telethon.tl.types import (
     MessageEntityUrl,
 )
 
+from app.bot.users import user_cache
 from app.database import Session
+from app.tests.fake_redis import FakeRedis
+from app.timetable.cache import timetable_cache
+from app.timetable.fragments import lesson_fragments
+from app.timetable.index import lessons_index
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +59,7 @@ def reload_db_session_decorator():
     importlib.reload(app.bot.commands.basic)
     importlib.reload(app.bot.commands.user)
     importlib.reload(app.bot.commands.timetable)
+    importlib.reload(app.bot.commands.teacher)
     importlib.reload(app.bot.commands.moderation)
     importlib.reload(app.bot.commands.utils)
     importlib.reload(app.bot.commands)
@@ -63,8 +69,8 @@ def reload_db_session_decorator():
 def use_bot(db_session):
     """ Runs a telegram bot, which uses db session from the fixture """
 
-    # Mock app.bot.decorators.db_session to be able to rollback the session after test
-    # completed
+    # Mock app.bot.decorators.db_session and app.bot.decorators.db_read_session to be able to
+    # rollback the session after test completed
     def mock_db_session(func):
         """ Pushes session, controlled by the fixture """
 
@@ -75,8 +81,21 @@ def use_bot(db_session):
 
         return inner
 
+    def mock_db_read_session(func):
+        """ Pushes session, controlled by the fixture, as a read-only one """
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            kwargs["read_session"] = db_session
+            return func(*args, **kwargs)
+
+        return inner
+
     db_session_mock = mock.patch("app.bot.decorators.db_session", mock_db_session)
     db_session_mock.start()
+    db_read_session_mock = mock.patch("app.bot.decorators.db_read_session",
+                                      mock_db_read_session)
+    db_read_session_mock.start()
     reload_db_session_decorator()
 
     # Start the bot in a separate thread
@@ -105,6 +124,7 @@ def use_bot(db_session):
 
     stop_event.set()
     db_session_mock.stop()
+    db_read_session_mock.stop()
     importlib.invalidate_caches()
     reload_db_session_decorator()
 
@@ -227,8 +247,16 @@ def db_session(db) -> SqaSession:
     global session
     session.invalidate()
     session.begin_nested()  # Savepoint
+    # each test gets its own in-memory Redis, so a real server is neither required nor wiped
+    redis_mock = mock.patch.object(timetable_cache, "redis", FakeRedis())
+    redis_mock.start()
+    user_cache.clear()
+    timetable_cache.clear()
+    lesson_fragments.clear()
+    lessons_index.clear()
 
     yield session
 
+    redis_mock.stop()
     session.rollback()
     session.invalidate()
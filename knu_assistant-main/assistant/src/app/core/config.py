@@ -1,5 +1,5 @@
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseSettings, HttpUrl, PostgresDsn, validator
 
@@ -62,9 +62,105 @@ class Settings(BaseSettings):
             path=f"/{values.get('POSTGRES_DB')}",
         )
 
+    # Comma-separated list of read replicas hosts, e.g. "replica-1,replica-2:5433"
+    POSTGRES_REPLICA_HOSTS: Optional[str] = None
+    SQLALCHEMY_REPLICA_URIS: List[str] = []
+
+    @validator("SQLALCHEMY_REPLICA_URIS", pre=True, always=True)
+    def assemble_replica_connections(cls, v: Any, values: Dict[str, Any]) -> List[str]:
+        if isinstance(v, list) and v:
+            return v
+        hosts = values.get("POSTGRES_REPLICA_HOSTS") or ""
+        uris = []
+        for host in hosts.split(","):
+            host = host.strip()
+            if not host:
+                continue
+            port = None
+            if ":" in host:
+                host, port = host.split(":", 1)
+            uris.append(PostgresDsn.build(
+                scheme="postgresql",
+                user=values.get("POSTGRES_USER"),
+                password=values.get("POSTGRES_PASSWORD"),
+                host=host,
+                port=port,
+                path=f"/{values.get('POSTGRES_DB')}",
+            ))
+        return uris
+
+    # Connection pool of each engine (primary and every replica)
+    POSTGRES_POOL_SIZE: int = 40
+    POSTGRES_POOL_MAX_OVERFLOW: int = 10
+    # How long (in seconds) to wait for a free connection before failing the update
+    POSTGRES_POOL_TIMEOUT: int = 10
+
+    # Replica is skipped if its replication lag (in seconds) exceeds this value
+    POSTGRES_REPLICA_MAX_LAG: int = 10
+    # How long (in seconds) a failed or lagging replica is excluded from routing
+    POSTGRES_REPLICA_RETRY_INTERVAL: int = 30
+
+    # How often (in seconds) users' last activity is written to the database
+    ACTIVITY_FLUSH_INTERVAL: int = 5
+
+    # In-process cache of users' state
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 300
+
+    # Rendered timetables: in-process LRU in front of Redis
+    TIMETABLE_CACHE_SIZE: int = 5000
+    TIMETABLE_CACHE_TTL: int = 24 * 60 * 60
+
+    # Pre-rendered lessons, shared by all users and dates
+    LESSON_FRAGMENTS_SIZE: int = 20000
+
+    # How long (in seconds) Telegram may reuse results of an inline query for the same user
+    INLINE_QUERY_CACHE_TIME: int = 300
+
+    # Days of groups, indexed in-process for /now and /next
+    LESSONS_INDEX_SIZE: int = 10000
+    # Seconds, for which a group's timetable version is not asked from Redis again;
+    # indexed days are also trusted for this long, while versions are unavailable
+    LESSONS_INDEX_VERSION_TTL: float = 5
+
+    # Handlers, which take longer (in seconds), are logged with their DB and Telegram API time
+    SLOW_HANDLER_THRESHOLD: float = 1.0
+
+    # Port of the Prometheus metrics endpoint (GET /metrics); disabled if not set
+    METRICS_PORT: Optional[int] = None
+
+    # Port of the iCalendar feeds endpoint (GET /calendar/<tg_id>/<token>.ics);
+    # disabled if not set
+    CALENDAR_PORT: Optional[int] = None
+    # Public URL of the endpoint, shown to users by /ics, e.g. "https://example.com"
+    CALENDAR_URL: Optional[str] = None
+    # Key for tokens of feeds' URLs; the bot token is used if not set
+    CALENDAR_SECRET: Optional[str] = None
+
+    @validator("CALENDAR_SECRET", pre=True, always=True)
+    def default_calendar_secret(cls, v: Optional[str], values: Dict[str, Any]) -> str:
+        return v or values.get("TELEGRAM_BOT_TOKEN")
+
+    # Period of lessons in a feed, relative to the current date
+    CALENDAR_PAST_DAYS: int = 14
+    CALENDAR_FUTURE_DAYS: int = 120
+    # Feeds streamed at once; each holds a database connection, so it must stay well below
+    # POSTGRES_POOL_SIZE. Further requests are answered with 503 Service Unavailable
+    CALENDAR_MAX_CONNECTIONS: int = 8
+
+    # Each broadcast is sent in batches of BROADCAST_BATCH_SIZE messages every
+    # BROADCAST_BATCH_INTERVAL seconds, so a big group does not hold a worker
+    BROADCAST_BATCH_SIZE: int = 20
+    BROADCAST_BATCH_INTERVAL: float = 1.0
+    # Messages per second of all broadcasts together, to stay within Telegram limits
+    # (~30 messages per second for a bot)
+    BROADCAST_RATE_LIMIT: int = 25
+
     REDIS_HOST: str
     REDIS_PORT: int
     REDIS_DB: int
+    # Seconds; caches fall back to the database if Redis does not respond in time
+    REDIS_SOCKET_TIMEOUT: float = 0.5
     CELERY_BROKER_URL: Optional[str] = None
 
     @validator("CELERY_BROKER_URL", pre=True)
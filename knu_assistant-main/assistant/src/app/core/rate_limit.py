@@ -0,0 +1,38 @@
+"""
+Rate limits, shared by all processes through Redis
+
+Usage:
+>>> limiter = RateLimiter(redis_client, "broadcast", limit=25)
+>>> if limiter.acquire():
+...     send_message()
+"""
+
+import logging
+import time
+
+from redis import Redis
+
+__all__ = ["RateLimiter"]
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "rate_limit:"
+
+
+class RateLimiter:
+    """ Allows at most `limit` events per second, counted in one-second windows """
+
+    def __init__(self, redis: Redis, name: str, limit: int):
+        self.redis = redis
+        self.name = name
+        self.limit = limit
+
+    def acquire(self) -> bool:
+        """
+        Counts an event in the current second, unless the limit is reached.
+        Raises RedisError, if the counter is unavailable
+        """
+        key = "{}{}:{}".format(KEY_PREFIX, self.name, int(time.time()))
+        # the window is created with a TTL before it is counted, so it never outlives a few seconds
+        self.redis.set(key, 0, ex=2, nx=True)
+        return self.redis.incr(key) <= self.limit
@@ -0,0 +1,14 @@
+""" Redis client for application data (caches); Celery uses the same server as a broker """
+
+from redis import Redis
+
+from app.core.config import settings
+
+# short timeouts, so an unavailable Redis slows down nothing but itself
+redis_client = Redis(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_DB,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+)
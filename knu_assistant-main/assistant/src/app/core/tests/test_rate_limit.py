@@ -0,0 +1,19 @@
+import mock
+
+from app.core.rate_limit import RateLimiter
+from app.tests.fake_redis import FakeRedis
+
+
+def test_rate_limiter():
+    redis = FakeRedis()
+    limiter = RateLimiter(redis, "test", limit=2)
+    with mock.patch("app.core.rate_limit.time.time", return_value=100.5):
+        assert limiter.acquire()
+        assert limiter.acquire()
+        assert not limiter.acquire()
+        # the limit is shared by all limiters with the same name
+        assert not RateLimiter(redis, "test", limit=2).acquire()
+        assert RateLimiter(redis, "other", limit=2).acquire()
+    # the next second
+    with mock.patch("app.core.rate_limit.time.time", return_value=101.0):
+        assert limiter.acquire()
@@ -1,28 +1,262 @@
 import datetime as dt
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
 
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
 from sqlalchemy import (
     Column,
     ForeignKey,
+    Index,
     MetaData,
     Table,
     UniqueConstraint,
     create_engine,
+    event,
+    text,
 )
 from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import backref, relationship, sessionmaker
+from sqlalchemy.orm import Session as OrmSession, backref, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql.sqltypes import Boolean, Date, DateTime, Integer, String, Text, Time
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
-db = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_size=40, max_overflow=10)
+
+pool_checkouts = Counter(
+    "db_pool_checkouts_total", "Connections checked out from the pool", ["pool"],
+)
+pool_checkout_timeouts = Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts failed because the pool was exhausted", ["pool"],
+)
+pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ QueuePool, which records checkout wait time and timeouts """
+
+    # label of the pool in metrics; set by `create_instrumented_engine`
+    name = "default"
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_checkout_timeouts.labels(pool=self.name).inc()
+            logger.error("pool %s is exhausted: %d connections are checked out",
+                         self.name, self.checkedout())
+            raise
+        pool_checkout_wait.labels(pool=self.name).observe(time.perf_counter() - started_at)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.name = self.name
+        instrumented_pools[self.name] = pool
+        return pool
+
+
+# {name: pool} of every engine, which is created by `create_instrumented_engine`
+instrumented_pools: Dict[str, InstrumentedQueuePool] = {}
+
+
+def create_instrumented_engine(uri: str, name: str) -> Engine:
+    engine = create_engine(
+        uri,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.POSTGRES_POOL_SIZE,
+        max_overflow=settings.POSTGRES_POOL_MAX_OVERFLOW,
+        pool_timeout=settings.POSTGRES_POOL_TIMEOUT,
+    )
+    engine.pool.name = name
+    instrumented_pools[name] = engine.pool
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_checkouts.labels(pool=name).inc()
+
+    return engine
+
+
+class PoolsCollector:
+    """ Reports connections, checked out from each pool, at scrape time """
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            "db_pool_checked_out", "Connections currently checked out from the pool",
+            labels=["pool"],
+        )
+        for name, pool in instrumented_pools.items():
+            gauge.add_metric([name], pool.checkedout())
+        yield gauge
+
+
+REGISTRY.register(PoolsCollector())
+
+
+db = create_instrumented_engine(settings.SQLALCHEMY_DATABASE_URI, "primary")
+replicas = [create_instrumented_engine(uri, "replica-{}".format(idx))
+            for idx, uri in enumerate(settings.SQLALCHEMY_REPLICA_URIS)]
 Base = declarative_base()
 meta = MetaData(db)
 Session = sessionmaker(bind=db, autoflush=False)
 
+# Replication lag in seconds; 0 if the server is not a replica or has replayed everything
+REPLICATION_LAG_QUERY = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+
+
+class ReplicaRouter:
+    """
+    Chooses an engine for read-only sessions.
+    Replicas are used in a round-robin manner. Their lag is checked by a background thread,
+    so choosing an engine never waits for a database. A replica, which is unreachable or lags
+    behind the primary more than `max_lag` seconds, is excluded for `retry_interval` seconds;
+    a replica, which has not been checked recently, is not used either.
+    If no replica is available, the primary is used.
+    """
+
+    # how often (in seconds) the replication lag of each replica is checked
+    LAG_CHECK_INTERVAL = 5
+    # seconds, for which the result of a check is trusted
+    CHECK_TTL = 3 * LAG_CHECK_INTERVAL
+
+    def __init__(self, primary: Engine, replicas: List[Engine], max_lag: int, retry_interval: int):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._next_idx = 0
+        self._excluded_until: Dict[Engine, float] = {}
+        self._checked_at: Dict[Engine, float] = {}
+        self._refresher: Optional[threading.Thread] = None
+
+    def start(self):
+        """ Starts checking replicas in a daemon thread, unless it is already running """
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_forever,
+                                               name="replica-router", daemon=True)
+        self._refresher.start()
+
+    def _refresh_forever(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("failed to check replicas")
+            time.sleep(self.LAG_CHECK_INTERVAL)
+
+    def refresh(self):
+        """ Checks every replica, which is not excluded """
+        for engine in self.replicas:
+            if self._excluded_until.get(engine, 0) <= time.monotonic():
+                self.check(engine)
+
+    def check(self, engine: Engine) -> bool:
+        """ Queries the replication lag of the replica and excludes it, if it is unhealthy """
+        try:
+            with engine.connect() as connection:
+                lag = connection.execute(REPLICATION_LAG_QUERY).scalar() or 0
+        except SQLAlchemyError as e:
+            logger.warning("replica %s is unavailable: %s", engine.url.host, str(e))
+            self.exclude(engine)
+            return False
+
+        if lag > self.max_lag:
+            logger.warning("replica %s lags behind for %.1fs", engine.url.host, lag)
+            self.exclude(engine)
+            return False
+
+        self._checked_at[engine] = time.monotonic()
+        return True
+
+    def get_engine(self) -> Engine:
+        if not self.replicas:
+            return self.primary
+        self.start()
+
+        with self._lock:
+            start_idx = self._next_idx
+            self._next_idx = (self._next_idx + 1) % len(self.replicas)
+
+        for i in range(len(self.replicas)):
+            engine = self.replicas[(start_idx + i) % len(self.replicas)]
+            if self.is_available(engine):
+                return engine
+        return self.primary
+
+    def is_available(self, engine: Engine) -> bool:
+        """ Uses the result of the last check, the replica itself is not queried """
+        now = time.monotonic()
+        if self._excluded_until.get(engine, 0) > now:
+            return False
+        checked_at = self._checked_at.get(engine, None)
+        return checked_at is not None and now - checked_at < self.CHECK_TTL
+
+    def exclude(self, engine: Engine):
+        """ Excludes the replica from routing for `retry_interval` seconds """
+        if engine is self.primary:
+            return
+        self._excluded_until[engine] = time.monotonic() + self.retry_interval
+        self._checked_at.pop(engine, None)
+
+
+replica_router = ReplicaRouter(
+    primary=db,
+    replicas=replicas,
+    max_lag=settings.POSTGRES_REPLICA_MAX_LAG,
+    retry_interval=settings.POSTGRES_REPLICA_RETRY_INTERVAL,
+)
+
+
+class ReadSessionMaker(sessionmaker):
+    """ sessionmaker, which binds each new session to an available read replica """
+
+    def __call__(self, **local_kw):
+        local_kw.setdefault("bind", replica_router.get_engine())
+        return super().__call__(**local_kw)
+
+
+# Session for read-only operations (e.g. timetable rendering). Must never be used for writes.
+ReadSession = ReadSessionMaker(autoflush=False)
+
+
+@contextmanager
+def session_scope(session_factory: sessionmaker = Session) -> Iterator[OrmSession]:
+    """
+    Provides a session, which is rolled back if the block raises and is always closed,
+    so its connection is returned to the pool
+    """
+    session = session_factory()
+    try:
+        yield session
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
 
 class User(Base):
     __tablename__ = "users"
@@ -164,7 +398,8 @@ class SingleLesson(Base):
 LessonTeacher = Table(
     "lessons_teachers", Base.metadata,
     Column("lesson_id", Integer, ForeignKey("lessons.id")),
-    Column("teacher_id", Integer, ForeignKey("teachers.id")),
+    # teachers' timetables are looked up by teacher
+    Column("teacher_id", Integer, ForeignKey("teachers.id"), index=True),
 )
 
 # If lesson is divided into subgroups, match each one with its members (users)
@@ -175,6 +410,16 @@ LessonSubgroupMember = Table(
 )
 
 
+# TODO: move to enum with representation ability
+LESSON_FORMATS = {
+    0: "лекція",
+    1: "семінар",
+    2: "практика",
+    3: "лабораторна",
+    4: "інш.",
+}
+
+
 class Lesson(Base):
     __tablename__ = "lessons"
 
@@ -218,15 +463,7 @@ class Lesson(Base):
     )
 
     def represent_lesson_format(self):
-        # TODO: move to enum with representation ability
-        names = {
-            0: "лекція",
-            1: "семінар",
-            2: "практика",
-            3: "лабораторна",
-            4: "інш.",
-        }
-        return names[self.lesson_format]
+        return LESSON_FORMATS[self.lesson_format]
 
     def __repr__(self):
         return "<Lesson(id={}, name={})>".format(self.id, self.name)
@@ -240,6 +477,17 @@ class Lesson(Base):
         return name
 
 
+def teacher_full_name(last_name: str, first_name: str, middle_name: str) -> str:
+    return " ".join((last_name, first_name, middle_name)).strip()
+
+
+def teacher_short_name(last_name: str, first_name: str, middle_name: str) -> str:
+    """ Last name and initials, e.g. "Шевченко Т. Г." """
+    if first_name and middle_name:
+        return "{} {}. {}.".format(last_name, first_name[0], middle_name[0])
+    return last_name
+
+
 class Teacher(Base):
     __tablename__ = "teachers"
 
@@ -260,6 +508,11 @@ class Teacher(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        UniqueConstraint("last_name", "first_name", "middle_name",
+                         name="teacher_full_name_key"),
+    )
+
     def __repr__(self):
         return "<Teacher(id={}, first_name={}, last_name={}, middle_name={})>" \
             .format(self.id, self.first_name, self.last_name, self.middle_name)
@@ -269,13 +522,11 @@ class Teacher(Base):
 
     @property
     def full_name(self):
-        return " ".join((self.last_name, self.first_name, self.middle_name)).strip()
+        return teacher_full_name(self.last_name, self.first_name, self.middle_name)
 
     @property
     def short_name(self):
-        if self.first_name and self.middle_name:
-            return "{} {}. {}.".format(self.last_name, self.first_name[0], self.middle_name[0])
-        return self.last_name
+        return teacher_short_name(self.last_name, self.first_name, self.middle_name)
 
 
 class Request(Base):
@@ -348,3 +599,98 @@ class Request(Base):
     def __repr__(self):
         return "<Request(id={}, students_group_id={})>" \
             .format(self.id, self.students_group_id)
+
+
+class Broadcast(Base):
+    """ Message from a moderator to all students of their group """
+    __tablename__ = "broadcasts"
+
+    id = Column(
+        Integer,
+        primary_key=True,
+    )
+
+    students_group_id = Column(
+        Integer,
+        ForeignKey("students_groups.id"),
+        nullable=False,
+    )
+
+    # moderator who sent this broadcast
+    author_id = Column(
+        Integer,
+        ForeignKey("users.tg_id"),
+        nullable=False,
+    )
+
+    message = Column(
+        Text,
+        nullable=False,
+    )
+
+    created_at = Column(
+        DateTime,
+        nullable=False,
+        default=dt.datetime.now,
+    )
+
+    # set once the message is delivered (or failed) to all recipients
+    finished_at = Column(
+        DateTime,
+        nullable=True,
+    )
+
+    students_group = relationship("StudentsGroup")
+    author = relationship("User")
+
+    def __repr__(self):
+        return "<Broadcast(id={}, students_group_id={})>" \
+            .format(self.id, self.students_group_id)
+
+
+# Delivery statuses of a broadcast to a recipient
+BROADCAST_PENDING = "pending"
+BROADCAST_SENT = "sent"
+BROADCAST_FAILED = "failed"
+
+
+class BroadcastRecipient(Base):
+    __tablename__ = "broadcast_recipients"
+
+    broadcast_id = Column(
+        Integer,
+        ForeignKey("broadcasts.id"),
+        primary_key=True,
+    )
+    user_id = Column(
+        Integer,
+        ForeignKey("users.tg_id"),
+        primary_key=True,
+    )
+
+    status = Column(
+        String,
+        nullable=False,
+        default=BROADCAST_PENDING,
+    )
+
+    # Telegram error, if the delivery failed
+    error = Column(
+        Text,
+        nullable=True,
+    )
+
+    sent_at = Column(
+        DateTime,
+        nullable=True,
+    )
+
+    __table_args__ = (
+        # pending recipients are taken in batches
+        Index("broadcast_recipients_pending_idx", "broadcast_id", "user_id",
+              postgresql_where=(status == BROADCAST_PENDING)),
+    )
+
+    def __repr__(self):
+        return "<BroadcastRecipient(broadcast_id={}, user_id={}, status={})>" \
+            .format(self.broadcast_id, self.user_id, self.status)
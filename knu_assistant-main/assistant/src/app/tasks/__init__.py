@@ -1 +1,2 @@
+from .broadcast import send_broadcast
 from .timetable import tomorrow_timetable
@@ -0,0 +1,116 @@
+""" Delivery of moderators' broadcasts """
+
+import datetime as dt
+import logging
+
+import telegram.error
+from redis import RedisError
+from sqlalchemy import func, select, update
+
+from app.bot.api import bot
+from app.core.celery import app
+from app.core.config import settings
+from app.core.rate_limit import RateLimiter
+from app.core.redis import redis_client
+from app.database import (
+    BROADCAST_FAILED,
+    BROADCAST_PENDING,
+    BROADCAST_SENT,
+    Broadcast,
+    BroadcastRecipient,
+    Session,
+    session_scope,
+)
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_HEADER = "\U0001F4E2 Повідомлення від модератора групи:\n\n"
+
+# shared by all broadcasts, which are being sent by any worker
+broadcast_limiter = RateLimiter(redis_client, "broadcast", settings.BROADCAST_RATE_LIMIT)
+
+
+def send_batch(session, broadcast: Broadcast) -> float:
+    """
+    Sends the broadcast to the next batch of pending recipients
+    :return: seconds to wait before the next batch, 0 if no recipients are pending
+    """
+    recipients = session.execute(
+        select(BroadcastRecipient.user_id)
+        .where((BroadcastRecipient.broadcast_id == broadcast.id) &
+               (BroadcastRecipient.status == BROADCAST_PENDING))
+        .order_by(BroadcastRecipient.user_id)
+        .limit(settings.BROADCAST_BATCH_SIZE)
+    ).scalars().all()
+    if not recipients:
+        return 0
+
+    delay = settings.BROADCAST_BATCH_INTERVAL
+    for user_id in recipients:
+        try:
+            allowed = broadcast_limiter.acquire()
+        except RedisError as e:
+            logger.warning("broadcast rate limit is unavailable: %s", str(e))
+            allowed = False
+        if not allowed:
+            # other broadcasts have used up this second; the rest waits for the next batch
+            break
+
+        status, error = BROADCAST_SENT, None
+        try:
+            # the message is sent as is, without markup, so moderators can not break it
+            bot.send_message(chat_id=user_id, text=BROADCAST_HEADER + broadcast.message)
+        except telegram.error.RetryAfter as e:
+            # flood limit: the rest of the batch stays pending until Telegram allows
+            logger.warning("broadcast %s is throttled for %ss", broadcast.id, e.retry_after)
+            delay = max(delay, float(e.retry_after))
+            break
+        except telegram.error.TelegramError as e:
+            # e.g. the user blocked the bot
+            status, error = BROADCAST_FAILED, str(e)
+        session.execute(
+            update(BroadcastRecipient)
+            .where((BroadcastRecipient.broadcast_id == broadcast.id) &
+                   (BroadcastRecipient.user_id == user_id))
+            .values(status=status, error=error, sent_at=dt.datetime.now())
+        )
+        # committed one by one, so a task, which is retried after a crash,
+        # sends again at most a single message
+        session.commit()
+    return delay
+
+
+def finish(session, broadcast: Broadcast):
+    counts = dict(session.execute(
+        select(BroadcastRecipient.status, func.count())
+        .where(BroadcastRecipient.broadcast_id == broadcast.id)
+        .group_by(BroadcastRecipient.status)
+    ).all())
+    broadcast.finished_at = dt.datetime.now()
+    session.commit()
+    try:
+        bot.send_message(
+            chat_id=broadcast.author_id,
+            text="Повідомлення #{} надіслано: {} отримали, {} не вдалося доставити".format(
+                broadcast.id, counts.get(BROADCAST_SENT, 0), counts.get(BROADCAST_FAILED, 0)),
+        )
+    except telegram.error.TelegramError as e:
+        logger.warning("failed to report broadcast %s: %s", broadcast.id, str(e))
+
+
+@app.task(bind=True)
+def send_broadcast(self, broadcast_id: int):
+    """
+    Sends a single batch of the broadcast and reschedules itself for the next one,
+    so a worker is not blocked by a big group and batches are spread in time
+    """
+    with session_scope(Session) as session:
+        broadcast = session.query(Broadcast).get(broadcast_id)
+        if broadcast is None or broadcast.finished_at is not None:
+            return
+
+        delay = send_batch(session, broadcast)
+        if delay:
+            self.apply_async((broadcast_id,), countdown=delay)
+        else:
+            finish(session, broadcast)
@@ -0,0 +1,111 @@
+import mock
+import pytest
+import telegram.error
+
+from app.bot.api import bot
+from app.database import (
+    BROADCAST_FAILED,
+    BROADCAST_PENDING,
+    BROADCAST_SENT,
+    Broadcast,
+    BroadcastRecipient,
+)
+from app.tests.factories import StudentsGroupFactory, UserFactory
+from app.tests.fake_redis import FakeRedis
+
+
+@pytest.fixture(autouse=True)
+def limiter_redis():
+    """ The global rate limit is counted in memory """
+    with mock.patch("app.tasks.broadcast.broadcast_limiter.redis", FakeRedis()) as redis:
+        yield redis
+
+
+def make_broadcast(db_session, recipients: int) -> Broadcast:
+    group = StudentsGroupFactory()
+    author = UserFactory(students_group=group, is_group_moderator=True)
+    users = [UserFactory(students_group=group) for _ in range(recipients)]
+    db_session.commit()
+    broadcast = Broadcast(students_group_id=group.id, author_id=author.tg_id, message="Hi")
+    db_session.add(broadcast)
+    db_session.flush()
+    for user in users:
+        db_session.add(BroadcastRecipient(broadcast_id=broadcast.id, user_id=user.tg_id))
+    db_session.commit()
+    return broadcast
+
+
+def statuses(db_session, broadcast: Broadcast):
+    return sorted(recipient.status for recipient in
+                  db_session.query(BroadcastRecipient).filter_by(broadcast_id=broadcast.id))
+
+
+class TestSendBatch:
+
+    def test_batches(self, db_session, mocker):
+        from app.tasks.broadcast import send_batch
+        broadcast = make_broadcast(db_session, 3)
+        send_message = mocker.patch.object(bot, "send_message")
+
+        with mock.patch("app.tasks.broadcast.settings.BROADCAST_BATCH_SIZE", 2):
+            assert send_batch(db_session, broadcast) > 0
+            assert send_message.call_count == 2
+            assert send_batch(db_session, broadcast) > 0
+            assert send_batch(db_session, broadcast) == 0
+        assert send_message.call_count == 3
+        assert send_message.call_args.kwargs["text"].endswith("Hi")
+        assert statuses(db_session, broadcast) == [BROADCAST_SENT] * 3
+
+    def test_errors(self, db_session, mocker):
+        from app.tasks.broadcast import send_batch
+        broadcast = make_broadcast(db_session, 3)
+        mocker.patch.object(bot, "send_message", side_effect=[
+            None,
+            telegram.error.Unauthorized("Forbidden: bot was blocked by the user"),
+            telegram.error.RetryAfter(5),
+        ])
+
+        # the throttled recipient is left for the next batch
+        assert send_batch(db_session, broadcast) == 5
+        assert statuses(db_session, broadcast) == [BROADCAST_FAILED, BROADCAST_PENDING,
+                                                   BROADCAST_SENT]
+
+    def test_rate_limit(self, db_session, mocker):
+        from app.tasks.broadcast import send_batch
+        first, second = make_broadcast(db_session, 2), make_broadcast(db_session, 2)
+        send_message = mocker.patch.object(bot, "send_message")
+
+        # the limit is shared by both broadcasts, which are sent within the same second
+        with mock.patch("app.tasks.broadcast.broadcast_limiter.limit", 3), \
+                mock.patch("app.core.rate_limit.time.time", return_value=100.0):
+            assert send_batch(db_session, first) > 0
+            assert send_batch(db_session, second) > 0
+        assert send_message.call_count == 3
+        assert statuses(db_session, second) == [BROADCAST_PENDING, BROADCAST_SENT]
+
+    def test_committed_per_recipient(self, db_session, mocker):
+        from app.tasks.broadcast import send_batch
+        broadcast = make_broadcast(db_session, 2)
+        mocker.patch.object(bot, "send_message", side_effect=[None, RuntimeError()])
+
+        with pytest.raises(RuntimeError):
+            send_batch(db_session, broadcast)
+        db_session.rollback()
+        # the delivered message is not sent again by a retry
+        assert statuses(db_session, broadcast) == [BROADCAST_PENDING, BROADCAST_SENT]
+
+
+def test_send_broadcast(db_session, mocker):
+    from app.tasks.broadcast import send_broadcast
+    broadcast = make_broadcast(db_session, 1)
+    send_message = mocker.patch.object(bot, "send_message")
+    apply_async = mocker.patch.object(send_broadcast, "apply_async")
+    mocker.patch("app.tasks.broadcast.session_scope").return_value.__enter__.return_value = \
+        db_session
+
+    send_broadcast(broadcast.id)
+    apply_async.assert_called_once()
+    send_broadcast(broadcast.id)
+    # the report to the author
+    assert send_message.call_args.kwargs["chat_id"] == broadcast.author_id
+    assert db_session.query(Broadcast).get(broadcast.id).finished_at is not None
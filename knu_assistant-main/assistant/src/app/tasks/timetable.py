@@ -9,20 +9,34 @@ from app.bot.commands.timetable import build_timetable_day
 from app.bot.api import bot
 from app.bot.dictionaries import week
 from app.core.config import settings
-from app.database import Session, User
+from app.database import ReadSession, User, session_scope
 from app.core.celery import app
+from app.timetable.queries import (
+    filter_user_lessons,
+    get_groups_lessons_between,
+    get_subgroups_members,
+)
 
 
 @app.task
 def tomorrow_timetable():
     """ Sends each user their timetable for the next day, if present """
-    session = Session()
-    users = session.query(User).all()
     tomorrow = dt.datetime.today().date() + dt.timedelta(days=1)
+
+    # load everything in bulk instead of querying each user's timetable
+    with session_scope(ReadSession) as session:
+        users = session.query(User.tg_id, User.students_group_id) \
+            .filter(User.students_group_id != None) \
+            .all()
+        groups_lessons = get_groups_lessons_between(session, tomorrow, tomorrow)
+        subgroups = get_subgroups_members(session)
+
     for user in users:
-        timetable = build_timetable_day(session, user, tomorrow)
-        if not timetable:
+        lessons = filter_user_lessons(groups_lessons.get(user.students_group_id, []),
+                                      subgroups.get(user.tg_id, set()))
+        if not lessons:
             continue
+        timetable = build_timetable_day(session, user, tomorrow, lessons=lessons)
         message = "Твій розклад на завтра ({day}):\n\n{timetable}\n\n".format(
             day=week.LIST[tomorrow.weekday()].name,
             timetable=timetable,
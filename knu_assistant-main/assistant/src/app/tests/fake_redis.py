@@ -0,0 +1,48 @@
+"""
+In-memory stand-in for Redis, so tests never touch a real server.
+
+Usage:
+>>> with mock.patch.object(timetable_cache, "redis", FakeRedis()):
+...     timetable_cache.clear()
+"""
+
+from fnmatch import fnmatchcase
+
+import mock
+
+__all__ = ["FakeRedis"]
+
+
+class FakeRedis:
+    """ Subset of Redis API, used by the application """
+
+    def __init__(self):
+        self.data = dict()
+
+    def get(self, key):
+        return self.data.get(key, None)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def mget(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match="*"):
+        return iter([key for key in self.data if fnmatchcase(key, match)])
+
+    def pipeline(self, transaction=True):
+        pipeline = mock.MagicMock()
+        pipeline.incr.side_effect = self.incr
+        pipeline.set.side_effect = self.set
+        return pipeline
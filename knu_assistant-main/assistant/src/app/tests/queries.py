@@ -0,0 +1,80 @@
+"""
+Test helpers to catch query regressions (e.g. N+1 lazy loads).
+
+Usage:
+>>> with query_budget(3):
+...     build_timetable_day(db_session, user, date)
+"""
+
+import re
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.database import db
+
+__all__ = ["QueryRecorder", "query_budget", "statement_shape"]
+
+PARAMETER_MASK = re.compile(r"%\(\w+\)s|\?|:\w+")
+# expanded IN lists, e.g. "IN (?, ?, ?)"
+PARAMETERS_LIST_MASK = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SPACES_MASK = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """ Statement with normalized whitespace and parameters, regardless of their number """
+    shape = PARAMETER_MASK.sub("?", statement)
+    shape = PARAMETERS_LIST_MASK.sub("(?)", shape)
+    return SPACES_MASK.sub(" ", shape).strip()
+
+
+class QueryRecorder:
+    """ Records statements, executed by the engine while the recorder is active """
+
+    def __init__(self, engine: Engine = db):
+        self.engine = engine
+        self.statements: List[str] = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryRecorder":
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def repeated(self, max_repeats: int = 1) -> Dict[str, int]:
+        """ Statement shapes, which were executed more than `max_repeats` times """
+        shapes = Counter(statement_shape(statement) for statement in self.statements)
+        return {shape: count for shape, count in shapes.items() if count > max_repeats}
+
+    def report(self) -> str:
+        return "\n".join("{}. {}".format(idx, statement_shape(statement))
+                         for idx, statement in enumerate(self.statements, start=1))
+
+
+@contextmanager
+def query_budget(max_queries: int, max_repeats: int = 1,
+                 engine: Engine = db) -> Iterator[QueryRecorder]:
+    """
+    Fails if the block executes more than `max_queries` statements,
+    or the same statement shape more than `max_repeats` times (a likely N+1)
+    """
+    with QueryRecorder(engine) as recorder:
+        yield recorder
+
+    assert recorder.count <= max_queries, \
+        "{} statements executed, the budget is {}:\n{}".format(
+            recorder.count, max_queries, recorder.report())
+    repeated = recorder.repeated(max_repeats)
+    assert not repeated, "repeated statements (possible N+1):\n{}".format(
+        "\n".join("{}x {}".format(count, shape) for shape, count in repeated.items()))
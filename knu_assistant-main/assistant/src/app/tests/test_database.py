@@ -1,5 +1,17 @@
-from sqlalchemy.orm import Session
+import time
 
+import mock
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.database import (
+    InstrumentedQueuePool,
+    ReplicaRouter,
+    instrumented_pools,
+    session_scope,
+)
 from app.tests.factories import LessonFactory, TeacherFactory
 
 
@@ -49,3 +61,138 @@ class TestTeacher:
 
         jones = TeacherFactory(first_name="", middle_name="O", last_name="Jones")
         assert jones.short_name == "Jones"
+
+
+class TestReplicaRouter:
+
+    @pytest.fixture(autouse=True)
+    def no_refresher(self):
+        """ Replicas are checked by the tests, rather than by a background thread """
+        with mock.patch.object(ReplicaRouter, "start"):
+            yield
+
+    def replica(self, lag=0, error=None):
+        engine = mock.MagicMock()
+        connection = engine.connect.return_value.__enter__.return_value
+        if error is not None:
+            connection.execute.side_effect = error
+        else:
+            connection.execute.return_value.scalar.return_value = lag
+        return engine
+
+    def test_without_replicas(self):
+        primary = mock.MagicMock()
+        router = ReplicaRouter(primary, [], max_lag=10, retry_interval=30)
+        assert router.get_engine() is primary
+
+    def test_round_robin(self):
+        primary = mock.MagicMock()
+        replica_1, replica_2 = self.replica(), self.replica()
+        router = ReplicaRouter(primary, [replica_1, replica_2], max_lag=10, retry_interval=30)
+        router.refresh()
+        assert router.get_engine() is replica_1
+        assert router.get_engine() is replica_2
+        assert router.get_engine() is replica_1
+        # routing reads results of the checks only
+        assert replica_1.connect.call_count == 1
+
+    def test_not_checked(self):
+        primary = mock.MagicMock()
+        replica = self.replica()
+        router = ReplicaRouter(primary, [replica], max_lag=10, retry_interval=30)
+        assert router.get_engine() is primary
+        assert replica.connect.call_count == 0
+
+    def test_outdated_check(self):
+        primary = mock.MagicMock()
+        replica = self.replica()
+        router = ReplicaRouter(primary, [replica], max_lag=10, retry_interval=30)
+        router.refresh()
+        later = time.monotonic() + ReplicaRouter.CHECK_TTL + 1
+        with mock.patch("app.database.time.monotonic", return_value=later):
+            assert router.get_engine() is primary
+
+    def test_lagging_replica(self):
+        primary = mock.MagicMock()
+        lagging, healthy = self.replica(lag=60), self.replica()
+        router = ReplicaRouter(primary, [lagging, healthy], max_lag=10, retry_interval=30)
+        router.refresh()
+        assert router.get_engine() is healthy
+        assert router.get_engine() is healthy
+
+    def test_failed_replicas_fallback(self):
+        primary = mock.MagicMock()
+        failed = self.replica(error=OperationalError("SELECT 1", {}, Exception("down")))
+        router = ReplicaRouter(primary, [failed], max_lag=10, retry_interval=30)
+        router.refresh()
+        assert router.get_engine() is primary
+        # the replica is excluded and not checked again until retry_interval passes
+        router.refresh()
+        assert router.get_engine() is primary
+        assert failed.connect.call_count == 1
+
+    def test_exclude(self):
+        primary = mock.MagicMock()
+        replica = self.replica()
+        router = ReplicaRouter(primary, [replica], max_lag=10, retry_interval=30)
+        router.refresh()
+        assert router.get_engine() is replica
+        router.exclude(replica)
+        assert router.get_engine() is primary
+
+
+class TestInstrumentedQueuePool:
+
+    def pool(self, name):
+        pool = InstrumentedQueuePool(mock.MagicMock, pool_size=1, max_overflow=0, timeout=0.01)
+        pool.name = name
+        return pool
+
+    def test_checkout_wait(self):
+        pool = self.pool("test_checkout_wait")
+        connection = pool.connect()
+        assert REGISTRY.get_sample_value(
+            "db_pool_checkout_wait_seconds_count", {"pool": "test_checkout_wait"}) == 1
+        assert pool.checkedout() == 1
+        connection.close()
+        assert pool.checkedout() == 0
+
+    def test_timeout(self):
+        pool = self.pool("test_timeout")
+        pool.connect()
+        with pytest.raises(PoolTimeoutError):
+            pool.connect()
+        assert REGISTRY.get_sample_value(
+            "db_pool_checkout_timeouts_total", {"pool": "test_timeout"}) == 1
+
+    def test_checked_out(self):
+        pool = self.pool("test_checked_out")
+        with mock.patch.dict(instrumented_pools, {"test_checked_out": pool}):
+            connection = pool.connect()
+            assert REGISTRY.get_sample_value(
+                "db_pool_checked_out", {"pool": "test_checked_out"}) == 1
+            connection.close()
+            assert REGISTRY.get_sample_value(
+                "db_pool_checked_out", {"pool": "test_checked_out"}) == 0
+
+    def test_recreate(self):
+        pool = self.pool("test_recreate")
+        assert pool.recreate().name == "test_recreate"
+
+
+class TestSessionScope:
+
+    def test_close(self):
+        with mock.patch.object(sessionmaker, "__call__") as session_mock:
+            with session_scope() as session:
+                assert session is session_mock.return_value
+            assert session.close.call_count == 1
+            assert session.rollback.call_count == 0
+
+    def test_rollback_on_error(self):
+        with mock.patch.object(sessionmaker, "__call__") as session_mock:
+            with pytest.raises(ValueError):
+                with session_scope():
+                    raise ValueError()
+            assert session_mock.return_value.rollback.call_count == 1
+            assert session_mock.return_value.close.call_count == 1
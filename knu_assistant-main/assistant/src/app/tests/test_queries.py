@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.tests.queries import QueryRecorder, query_budget, statement_shape
+
+
+def test_statement_shape():
+    assert statement_shape("SELECT *\n  FROM lessons WHERE id = %(pk_1)s") == \
+        "SELECT * FROM lessons WHERE id = ?"
+    assert statement_shape("SELECT * FROM lessons WHERE id IN (%(id_1_1)s, %(id_1_2)s)") == \
+        statement_shape("SELECT * FROM lessons WHERE id IN (%(id_1_1)s)")
+
+
+class TestQueryBudget:
+
+    @pytest.fixture()
+    def engine(self):
+        return create_engine("sqlite://")
+
+    def test_recorder(self, engine):
+        with QueryRecorder(engine) as recorder:
+            with engine.connect() as connection:
+                for i in range(3):
+                    connection.execute(text("SELECT :i"), {"i": i})
+                connection.execute(text("SELECT 1"))
+        assert recorder.count == 4
+        assert recorder.repeated() == {"SELECT ?": 3}
+
+    def test_within_budget(self, engine):
+        with query_budget(2, engine=engine):
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+
+    def test_over_budget(self, engine):
+        with pytest.raises(AssertionError, match="3 statements executed, the budget is 2"):
+            with query_budget(2, max_repeats=3, engine=engine):
+                with engine.connect() as connection:
+                    for i in range(3):
+                        connection.execute(text("SELECT :i"), {"i": i})
+
+    def test_repeated(self, engine):
+        with pytest.raises(AssertionError, match="possible N\\+1"):
+            with query_budget(10, engine=engine):
+                with engine.connect() as connection:
+                    for i in range(2):
+                        connection.execute(text("SELECT :i"), {"i": i})
@@ -0,0 +1 @@
+""" Timetable queries and rendering helpers """
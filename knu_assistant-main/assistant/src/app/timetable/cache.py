@@ -0,0 +1,162 @@
+"""
+Cache of rendered timetables: an in-process LRU in front of Redis.
+
+Keys include a per-group version, stored in Redis. The version is incremented whenever
+the group's timetable changes (see `TimetableCache.invalidate_groups`), so stale entries
+are never read again and simply expire. If Redis is unavailable, timetables are rendered
+without caching.
+"""
+
+import datetime as dt
+import logging
+import threading
+import time
+from typing import AbstractSet, Callable, Iterable, List, Optional, Tuple
+
+from cachetools import TTLCache
+from redis import Redis, RedisError
+
+from app.core.config import settings
+from app.core.redis import redis_client
+
+__all__ = ["DAY", "MONTH", "WEEK", "TimetableCache", "timetable_cache"]
+
+logger = logging.getLogger(__name__)
+
+# kinds of rendered timetables
+DAY = "day"
+WEEK = "week"
+MONTH = "month"
+
+KEY_PREFIX = "timetable:"
+
+
+class TimetableCache:
+
+    def __init__(self, redis: Redis, maxsize: int, ttl: int):
+        self.redis = redis
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._invalidation_listeners: List[Callable[[AbstractSet[int]], None]] = []
+
+    @staticmethod
+    def version_key(students_group_id: int) -> str:
+        return "{}version:{}".format(KEY_PREFIX, students_group_id)
+
+    @staticmethod
+    def modified_key(students_group_id: int) -> str:
+        return "{}modified:{}".format(KEY_PREFIX, students_group_id)
+
+    def group_version(self, students_group_id: int) -> int:
+        """ Raises RedisError, if the version is unavailable """
+        return int(self.redis.get(self.version_key(students_group_id)) or 0)
+
+    def group_revision(self, students_group_id: int) -> Tuple[int, Optional[dt.datetime]]:
+        """
+        Version of the group's timetable and the time (UTC) it was last invalidated,
+        which is None if the group was not invalidated since versions were created.
+        Raises RedisError, if the version is unavailable
+        """
+        version, modified = self.redis.mget(self.version_key(students_group_id),
+                                            self.modified_key(students_group_id))
+        if modified is not None:
+            modified = dt.datetime.fromtimestamp(int(modified), dt.timezone.utc)
+        return int(version or 0), modified
+
+    def build_key(self, kind: str, students_group_id: int, subgroups_ids: Iterable[int],
+                  date: dt.date) -> str:
+        """ Raises RedisError, if the group version is unavailable """
+        version = self.group_version(students_group_id)
+        return "{prefix}{kind}:{group}:v{version}:{subgroups}:{date}".format(
+            prefix=KEY_PREFIX,
+            kind=kind,
+            group=students_group_id,
+            version=version,
+            subgroups=",".join(str(i) for i in sorted(subgroups_ids)) or "-",
+            date=date.isoformat(),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._local.get(key, None)
+        if value is not None:
+            return value
+
+        value = self.redis.get(key)
+        if value is None:
+            return None
+        value = value.decode("utf-8")
+        with self._lock:
+            self._local[key] = value
+        return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._local[key] = value
+        self.redis.set(key, value.encode("utf-8"), ex=self.ttl)
+
+    def get_or_render(self, kind: str, students_group_id: Optional[int],
+                      subgroups_ids: Iterable[int], date: dt.date,
+                      render: Callable[[], str]) -> str:
+        """
+        :param date: the day or any other date, that identifies the rendered period
+            (e.g. Monday for a week, the first day for a month)
+        :param render: renders the timetable on a cache miss
+        """
+        if students_group_id is None:
+            return render()
+
+        try:
+            key = self.build_key(kind, students_group_id, subgroups_ids, date)
+            value = self.get(key)
+        except RedisError as e:
+            logger.warning("timetable cache is unavailable: %s", str(e))
+            return render()
+        if value is not None:
+            return value
+
+        value = render()
+        try:
+            self.set(key, value)
+        except RedisError as e:
+            logger.warning("timetable cache is unavailable: %s", str(e))
+        return value
+
+    def add_invalidation_listener(self, listener: Callable[[AbstractSet[int]], None]):
+        """ The listener is called with ids of groups, which are invalidated by this process """
+        self._invalidation_listeners.append(listener)
+
+    def invalidate_groups(self, students_groups_ids: Iterable[int]):
+        """ Must be called, after timetables of the groups are changed and committed """
+        students_groups_ids = set(students_groups_ids)
+        for listener in self._invalidation_listeners:
+            listener(students_groups_ids)
+
+        pipeline = self.redis.pipeline(transaction=False)
+        modified = int(time.time())
+        for students_group_id in students_groups_ids:
+            pipeline.incr(self.version_key(students_group_id))
+            pipeline.set(self.modified_key(students_group_id), modified)
+        try:
+            pipeline.execute()
+        except RedisError as e:
+            logger.error("failed to invalidate timetable cache: %s", str(e))
+
+    def clear(self):
+        """ Drops all cached timetables and groups versions """
+        with self._lock:
+            self._local.clear()
+        try:
+            keys = list(self.redis.scan_iter(match=KEY_PREFIX + "*"))
+            if keys:
+                self.redis.delete(*keys)
+        except RedisError as e:
+            logger.error("failed to clear timetable cache: %s", str(e))
+
+
+timetable_cache = TimetableCache(
+    redis=redis_client,
+    maxsize=settings.TIMETABLE_CACHE_SIZE,
+    ttl=settings.TIMETABLE_CACHE_TTL,
+)
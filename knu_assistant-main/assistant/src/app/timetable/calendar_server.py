@@ -0,0 +1,142 @@
+"""
+HTTP endpoint of users' iCalendar feeds, which calendar apps subscribe to:
+GET /calendar/<tg_id>/<token>.ics (see app.timetable.ics.calendar_token)
+
+Feeds are validated with ETag and Last-Modified before any lesson is loaded,
+and are streamed to the client while the lessons are read from the database.
+A streamed feed holds a database connection, so only CALENDAR_MAX_CONNECTIONS feeds
+are served at once.
+"""
+
+import datetime as dt
+import email.utils
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlsplit
+
+from app.bot.users import UserSnapshot, user_cache
+from app.core.config import settings
+from app.database import ReadSession, User, session_scope
+from app.timetable.cache import timetable_cache
+from app.timetable.ics import CONTENT_TYPE, Feed, build_feed, check_calendar_token, encode_lines
+
+__all__ = ["CALENDAR_NAME", "CalendarRequestHandler", "calendar_path", "start_http_server"]
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_NAME = "Розклад занять"
+PATH_PATTERN = re.compile(r"^/calendar/(\d+)/([0-9a-f]{32})\.ics$")
+# seconds, after which a client is asked to retry, if all connections are busy
+RETRY_AFTER = 60
+
+# feeds, which are being served
+_connections = threading.BoundedSemaphore(settings.CALENDAR_MAX_CONNECTIONS)
+
+
+def calendar_path(tg_id: int, token: str) -> str:
+    return "/calendar/{}/{}.ics".format(tg_id, token)
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[dt.datetime]:
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_modified(feed: Feed, if_none_match: Optional[str],
+                    if_modified_since: Optional[str]) -> bool:
+    """
+    RFC 7232: If-None-Match takes precedence over If-Modified-Since.
+    Last-Modified does not change with the user's subgroups, so If-Modified-Since alone
+    is not trusted, when the feed has an ETag.
+    """
+    if if_none_match is not None:
+        if feed.etag is None:
+            return False
+        return feed.etag in (tag.strip() for tag in if_none_match.split(",")) \
+            or if_none_match.strip() == "*"
+    if feed.etag is not None:
+        return False
+    since = _parse_http_date(if_modified_since)
+    if since is None or feed.last_modified is None or since.tzinfo is None:
+        return False
+    return feed.last_modified.replace(microsecond=0) <= since
+
+
+class CalendarRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        match = PATH_PATTERN.match(urlsplit(self.path).path)
+        if match is None or not check_calendar_token(int(match.group(1)), match.group(2)):
+            self.send_error(404)
+            return
+        tg_id = int(match.group(1))
+
+        if not _connections.acquire(blocking=False):
+            logger.warning("calendar feed of %s is rejected: all connections are busy", tg_id)
+            self.send_response(503)
+            self.send_header("Retry-After", str(RETRY_AFTER))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            self._send_feed(tg_id)
+        finally:
+            _connections.release()
+
+    def _send_feed(self, tg_id: int):
+        with session_scope(ReadSession) as session:
+            user = user_cache.get(tg_id)
+            if user is None:
+                db_user = session.query(User).get(tg_id)
+                if db_user is not None:
+                    user = UserSnapshot.from_user(session, db_user)
+                    user_cache.set(user)
+            if user is None or user.students_group_id is None:
+                self.send_error(404)
+                return
+
+            feed = build_feed(session, timetable_cache, user, CALENDAR_NAME)
+            if is_not_modified(feed, self.headers.get("If-None-Match"),
+                               self.headers.get("If-Modified-Since")):
+                self.send_response(304)
+                self._send_validators(feed)
+                self.end_headers()
+                return
+
+            # the length is unknown until the feed is generated,
+            # so the response ends when the connection is closed
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Disposition", 'inline; filename="timetable.ics"')
+            self.send_header("Connection", "close")
+            self._send_validators(feed)
+            self.end_headers()
+            for chunk in encode_lines(feed.lines):
+                self.wfile.write(chunk)
+
+    def _send_validators(self, feed: Feed):
+        self.send_header("Cache-Control", "private, no-cache")
+        if feed.etag is not None:
+            self.send_header("ETag", feed.etag)
+        if feed.last_modified is not None:
+            self.send_header("Last-Modified",
+                             email.utils.format_datetime(feed.last_modified, usegmt=True))
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_http_server(port: int, addr: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """ Serves users' calendar feeds in a daemon thread """
+    server = ThreadingHTTPServer((addr, port), CalendarRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info("serving calendars on %s:%s", addr, port)
+    return server
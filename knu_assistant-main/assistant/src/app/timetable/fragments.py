@@ -0,0 +1,52 @@
+"""
+Pre-rendered lesson bodies (name, format, teachers and link), shared by all users and dates.
+
+A fragment is stored together with the LessonRow it was rendered from and is re-rendered
+as soon as the row differs, so changes made by other processes (e.g. the scrapper)
+are picked up without any invalidation.
+"""
+
+import logging
+import threading
+from typing import Callable
+
+from cachetools import LRUCache
+
+from app.core.config import settings
+from app.timetable.models import LessonRow
+
+__all__ = ["LessonFragments", "lesson_fragments"]
+
+logger = logging.getLogger(__name__)
+
+
+class LessonFragments:
+
+    def __init__(self, maxsize: int):
+        self._lock = threading.Lock()
+        # {lesson id: (LessonRow, rendered fragment)}
+        self._fragments = LRUCache(maxsize=maxsize)
+
+    def get_or_render(self, lesson: LessonRow, render: Callable[[LessonRow], str]) -> str:
+        with self._lock:
+            cached = self._fragments.get(lesson.id, None)
+        # rows of the same lesson are usually the same object, see `build_rows`
+        if cached is not None and (cached[0] is lesson or cached[0] == lesson):
+            return cached[1]
+
+        fragment = render(lesson)
+        with self._lock:
+            self._fragments[lesson.id] = (lesson, fragment)
+        return fragment
+
+    def invalidate(self, lesson_id: int):
+        """ Drops the lesson's fragment right away, e.g. after its link is changed """
+        with self._lock:
+            self._fragments.pop(lesson_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+lesson_fragments = LessonFragments(maxsize=settings.LESSON_FRAGMENTS_SIZE)
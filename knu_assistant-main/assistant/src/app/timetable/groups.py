@@ -0,0 +1,77 @@
+"""
+Students groups catalog
+
+Groups are found by their name, compared in lowercase and without punctuation and spaces
+(so "к24" finds "К-24"): an exact match goes first, then names starting with the query,
+then similar names. The search takes a single statement, served by the prefix
+and trigram indexes on the normalized name.
+"""
+
+import logging
+import re
+from typing import List, NamedTuple
+
+from sqlalchemy import bindparam, case, func, literal_column, select
+from sqlalchemy.orm import Session
+
+from app.database import Faculty, StudentsGroup
+
+__all__ = [
+    "GROUP_SEARCH_NAME",
+    "GROUPS_SEARCH_STATEMENT",
+    "GroupRow",
+    "search_groups",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class GroupRow(NamedTuple):
+    id: int
+    name: str
+    course: int
+    faculty_shortcut: str
+
+
+# Must match the expression of students_groups_search_name_*_idx indexes
+GROUP_SEARCH_NAME = func.lower(func.regexp_replace(
+    StudentsGroup.name, literal_column("'[^[:alnum:]]+'"), literal_column("''"),
+    literal_column("'g'"),
+))
+# the same normalization of queries
+NON_ALNUM = re.compile(r"[\W_]+")
+
+# Groups, whose name starts with the query or is similar to it, ranked by relevance.
+# Parameters: query (lowercase), prefix (LIKE pattern of the query), limit
+GROUPS_SEARCH_STATEMENT = (
+    select(StudentsGroup.id, StudentsGroup.name, StudentsGroup.course, Faculty.shortcut)
+    .join(Faculty, Faculty.id == StudentsGroup.faculty_id)
+    .where(
+        GROUP_SEARCH_NAME.like(bindparam("prefix")) |
+        GROUP_SEARCH_NAME.op("%")(bindparam("query"))
+    )
+    .order_by(
+        case(
+            (GROUP_SEARCH_NAME == bindparam("query"), 0),
+            (GROUP_SEARCH_NAME.like(bindparam("prefix")), 1),
+            else_=2,
+        ),
+        func.similarity(GROUP_SEARCH_NAME, bindparam("query")).desc(),
+        StudentsGroup.name,
+        StudentsGroup.id,
+    )
+    .limit(bindparam("limit"))
+)
+
+
+def search_groups(session: Session, query: str, limit: int = 8) -> List[GroupRow]:
+    query = NON_ALNUM.sub("", query.lower())
+    if not query:
+        return []
+    params = {
+        "query": query,
+        # the query has no LIKE wildcards after normalization
+        "prefix": query + "%",
+        "limit": limit,
+    }
+    return [GroupRow(*row) for row in session.execute(GROUPS_SEARCH_STATEMENT, params)]
@@ -0,0 +1,206 @@
+"""
+iCalendar (RFC 5545) export of users' timetables
+
+Feeds are generated line by line from a streamed range query, so a calendar of a few
+months is never built in memory as a whole. Each feed has a validator, which changes
+whenever the group's timetable, user's subgroups or the exported period change,
+so calendar apps polling the feed are answered with 304 Not Modified most of the time.
+"""
+
+import datetime as dt
+import hashlib
+import hmac
+import logging
+from typing import Iterable, Iterator, Optional, Tuple
+
+from redis import RedisError
+from sqlalchemy.orm import Session
+
+from app.bot.users import UserSnapshot
+from app.core.config import settings
+from app.timetable.cache import TimetableCache
+from app.timetable.models import SingleLessonRow
+from app.timetable.queries import iter_lessons_between
+
+__all__ = [
+    "CONTENT_TYPE",
+    "Feed",
+    "build_feed",
+    "calendar_lines",
+    "calendar_period",
+    "calendar_token",
+    "check_calendar_token",
+    "encode_lines",
+]
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/calendar; charset=utf-8"
+TIMEZONE = "Europe/Kiev"
+# Definition of TIMEZONE, which local times of events refer to: EET (+0200) and
+# EEST (+0300) from the last Sunday of March 03:00 to the last Sunday of October 04:00
+VTIMEZONE_LINES = (
+    "BEGIN:VTIMEZONE",
+    "TZID:" + TIMEZONE,
+    "BEGIN:STANDARD",
+    "DTSTART:19701025T040000",
+    "TZOFFSETFROM:+0300",
+    "TZOFFSETTO:+0200",
+    "TZNAME:EET",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "BEGIN:DAYLIGHT",
+    "DTSTART:19700329T030000",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0300",
+    "TZNAME:EEST",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "END:VTIMEZONE",
+)
+# RFC 5545 limits content lines to 75 octets, excluding the line break
+MAX_LINE_OCTETS = 75
+
+
+def calendar_token(tg_id: int) -> str:
+    """ Secret part of user's feed URL """
+    return hmac.new(settings.CALENDAR_SECRET.encode("utf-8"), str(tg_id).encode("utf-8"),
+                    hashlib.sha256).hexdigest()[:32]
+
+
+def check_calendar_token(tg_id: int, token: str) -> bool:
+    return hmac.compare_digest(calendar_token(tg_id), token)
+
+
+def calendar_period(today: dt.date) -> Tuple[dt.date, dt.date]:
+    return (today - dt.timedelta(days=settings.CALENDAR_PAST_DAYS),
+            today + dt.timedelta(days=settings.CALENDAR_FUTURE_DAYS))
+
+
+def escape_text(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold_line(line: str) -> str:
+    """ Splits a content line longer than 75 octets, not breaking UTF-8 characters """
+    if len(line.encode("utf-8")) <= MAX_LINE_OCTETS:
+        return line
+    parts = []
+    part, size, limit = [], 0, MAX_LINE_OCTETS
+    for char in line:
+        char_size = len(char.encode("utf-8"))
+        if size + char_size > limit:
+            parts.append("".join(part))
+            # continuation lines start with a space, which takes an octet
+            part, size, limit = [], 0, MAX_LINE_OCTETS - 1
+        part.append(char)
+        size += char_size
+    parts.append("".join(part))
+    return "\r\n ".join(parts)
+
+
+def _local_time(date: dt.date, time: dt.time) -> str:
+    return dt.datetime.combine(date, time).strftime("%Y%m%dT%H%M%S")
+
+
+def event_lines(lesson: SingleLessonRow, stamp: str) -> Iterator[str]:
+    description = [lesson.lesson.represent_lesson_format()]
+    description.extend(teacher.full_name for teacher in lesson.lesson.teachers)
+    if lesson.comment:
+        description.append(lesson.comment)
+
+    yield "BEGIN:VEVENT"
+    # SingleLessons are recreated on each scrape, so their ids are not stable
+    yield "UID:{}-{}@{}".format(lesson.lesson_id, _local_time(lesson.date, lesson.starts_at),
+                                settings.TELEGRAM_BOT_NAME)
+    yield "DTSTAMP:" + stamp
+    yield "DTSTART;TZID={}:{}".format(TIMEZONE, _local_time(lesson.date, lesson.starts_at))
+    yield "DTEND;TZID={}:{}".format(TIMEZONE, _local_time(lesson.date, lesson.ends_at))
+    yield "SUMMARY:" + escape_text(lesson.lesson.name)
+    yield "DESCRIPTION:" + escape_text("\n".join(description))
+    if lesson.lesson.link:
+        yield "URL:" + lesson.lesson.link
+    yield "END:VEVENT"
+
+
+def calendar_lines(lessons: Iterable[SingleLessonRow], name: str,
+                   stamp: dt.datetime) -> Iterator[str]:
+    """
+    Folded content lines of a calendar, without line breaks
+    :param stamp: time (UTC) the calendar was generated or its timetable was modified
+    """
+    stamp = stamp.astimezone(dt.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR"
+    yield "VERSION:2.0"
+    yield "PRODID:-//{}//Timetable//UK".format(settings.TELEGRAM_BOT_NAME)
+    yield "CALSCALE:GREGORIAN"
+    yield "METHOD:PUBLISH"
+    yield fold_line("X-WR-CALNAME:" + escape_text(name))
+    yield "X-WR-TIMEZONE:" + TIMEZONE
+    yield from VTIMEZONE_LINES
+    for lesson in lessons:
+        for line in event_lines(lesson, stamp):
+            yield fold_line(line)
+    yield "END:VCALENDAR"
+
+
+def encode_lines(lines: Iterable[str], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """ Joins lines with CRLF into chunks of about `chunk_size` bytes """
+    chunk, size = [], 0
+    for line in lines:
+        data = line.encode("utf-8") + b"\r\n"
+        chunk.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b"".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+class Feed:
+    """
+    User's calendar: validators are known before the lessons are loaded.
+    Validators are None, if timetable versions are unavailable.
+    """
+
+    def __init__(self, etag: Optional[str], last_modified: Optional[dt.datetime],
+                 lines: Iterator[str]):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.lines = lines
+
+
+def build_feed(session: Session, cache: TimetableCache, user: UserSnapshot, name: str,
+               today: Optional[dt.date] = None) -> Feed:
+    """
+    Lessons are loaded lazily, while the feed lines are consumed, so the session
+    must stay open until then
+    :param today: the exported period is counted from this date (the current one by default)
+    """
+    today = today or dt.date.today()
+    date_from, date_to = calendar_period(today)
+    lessons = iter_lessons_between(session, user, date_from, date_to)
+    try:
+        version, modified = cache.group_revision(user.students_group_id)
+    except RedisError as e:
+        logger.warning("timetable versions are unavailable: %s", str(e))
+        now = dt.datetime.now(dt.timezone.utc)
+        return Feed(None, None, calendar_lines(lessons, name, now))
+
+    # the period moves every day, so the feed changes at least at midnight
+    midnight = dt.datetime.combine(today, dt.time()).astimezone(dt.timezone.utc)
+    last_modified = max(modified, midnight) if modified is not None else midnight
+
+    subgroups = ",".join(str(i) for i in sorted(user.subgroups_ids))
+    etag = hashlib.blake2b("{}:{}:{}:{}:{}".format(
+        user.students_group_id, version, subgroups, date_from, date_to,
+    ).encode("utf-8"), digest_size=16).hexdigest()
+    return Feed('"{}"'.format(etag), last_modified,
+                calendar_lines(lessons, name, last_modified))
@@ -0,0 +1,159 @@
+"""
+In-memory index of groups' lessons by time, which answers "what is now" and "what is next"
+with a binary search and no SQL on a hit.
+
+Days are indexed per group (with all subgroups) and filtered by user's subgroups on lookup.
+An indexed day is reloaded once the group's version in TimetableCache changes,
+i.e. after a scrape or a lesson change. Versions are kept in-process for a few seconds,
+so most lookups do no I/O at all; groups, invalidated by this process, are dropped at once.
+While versions are unavailable, indexed days are trusted for the same few seconds only.
+"""
+
+import bisect
+import datetime as dt
+import logging
+import threading
+from time import monotonic
+from typing import AbstractSet, Iterable, List, Optional
+
+from cachetools import LRUCache
+from redis import RedisError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.timetable.cache import TimetableCache, timetable_cache
+from app.timetable.models import SingleLessonRow
+from app.timetable.queries import get_group_lessons_between, is_user_lesson
+
+__all__ = ["DayIndex", "LessonsIndex", "lessons_index"]
+
+logger = logging.getLogger(__name__)
+
+# version of days, which were loaded while group versions were unavailable
+UNKNOWN_VERSION = -1
+
+
+class DayIndex:
+    """ Lessons of a group on a date, sorted by their start time """
+
+    __slots__ = ("version", "loaded_at", "lessons", "starts")
+
+    def __init__(self, version: int, lessons: List[SingleLessonRow]):
+        self.version = version
+        self.loaded_at = monotonic()
+        self.lessons = sorted(lessons, key=lambda lesson: lesson.starts_at)
+        self.starts = [lesson.starts_at for lesson in self.lessons]
+
+    def current(self, time: dt.time, subgroups: AbstractSet[int]) -> List[SingleLessonRow]:
+        """ User's lessons, which are going on at the time """
+        # only lessons started at the time or earlier may be going on
+        started = bisect.bisect_right(self.starts, time)
+        return [lesson for lesson in self.lessons[:started]
+                if lesson.ends_at > time and is_user_lesson(lesson, subgroups)]
+
+    def next(self, time: Optional[dt.time],
+             subgroups: AbstractSet[int]) -> Optional[SingleLessonRow]:
+        """ User's first lesson, which starts after the time (or the first one, if None) """
+        idx = 0 if time is None else bisect.bisect_right(self.starts, time)
+        for lesson in self.lessons[idx:]:
+            if is_user_lesson(lesson, subgroups):
+                return lesson
+        return None
+
+
+class LessonsIndex:
+
+    # days, which are loaded at once on a miss, so /next usually takes a single query
+    PRELOAD_DAYS = 7
+
+    def __init__(self, cache: TimetableCache, maxsize: int, version_ttl: float):
+        self.cache = cache
+        self.version_ttl = version_ttl
+        self._lock = threading.Lock()
+        # {(students_group_id, date): DayIndex}
+        self._days = LRUCache(maxsize=maxsize)
+        # {students_group_id: (version, time it was asked from Redis)}
+        self._versions = LRUCache(maxsize=maxsize)
+
+    def _version(self, students_group_id: int) -> int:
+        now = monotonic()
+        with self._lock:
+            cached = self._versions.get(students_group_id, None)
+        if cached is not None and now - cached[1] < self.version_ttl:
+            return cached[0]
+
+        try:
+            version = self.cache.group_version(students_group_id)
+        except RedisError as e:
+            logger.warning("timetable versions are unavailable: %s", str(e))
+            return UNKNOWN_VERSION
+        with self._lock:
+            self._versions[students_group_id] = (version, now)
+        return version
+
+    def _is_actual(self, day: Optional[DayIndex], version: int) -> bool:
+        if day is None:
+            return False
+        if version == UNKNOWN_VERSION:
+            # nothing tells whether the day has changed, so it is trusted for a short time
+            return monotonic() - day.loaded_at < self.version_ttl
+        return day.version == version
+
+    def get_day(self, session: Session, students_group_id: int, date: dt.date,
+                version: Optional[int] = None) -> DayIndex:
+        """ :param session: used on a miss only """
+        if version is None:
+            version = self._version(students_group_id)
+        with self._lock:
+            day = self._days.get((students_group_id, date), None)
+        if self._is_actual(day, version):
+            return day
+
+        date_to = date + dt.timedelta(days=self.PRELOAD_DAYS - 1)
+        lessons = get_group_lessons_between(session, students_group_id, date, date_to)
+        days = {date + dt.timedelta(days=i): [] for i in range(self.PRELOAD_DAYS)}
+        for lesson in lessons:
+            days[lesson.date].append(lesson)
+        days = {day_date: DayIndex(version, day_lessons) for day_date, day_lessons in days.items()}
+        with self._lock:
+            for day_date, day in days.items():
+                self._days[(students_group_id, day_date)] = day
+        return days[date]
+
+    def current_lessons(self, session: Session, students_group_id: int,
+                        subgroups: AbstractSet[int],
+                        when: dt.datetime) -> List[SingleLessonRow]:
+        day = self.get_day(session, students_group_id, when.date())
+        return day.current(when.time(), subgroups)
+
+    def next_lesson(self, session: Session, students_group_id: int, subgroups: AbstractSet[int],
+                    when: dt.datetime, days: int = 7) -> Optional[SingleLessonRow]:
+        """ User's next lesson within `days` days, starting from `when` """
+        version = self._version(students_group_id)
+        time = when.time()
+        for day_idx in range(days):
+            date = when.date() + dt.timedelta(days=day_idx)
+            lesson = self.get_day(session, students_group_id, date, version).next(time, subgroups)
+            if lesson is not None:
+                return lesson
+            time = None  # next days are searched from their beginning
+        return None
+
+    def invalidate_groups(self, students_groups_ids: Iterable[int]):
+        """ Drops indexed days and versions of the groups """
+        students_groups_ids = set(students_groups_ids)
+        with self._lock:
+            for key in [key for key in self._days if key[0] in students_groups_ids]:
+                del self._days[key]
+            for students_group_id in students_groups_ids:
+                self._versions.pop(students_group_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+            self._versions.clear()
+
+
+lessons_index = LessonsIndex(timetable_cache, maxsize=settings.LESSONS_INDEX_SIZE,
+                             version_ttl=settings.LESSONS_INDEX_VERSION_TTL)
+timetable_cache.add_invalidation_listener(lessons_index.invalidate_groups)
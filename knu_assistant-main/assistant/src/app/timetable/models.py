@@ -0,0 +1,51 @@
+"""
+Timetable read models
+Immutable tuple-backed counterparts of SingleLesson, Lesson and Teacher.
+They are not bound to a session, so they are safe to cache and share between threads.
+Attribute names match the ORM models, so renderers accept both.
+"""
+
+import datetime as dt
+from typing import NamedTuple, Optional, Tuple
+
+from app.database import LESSON_FORMATS, teacher_full_name, teacher_short_name
+
+__all__ = ["TeacherRow", "LessonRow", "SingleLessonRow"]
+
+
+class TeacherRow(NamedTuple):
+    id: int
+    last_name: str
+    first_name: str
+    middle_name: str
+
+    @property
+    def full_name(self):
+        return teacher_full_name(self.last_name, self.first_name, self.middle_name)
+
+    @property
+    def short_name(self):
+        return teacher_short_name(self.last_name, self.first_name, self.middle_name)
+
+
+class LessonRow(NamedTuple):
+    id: int
+    name: str
+    students_group_id: int
+    subgroup: Optional[str]
+    lesson_format: int
+    link: Optional[str]
+    teachers: Tuple[TeacherRow, ...]
+
+    def represent_lesson_format(self):
+        return LESSON_FORMATS[self.lesson_format]
+
+
+class SingleLessonRow(NamedTuple):
+    id: int
+    date: dt.date
+    starts_at: dt.time
+    ends_at: dt.time
+    lesson_id: int
+    comment: Optional[str]
+    lesson: LessonRow
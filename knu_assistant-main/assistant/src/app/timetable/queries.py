@@ -0,0 +1,220 @@
+"""
+Timetable queries
+Single entrypoint for loading lessons: SingleLesson, its Lesson and teachers are loaded
+in a constant number of queries and returned as read models (see app.timetable.models),
+so renderers never touch the session.
+
+Hot statements are built once on import and take all variable values as bound parameters,
+so each call reuses the statement object and its compiled form from the SQLAlchemy
+compiled cache instead of building and compiling it from scratch.
+"""
+
+import datetime as dt
+import logging
+from collections import defaultdict
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Set
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import Session
+
+from app.database import (
+    Lesson,
+    LessonSubgroupMember,
+    LessonTeacher,
+    SingleLesson,
+    Teacher,
+    User,
+)
+from app.timetable.models import LessonRow, SingleLessonRow, TeacherRow
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "USER_LESSONS_STATEMENT",
+    "GROUPS_LESSONS_STATEMENT",
+    "GROUP_LESSONS_STATEMENT",
+    "LESSONS_TEACHERS_STATEMENT",
+    "get_lessons_between",
+    "iter_lessons_between",
+    "get_day_lessons",
+    "get_groups_lessons_between",
+    "get_group_lessons_between",
+    "get_subgroups_members",
+    "filter_user_lessons",
+    "is_user_lesson",
+]
+
+_LESSON_COLUMNS = (
+    SingleLesson.id,
+    SingleLesson.date,
+    SingleLesson.starts_at,
+    SingleLesson.ends_at,
+    SingleLesson.lesson_id,
+    SingleLesson.comment,
+    Lesson.name,
+    Lesson.students_group_id,
+    Lesson.subgroup,
+    Lesson.lesson_format,
+    Lesson.link,
+)
+
+# User's SingleLessons within a dates range: lessons of user's group, which are not divided
+# into subgroups or belong to one of user's subgroups.
+# Parameters: user_id, students_group_id, date_from, date_to
+USER_LESSONS_STATEMENT = (
+    select(*_LESSON_COLUMNS)
+    .join(Lesson, Lesson.id == SingleLesson.lesson_id)
+    .where(
+        (Lesson.students_group_id == bindparam("students_group_id")) &
+        ((Lesson.subgroup == None) | Lesson.id.in_(
+            select(LessonSubgroupMember.c.lesson_id)
+            .where(LessonSubgroupMember.c.user_id == bindparam("user_id"))
+        )) &
+        (SingleLesson.date.between(bindparam("date_from"), bindparam("date_to")))
+    )
+    .order_by(SingleLesson.date, SingleLesson.starts_at)
+)
+
+# SingleLessons of all groups within a dates range, including all subgroups.
+# Parameters: date_from, date_to
+GROUPS_LESSONS_STATEMENT = (
+    select(*_LESSON_COLUMNS)
+    .join(Lesson, Lesson.id == SingleLesson.lesson_id)
+    .where(SingleLesson.date.between(bindparam("date_from"), bindparam("date_to")))
+    .order_by(Lesson.students_group_id, SingleLesson.date, SingleLesson.starts_at)
+)
+
+# SingleLessons of a group within a dates range, including all subgroups.
+# Parameters: students_group_id, date_from, date_to
+GROUP_LESSONS_STATEMENT = (
+    select(*_LESSON_COLUMNS)
+    .join(Lesson, Lesson.id == SingleLesson.lesson_id)
+    .where(
+        (Lesson.students_group_id == bindparam("students_group_id")) &
+        (SingleLesson.date.between(bindparam("date_from"), bindparam("date_to")))
+    )
+    .order_by(SingleLesson.date, SingleLesson.starts_at)
+)
+
+# Teachers of the given lessons
+# Parameters: lesson_ids
+LESSONS_TEACHERS_STATEMENT = (
+    select(LessonTeacher.c.lesson_id, Teacher.id, Teacher.last_name, Teacher.first_name,
+           Teacher.middle_name)
+    .join(Teacher, Teacher.id == LessonTeacher.c.teacher_id)
+    .where(LessonTeacher.c.lesson_id.in_(bindparam("lesson_ids", expanding=True)))
+    .order_by(LessonTeacher.c.lesson_id, Teacher.id)
+)
+
+
+def build_rows(session: Session, rows: Iterable) -> List[SingleLessonRow]:
+    """
+    Converts rows of _LESSON_COLUMNS into read models.
+    Teachers of all lessons are loaded with a single query,
+    each LessonRow is created once and shared between its SingleLessonRows.
+    """
+    rows = list(rows)
+    lesson_ids = list({row[4] for row in rows})
+
+    teachers = defaultdict(list)
+    if lesson_ids:
+        for lesson_id, *teacher in session.execute(LESSONS_TEACHERS_STATEMENT,
+                                                   {"lesson_ids": lesson_ids}):
+            teachers[lesson_id].append(TeacherRow(*teacher))
+
+    lessons: Dict[int, LessonRow] = {}
+    result = []
+    for (id_, date, starts_at, ends_at, lesson_id, comment,
+         name, students_group_id, subgroup, lesson_format, link) in rows:
+        lesson = lessons.get(lesson_id, None)
+        if lesson is None:
+            lesson = lessons[lesson_id] = LessonRow(
+                lesson_id, name, students_group_id, subgroup, lesson_format, link,
+                tuple(teachers[lesson_id]),
+            )
+        result.append(SingleLessonRow(id_, date, starts_at, ends_at, lesson_id, comment, lesson))
+    return result
+
+
+def get_lessons_between(session: Session, user: User,
+                        date_from: dt.date, date_to: dt.date) -> List[SingleLessonRow]:
+    """ User's lessons from date_from to date_to inclusive, ordered by date and start time """
+    params = {
+        "user_id": user.tg_id,
+        "students_group_id": user.students_group_id,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    return build_rows(session, session.execute(USER_LESSONS_STATEMENT, params))
+
+
+def iter_lessons_between(session: Session, user: User, date_from: dt.date, date_to: dt.date,
+                         chunk_size: int = 500) -> Iterator[SingleLessonRow]:
+    """
+    Same as get_lessons_between, but rows are streamed with a server-side cursor
+    and converted by chunks, so long periods are not loaded into memory at once
+    """
+    params = {
+        "user_id": user.tg_id,
+        "students_group_id": user.students_group_id,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    result = session.execute(USER_LESSONS_STATEMENT, params,
+                             execution_options={"stream_results": True})
+    for rows in result.partitions(chunk_size):
+        yield from build_rows(session, rows)
+
+
+def get_day_lessons(session: Session, user: User, date: dt.date) -> List[SingleLessonRow]:
+    """ User's lessons on the given date, ordered by their start time """
+    return get_lessons_between(session, user, date, date)
+
+
+def get_groups_lessons_between(session: Session, date_from: dt.date,
+                               date_to: dt.date) -> Dict[int, List[SingleLessonRow]]:
+    """
+    Lessons of all groups from date_from to date_to inclusive (including all subgroups),
+    grouped by students_group_id
+    """
+    params = {
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    result = defaultdict(list)
+    for lesson in build_rows(session, session.execute(GROUPS_LESSONS_STATEMENT, params)):
+        result[lesson.lesson.students_group_id].append(lesson)
+    return result
+
+
+def get_group_lessons_between(session: Session, students_group_id: int, date_from: dt.date,
+                              date_to: dt.date) -> List[SingleLessonRow]:
+    """
+    Lessons of the group from date_from to date_to inclusive (including all subgroups),
+    ordered by date and start time
+    """
+    params = {
+        "students_group_id": students_group_id,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    return build_rows(session, session.execute(GROUP_LESSONS_STATEMENT, params))
+
+
+def get_subgroups_members(session: Session) -> Dict[int, Set[int]]:
+    """ Subgroups (Lesson.id) of each user """
+    result = defaultdict(set)
+    for user_id, lesson_id in session.execute(
+            select(LessonSubgroupMember.c.user_id, LessonSubgroupMember.c.lesson_id)):
+        result[user_id].add(lesson_id)
+    return result
+
+
+def filter_user_lessons(lessons: Iterable[SingleLessonRow],
+                        subgroups: Set[int]) -> List[SingleLessonRow]:
+    """ Leaves lessons, which are not divided into subgroups or belong to user's subgroups """
+    return [lesson for lesson in lessons if is_user_lesson(lesson, subgroups)]
+
+
+def is_user_lesson(lesson: SingleLessonRow, subgroups: AbstractSet[int]) -> bool:
+    return lesson.lesson.subgroup is None or lesson.lesson_id in subgroups
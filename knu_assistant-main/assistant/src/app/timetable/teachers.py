@@ -0,0 +1,116 @@
+"""
+Teachers' timetables
+
+Teachers are found by a trigram search over their full names
+(see the teachers_search_name_trgm_idx index), and their lessons are loaded
+from lessons_teachers by teacher_id, across all students groups.
+"""
+
+import datetime as dt
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, func, literal_column, select
+from sqlalchemy.orm import Session
+
+from app.database import Lesson, LessonTeacher, SingleLesson, StudentsGroup, Teacher
+from app.timetable.models import SingleLessonRow, TeacherRow
+from app.timetable.queries import _LESSON_COLUMNS, build_rows
+
+__all__ = [
+    "TEACHER_SEARCH_NAME",
+    "TEACHERS_SEARCH_STATEMENT",
+    "TEACHER_LESSONS_STATEMENT",
+    "search_teachers",
+    "get_teacher",
+    "get_teacher_lessons_between",
+    "get_groups_names",
+]
+
+logger = logging.getLogger(__name__)
+
+_SPACE = literal_column("' '")
+
+# Must match the expression of teachers_search_name_trgm_idx
+TEACHER_SEARCH_NAME = func.lower(
+    Teacher.last_name + _SPACE + Teacher.first_name + _SPACE + Teacher.middle_name
+)
+
+# Teachers, whose full name contains the query or a part similar to it (e.g. with a typo),
+# the most similar first. Both conditions are served by the trigram index.
+# Parameters: query (lowercase), pattern (ILIKE pattern of the query), limit
+TEACHERS_SEARCH_STATEMENT = (
+    select(Teacher.id, Teacher.last_name, Teacher.first_name, Teacher.middle_name)
+    .where(
+        TEACHER_SEARCH_NAME.ilike(bindparam("pattern")) |
+        bindparam("query").op("<%")(TEACHER_SEARCH_NAME)
+    )
+    .order_by(func.word_similarity(bindparam("query"), TEACHER_SEARCH_NAME).desc(),
+              Teacher.last_name, Teacher.id)
+    .limit(bindparam("limit"))
+)
+
+# SingleLessons of all lessons of a teacher within a dates range.
+# Parameters: teacher_id, date_from, date_to
+TEACHER_LESSONS_STATEMENT = (
+    select(*_LESSON_COLUMNS)
+    .join(Lesson, Lesson.id == SingleLesson.lesson_id)
+    .where(
+        SingleLesson.lesson_id.in_(
+            select(LessonTeacher.c.lesson_id)
+            .where(LessonTeacher.c.teacher_id == bindparam("teacher_id"))
+        ) &
+        (SingleLesson.date.between(bindparam("date_from"), bindparam("date_to")))
+    )
+    # lessons, given to a few groups at once, go in a row
+    .order_by(SingleLesson.date, SingleLesson.starts_at, SingleLesson.ends_at, Lesson.name,
+              Lesson.lesson_format, Lesson.students_group_id)
+)
+
+
+def _like_pattern(query: str) -> str:
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%{}%".format(escaped)
+
+
+def search_teachers(session: Session, query: str, limit: int = 10) -> List[TeacherRow]:
+    query = " ".join(query.lower().split())
+    if not query:
+        return []
+    params = {
+        "query": query,
+        "pattern": _like_pattern(query),
+        "limit": limit,
+    }
+    return [TeacherRow(*row) for row in session.execute(TEACHERS_SEARCH_STATEMENT, params)]
+
+
+def get_teacher(session: Session, teacher_id: int) -> Optional[TeacherRow]:
+    row = session.execute(
+        select(Teacher.id, Teacher.last_name, Teacher.first_name, Teacher.middle_name)
+        .where(Teacher.id == teacher_id)
+    ).first()
+    return TeacherRow(*row) if row is not None else None
+
+
+def get_teacher_lessons_between(session: Session, teacher_id: int, date_from: dt.date,
+                                date_to: dt.date) -> List[SingleLessonRow]:
+    """
+    Teacher's lessons from date_from to date_to inclusive, ordered by date and start time.
+    A lesson, given to a few groups at once, is returned for each of them.
+    """
+    params = {
+        "teacher_id": teacher_id,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    return build_rows(session, session.execute(TEACHER_LESSONS_STATEMENT, params))
+
+
+def get_groups_names(session: Session, students_groups_ids: Iterable[int]) -> Dict[int, str]:
+    ids = list(set(students_groups_ids))
+    if not ids:
+        return {}
+    return dict(session.execute(
+        select(StudentsGroup.id, StudentsGroup.name).where(StudentsGroup.id.in_(ids))
+    ).all())
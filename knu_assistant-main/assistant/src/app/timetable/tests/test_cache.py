@@ -0,0 +1,93 @@
+import datetime as dt
+
+import mock
+from redis import RedisError
+
+from app.tests.fake_redis import FakeRedis
+from app.timetable.cache import DAY, WEEK, TimetableCache
+
+DATE = dt.date(2021, 2, 1)
+
+
+class TestTimetableCache:
+
+    def cache(self, redis=None):
+        return TimetableCache(redis or FakeRedis(), maxsize=100, ttl=60)
+
+    def test_render_once(self):
+        cache = self.cache()
+        render = mock.MagicMock(return_value="timetable")
+        for _ in range(3):
+            assert cache.get_or_render(DAY, 1, {2, 1}, DATE, render) == "timetable"
+        assert render.call_count == 1
+
+    def test_keys(self):
+        cache = self.cache()
+        render = mock.MagicMock(return_value="timetable")
+        cache.get_or_render(DAY, 1, {1, 2}, DATE, render)
+        cache.get_or_render(DAY, 1, [2, 1], DATE, render)  # the same subgroups
+        cache.get_or_render(DAY, 1, {1}, DATE, render)
+        cache.get_or_render(DAY, 2, {1, 2}, DATE, render)
+        cache.get_or_render(WEEK, 1, {1, 2}, DATE, render)
+        cache.get_or_render(DAY, 1, {1, 2}, DATE + dt.timedelta(days=1), render)
+        assert render.call_count == 5
+
+    def test_shared_between_processes(self):
+        redis = FakeRedis()
+        render = mock.MagicMock(return_value="timetable")
+        self.cache(redis).get_or_render(DAY, 1, set(), DATE, render)
+        self.cache(redis).get_or_render(DAY, 1, set(), DATE, render)
+        assert render.call_count == 1
+
+    def test_invalidate_groups(self):
+        redis = FakeRedis()
+        cache, other_cache = self.cache(redis), self.cache(redis)
+        cache.get_or_render(DAY, 1, set(), DATE, lambda: "old")
+        cache.get_or_render(DAY, 2, set(), DATE, lambda: "old")
+        other_cache.invalidate_groups([1])
+        assert cache.get_or_render(DAY, 1, set(), DATE, lambda: "new") == "new"
+        assert cache.get_or_render(DAY, 2, set(), DATE, lambda: "new") == "old"
+
+    def test_without_group(self):
+        cache = self.cache()
+        render = mock.MagicMock(return_value="")
+        cache.get_or_render(DAY, None, set(), DATE, render)
+        cache.get_or_render(DAY, None, set(), DATE, render)
+        assert render.call_count == 2
+
+    def test_redis_unavailable(self):
+        redis = mock.MagicMock()
+        redis.get.side_effect = RedisError()
+        cache = self.cache(redis)
+        assert cache.get_or_render(DAY, 1, set(), DATE, lambda: "timetable") == "timetable"
+
+    def test_group_revision(self):
+        cache = self.cache()
+        assert cache.group_revision(1) == (0, None)
+
+        cache.invalidate_groups([1])
+        version, modified = cache.group_revision(1)
+        assert version == 1
+        assert modified.tzinfo == dt.timezone.utc
+        assert abs(modified - dt.datetime.now(dt.timezone.utc)) < dt.timedelta(minutes=1)
+
+    def test_clear(self):
+        redis = FakeRedis()
+        redis.set("unrelated", "value")
+        cache = self.cache(redis)
+        render = mock.MagicMock(return_value="timetable")
+        cache.get_or_render(DAY, 1, set(), DATE, render)
+        cache.invalidate_groups([1])
+        cache.get_or_render(DAY, 1, set(), DATE, render)
+
+        cache.clear()
+        assert redis.data == {"unrelated": "value"}
+        cache.get_or_render(DAY, 1, set(), DATE, render)
+        assert render.call_count == 3
+
+    def test_invalidation_listener(self):
+        cache = self.cache()
+        listener = mock.MagicMock()
+        cache.add_invalidation_listener(listener)
+        cache.invalidate_groups([1, 2, 1])
+        listener.assert_called_once_with({1, 2})
@@ -0,0 +1,39 @@
+import mock
+
+from app.timetable.fragments import LessonFragments
+from app.timetable.models import LessonRow, TeacherRow
+
+TEACHER = TeacherRow(1, "Peterson", "Tom", "O")
+
+
+def lesson(link=None, teachers=(TEACHER,)):
+    return LessonRow(1, "Math", 1, None, 0, link, teachers)
+
+
+class TestLessonFragments:
+
+    def test_render_once(self):
+        fragments = LessonFragments(maxsize=10)
+        render = mock.MagicMock(return_value="fragment")
+        assert fragments.get_or_render(lesson(), render) == "fragment"
+        # an equal row, loaded by another query
+        assert fragments.get_or_render(lesson(), render) == "fragment"
+        assert render.call_count == 1
+
+    def test_changed_lesson(self):
+        fragments = LessonFragments(maxsize=10)
+        render = mock.MagicMock(side_effect=lambda row: row.link or "")
+        fragments.get_or_render(lesson(), render)
+        assert fragments.get_or_render(lesson(link="https://zoom.us"), render) == \
+            "https://zoom.us"
+        fragments.get_or_render(lesson(link="https://zoom.us", teachers=()), render)
+        assert render.call_count == 3
+
+    def test_invalidate(self):
+        fragments = LessonFragments(maxsize=10)
+        render = mock.MagicMock(return_value="fragment")
+        row = lesson()
+        fragments.get_or_render(row, render)
+        fragments.invalidate(row.id)
+        fragments.get_or_render(row, render)
+        assert render.call_count == 2
@@ -0,0 +1,26 @@
+from app.tests.factories import StudentsGroupFactory
+from app.timetable.groups import search_groups
+
+
+class TestSearchGroups:
+
+    def test_ranking(self, db_session):
+        StudentsGroupFactory(name="К-241")
+        exact = StudentsGroupFactory(name="К-24")
+        StudentsGroupFactory(name="К-34")
+        db_session.commit()
+
+        # the exact match, a prefix match and then similar names
+        assert [group.name for group in search_groups(db_session, "к-24")][:2] == \
+               [exact.name, "К-241"]
+        # punctuation, spaces and case are ignored
+        assert search_groups(db_session, " К 24 ")[0].id == exact.id
+
+    def test_prefix(self, db_session):
+        StudentsGroupFactory(name="МІ-31")
+        StudentsGroupFactory(name="МІ-32")
+        StudentsGroupFactory(name="К-31")
+        db_session.commit()
+
+        assert [group.name for group in search_groups(db_session, "мі")] == ["МІ-31", "МІ-32"]
+        assert search_groups(db_session, "%_") == []
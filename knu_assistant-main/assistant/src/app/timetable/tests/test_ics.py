@@ -0,0 +1,127 @@
+import datetime as dt
+import threading
+import urllib.error
+import urllib.request
+
+import mock
+import pytest
+
+from app.bot.users import UserSnapshot
+from app.tests.factories import (
+    LessonFactory,
+    SingleLessonFactory,
+    StudentsGroupFactory,
+    TeacherFactory,
+    UserFactory,
+)
+from app.timetable.cache import timetable_cache
+from app.timetable.calendar_server import calendar_path, is_not_modified, start_http_server
+from app.timetable.ics import (
+    MAX_LINE_OCTETS,
+    Feed,
+    build_feed,
+    calendar_token,
+    check_calendar_token,
+    encode_lines,
+    escape_text,
+    fold_line,
+)
+
+TODAY = dt.date(2021, 2, 1)
+
+
+class TestFormat:
+
+    def test_escape(self):
+        assert escape_text("a,b;c\\d\ne") == "a\\,b\\;c\\\\d\\ne"
+
+    def test_fold(self):
+        line = "SUMMARY:" + "Математичний аналіз " * 10
+        folded = fold_line(line)
+        parts = folded.split("\r\n ")
+        assert len(parts) > 1
+        assert "".join(parts) == line
+        assert len(parts[0].encode("utf-8")) <= MAX_LINE_OCTETS
+        assert all(len(part.encode("utf-8")) <= MAX_LINE_OCTETS - 1 for part in parts[1:])
+
+        assert fold_line("VERSION:2.0") == "VERSION:2.0"
+
+    def test_encode_lines(self):
+        chunks = list(encode_lines(["a" * 10] * 10, chunk_size=24))
+        assert b"".join(chunks) == b"aaaaaaaaaa\r\n" * 10
+        assert len(chunks) == 5
+
+
+def test_token():
+    token = calendar_token(1)
+    assert len(token) == 32
+    assert check_calendar_token(1, token)
+    assert not check_calendar_token(2, token)
+
+
+def test_not_modified():
+    modified = dt.datetime(2021, 2, 1, 10, 30, 15, 500, tzinfo=dt.timezone.utc)
+    feed = Feed('"abc"', modified, iter([]))
+    assert is_not_modified(feed, '"abc"', None)
+    assert is_not_modified(feed, '"x", "abc"', None)
+    assert not is_not_modified(feed, '"x"', "Mon, 01 Feb 2021 10:30:15 GMT")
+    # subgroups change the ETag, but not Last-Modified
+    assert not is_not_modified(feed, None, "Mon, 01 Feb 2021 10:30:15 GMT")
+
+    feed = Feed(None, modified, iter([]))
+    assert is_not_modified(feed, None, "Mon, 01 Feb 2021 10:30:15 GMT")
+    assert not is_not_modified(feed, None, "Mon, 01 Feb 2021 10:30:14 GMT")
+    assert not is_not_modified(feed, None, "yesterday")
+    assert not is_not_modified(Feed(None, None, iter([])), '"abc"', None)
+
+
+def test_connections_limit():
+    server = start_http_server(0, "127.0.0.1")
+    url = "http://127.0.0.1:{}{}".format(server.server_address[1],
+                                         calendar_path(1, calendar_token(1)))
+    try:
+        with mock.patch("app.timetable.calendar_server._connections",
+                        threading.BoundedSemaphore(1)) as connections:
+            connections.acquire()  # taken by another feed
+            with pytest.raises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(url, timeout=5)
+        assert e.value.code == 503
+        assert e.value.headers["Retry-After"] == "60"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class TestFeed:
+
+    def test_feed(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        lesson = LessonFactory(name="Math, algebra", students_group=group,
+                               teachers=[TeacherFactory()], link="https://zoom.us")
+        SingleLessonFactory(lesson=lesson, date=TODAY,
+                            starts_at=dt.time(8, 40), ends_at=dt.time(10, 15))
+        # out of the exported period
+        SingleLessonFactory(lesson=lesson, date=TODAY - dt.timedelta(days=365))
+        db_session.commit()
+        snapshot = UserSnapshot.from_user(db_session, user)
+
+        feed = build_feed(db_session, timetable_cache, snapshot, "Timetable", today=TODAY)
+        lines = list(feed.lines)
+        assert lines[0] == "BEGIN:VCALENDAR"
+        assert lines[-1] == "END:VCALENDAR"
+        assert lines.count("BEGIN:VEVENT") == 1
+        # the timezone, which events refer to, is defined before them
+        assert lines.index("TZID:Europe/Kiev") < lines.index("BEGIN:VEVENT")
+        assert "DTSTART;TZID=Europe/Kiev:20210201T084000" in lines
+        assert "DTEND;TZID=Europe/Kiev:20210201T101500" in lines
+        assert "SUMMARY:Math\\, algebra" in lines
+        assert "URL:https://zoom.us" in lines
+
+        # validators do not change until the timetable does
+        same = build_feed(db_session, timetable_cache, snapshot, "Timetable", today=TODAY)
+        assert (same.etag, same.last_modified) == (feed.etag, feed.last_modified)
+        timetable_cache.invalidate_groups([group.id])
+        changed = build_feed(db_session, timetable_cache, snapshot, "Timetable", today=TODAY)
+        assert changed.etag != feed.etag
+        assert changed.last_modified > feed.last_modified
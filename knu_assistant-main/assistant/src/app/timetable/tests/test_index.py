@@ -0,0 +1,119 @@
+import datetime as dt
+from time import monotonic
+
+import mock
+from redis import RedisError
+
+from app.timetable.index import DayIndex, LessonsIndex
+from app.timetable.models import LessonRow, SingleLessonRow
+
+DATE = dt.date(2021, 2, 1)
+
+MATH = LessonRow(1, "Math", 1, None, 0, None, ())
+PROGRAMMING_1 = LessonRow(2, "Programming", 1, "1", 0, None, ())
+PROGRAMMING_2 = LessonRow(3, "Programming", 1, "2", 0, None, ())
+
+
+def single_lesson(lesson: LessonRow, starts_at: dt.time, ends_at: dt.time, date=DATE):
+    return SingleLessonRow(1, date, starts_at, ends_at, lesson.id, None, lesson)
+
+
+class TestDayIndex:
+
+    def day(self):
+        return DayIndex(0, [
+            single_lesson(PROGRAMMING_1, dt.time(10, 35), dt.time(12, 10)),
+            single_lesson(PROGRAMMING_2, dt.time(10, 35), dt.time(12, 10)),
+            single_lesson(MATH, dt.time(8, 40), dt.time(10, 15)),
+        ])
+
+    def test_current(self):
+        day = self.day()
+        assert [l.lesson for l in day.current(dt.time(9), set())] == [MATH]
+        assert day.current(dt.time(10, 20), set()) == []
+        assert day.current(dt.time(10, 15), set()) == []
+        assert [l.lesson for l in day.current(dt.time(10, 35), {3})] == [PROGRAMMING_2]
+        assert day.current(dt.time(11), set()) == []
+
+    def test_next(self):
+        day = self.day()
+        assert day.next(None, set()).lesson == MATH
+        assert day.next(dt.time(8, 40), {2}).lesson == PROGRAMMING_1
+        assert day.next(dt.time(9), {3}).lesson == PROGRAMMING_2
+        assert day.next(dt.time(9), set()) is None
+
+
+class TestLessonsIndex:
+
+    def index(self, versions=None):
+        cache = mock.MagicMock()
+        cache.group_version.side_effect = lambda group_id: (versions or {}).get(group_id, 0)
+        return LessonsIndex(cache, maxsize=100, version_ttl=5)
+
+    def later(self, seconds):
+        """ Moves the clock of the index forward """
+        return mock.patch("app.timetable.index.monotonic", return_value=monotonic() + seconds)
+
+    @mock.patch("app.timetable.index.get_group_lessons_between")
+    def test_next_lesson(self, get_lessons):
+        get_lessons.return_value = [
+            single_lesson(MATH, dt.time(8, 40), dt.time(10, 15)),
+            single_lesson(PROGRAMMING_1, dt.time(8, 40), dt.time(10, 15),
+                          date=DATE + dt.timedelta(days=2)),
+        ]
+        index = self.index()
+        now = dt.datetime.combine(DATE, dt.time(12))
+        assert index.next_lesson(None, 1, {2}, now).lesson == PROGRAMMING_1
+        assert index.next_lesson(None, 1, set(), now) is None
+        # the whole week is loaded by the first lookup
+        assert get_lessons.call_count == 1
+        assert get_lessons.call_args.args[1:] == (1, DATE, DATE + dt.timedelta(days=6))
+        # the version is asked from Redis once within version_ttl
+        assert index.cache.group_version.call_count == 1
+
+    @mock.patch("app.timetable.index.get_group_lessons_between", return_value=[])
+    def test_version_change(self, get_lessons):
+        versions = {1: 0}
+        index = self.index(versions)
+        now = dt.datetime.combine(DATE, dt.time(12))
+        index.current_lessons(None, 1, set(), now)
+        index.current_lessons(None, 1, set(), now)
+        assert get_lessons.call_count == 1
+
+        versions[1] = 1  # the group was scrapped again
+        index.current_lessons(None, 1, set(), now)
+        assert get_lessons.call_count == 1  # the version is not asked again yet
+        with self.later(6):
+            index.current_lessons(None, 1, set(), now)
+        assert get_lessons.call_count == 2
+
+    @mock.patch("app.timetable.index.get_group_lessons_between", return_value=[])
+    def test_versions_unavailable(self, get_lessons):
+        index = self.index()
+        now = dt.datetime.combine(DATE, dt.time(12))
+        index.current_lessons(None, 1, set(), now)
+        index.cache.group_version.side_effect = RedisError()
+        with self.later(6):
+            # the day is not trusted without a version and is reloaded
+            index.current_lessons(None, 1, set(), now)
+            assert get_lessons.call_count == 2
+            # the reloaded day is trusted for a short time
+            index.current_lessons(None, 1, set(), now)
+            assert get_lessons.call_count == 2
+        with self.later(12):
+            index.current_lessons(None, 1, set(), now)
+            assert get_lessons.call_count == 3
+
+    @mock.patch("app.timetable.index.get_group_lessons_between", return_value=[])
+    def test_invalidate_groups(self, get_lessons):
+        versions = {1: 0, 2: 0}
+        index = self.index(versions)
+        now = dt.datetime.combine(DATE, dt.time(12))
+        index.current_lessons(None, 1, set(), now)
+        index.current_lessons(None, 2, set(), now)
+
+        versions[1] = 1
+        index.invalidate_groups([1])
+        index.current_lessons(None, 1, set(), now)
+        index.current_lessons(None, 2, set(), now)
+        assert get_lessons.call_count == 3
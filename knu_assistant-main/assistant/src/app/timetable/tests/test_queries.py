@@ -0,0 +1,147 @@
+import datetime as dt
+
+from app.tests.factories import (
+    LessonFactory,
+    SingleLessonFactory,
+    StudentsGroupFactory,
+    TeacherFactory,
+    UserFactory,
+)
+from app.timetable.models import LessonRow, SingleLessonRow, TeacherRow
+from app.timetable.queries import (
+    filter_user_lessons,
+    get_day_lessons,
+    get_groups_lessons_between,
+    get_lessons_between,
+    get_subgroups_members,
+    iter_lessons_between,
+)
+
+
+class TestGetDayLessons:
+
+    def test_subgroups(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        date = dt.date(year=2021, month=1, day=26)
+
+        math = LessonFactory(name="M", students_group=group)
+        programming_1 = LessonFactory(subgroup="1", name="P", students_group=group)
+        programming_2 = LessonFactory(subgroup="2", name="P", students_group=group)
+        english_1 = LessonFactory(subgroup="1", name="E", students_group=group)
+        user.subgroups.extend([programming_1, english_1])
+
+        math_sl = SingleLessonFactory(lesson=math, date=date, starts_at=dt.time(8, 40))
+        programming_1_sl = SingleLessonFactory(lesson=programming_1, date=date,
+                                               starts_at=dt.time(10, 35))
+        SingleLessonFactory(lesson=programming_2, date=date, starts_at=dt.time(10, 35))
+        # another day
+        SingleLessonFactory(lesson=math, date=date + dt.timedelta(days=1))
+        # another group
+        SingleLessonFactory(date=date)
+        db_session.commit()
+
+        # user has 2 subgroups, but each lesson is returned only once
+        lessons = get_day_lessons(db_session, user, date)
+        assert [lesson.id for lesson in lessons] == [math_sl.id, programming_1_sl.id]
+
+    def test_read_models(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        date = dt.date(year=2021, month=1, day=26)
+        koval = TeacherFactory()
+        kondratyuk = TeacherFactory()
+        lesson = LessonFactory(students_group=group, teachers=[koval, kondratyuk],
+                               link="https://zoom.us")
+        single_lesson = SingleLessonFactory(lesson=lesson, date=date)
+        db_session.commit()
+
+        lessons = get_day_lessons(db_session, user, date)
+        assert lessons == [SingleLessonRow(
+            id=single_lesson.id,
+            date=date,
+            starts_at=single_lesson.starts_at,
+            ends_at=single_lesson.ends_at,
+            lesson_id=lesson.id,
+            comment=None,
+            lesson=LessonRow(
+                id=lesson.id,
+                name=lesson.name,
+                students_group_id=group.id,
+                subgroup=None,
+                lesson_format=lesson.lesson_format,
+                link="https://zoom.us",
+                teachers=tuple(
+                    TeacherRow(t.id, t.last_name, t.first_name, t.middle_name)
+                    for t in sorted([koval, kondratyuk], key=lambda t: t.id)
+                ),
+            ),
+        )]
+        assert lessons[0].lesson.represent_lesson_format() == lesson.represent_lesson_format()
+        assert lessons[0].lesson.teachers[0].short_name == koval.short_name
+
+
+class TestGetLessonsBetween:
+
+    def test_range(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        monday = dt.date(year=2021, month=2, day=1)
+        sunday = monday + dt.timedelta(days=6)
+        lesson = LessonFactory(students_group=group)
+
+        monday_sl = SingleLessonFactory(lesson=lesson, date=monday, starts_at=dt.time(10, 35))
+        sunday_sl = SingleLessonFactory(lesson=lesson, date=sunday, starts_at=dt.time(8, 40))
+        # out of range
+        SingleLessonFactory(lesson=lesson, date=monday - dt.timedelta(days=1))
+        SingleLessonFactory(lesson=lesson, date=sunday + dt.timedelta(days=1))
+        db_session.commit()
+
+        lessons = get_lessons_between(db_session, user, monday, sunday)
+        assert [lesson.id for lesson in lessons] == [monday_sl.id, sunday_sl.id]
+
+    def test_iter(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        monday = dt.date(year=2021, month=2, day=1)
+        lesson = LessonFactory(students_group=group)
+        single_lessons = [SingleLessonFactory(lesson=lesson, date=monday + dt.timedelta(days=i))
+                          for i in range(5)]
+        db_session.commit()
+
+        lessons = list(iter_lessons_between(db_session, user, monday,
+                                            monday + dt.timedelta(days=6), chunk_size=2))
+        assert lessons == get_lessons_between(db_session, user, monday,
+                                              monday + dt.timedelta(days=6))
+        assert [lesson.id for lesson in lessons] == [sl.id for sl in single_lessons]
+
+
+class TestBulkLessons:
+
+    def test_groups_lessons(self, db_session):
+        group = StudentsGroupFactory()
+        user = UserFactory(students_group=group)
+        date = dt.date(year=2021, month=1, day=26)
+
+        math = LessonFactory(name="M", students_group=group)
+        programming_1 = LessonFactory(subgroup="1", name="P", students_group=group)
+        programming_2 = LessonFactory(subgroup="2", name="P", students_group=group)
+        user.subgroups.append(programming_1)
+
+        math_sl = SingleLessonFactory(lesson=math, date=date, starts_at=dt.time(8, 40))
+        programming_1_sl = SingleLessonFactory(lesson=programming_1, date=date,
+                                               starts_at=dt.time(10, 35))
+        programming_2_sl = SingleLessonFactory(lesson=programming_2, date=date,
+                                               starts_at=dt.time(12, 20))
+        db_session.commit()
+
+        groups_lessons = get_groups_lessons_between(db_session, date, date)
+        assert [lesson.id for lesson in groups_lessons[group.id]] == \
+               [math_sl.id, programming_1_sl.id, programming_2_sl.id]
+
+        subgroups = get_subgroups_members(db_session)
+        assert subgroups[user.tg_id] == {programming_1.id}
+
+        lessons = filter_user_lessons(groups_lessons[group.id], subgroups[user.tg_id])
+        assert [lesson.id for lesson in lessons] == [math_sl.id, programming_1_sl.id]
+        assert lessons == get_day_lessons(db_session, user, date)
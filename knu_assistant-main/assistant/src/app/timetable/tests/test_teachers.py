@@ -0,0 +1,60 @@
+import datetime as dt
+
+from app.tests.factories import (
+    LessonFactory,
+    SingleLessonFactory,
+    StudentsGroupFactory,
+    TeacherFactory,
+)
+from app.tests.queries import query_budget
+from app.timetable.teachers import get_groups_names, get_teacher_lessons_between, search_teachers
+
+MONDAY = dt.date(2021, 2, 1)
+
+
+class TestSearchTeachers:
+
+    def test_search(self, db_session):
+        shevchenko = TeacherFactory(last_name="Шевченко", first_name="Тарас",
+                                    middle_name="Григорович")
+        TeacherFactory(last_name="Шевчук", first_name="Іван", middle_name="Петрович")
+        TeacherFactory(last_name="Коваль", first_name="Олена", middle_name="Іванівна")
+        db_session.commit()
+
+        assert [t.id for t in search_teachers(db_session, "шевченко тарас")] == [shevchenko.id]
+        # a prefix
+        assert {t.last_name for t in search_teachers(db_session, "Шевч")} == \
+               {"Шевченко", "Шевчук"}
+        # a typo
+        assert search_teachers(db_session, "Шевченка")[0].id == shevchenko.id
+
+    def test_special_characters(self, db_session):
+        TeacherFactory(last_name="Коваль")
+        db_session.commit()
+        assert search_teachers(db_session, "%") == []
+        assert search_teachers(db_session, "   ") == []
+
+
+class TestTeacherLessons:
+
+    def test_lessons(self, db_session):
+        teacher = TeacherFactory()
+        groups = [StudentsGroupFactory(), StudentsGroupFactory()]
+        lectures = [LessonFactory(name="Math", students_group=group, teachers=[teacher])
+                    for group in groups]
+        for lecture in lectures:
+            SingleLessonFactory(lesson=lecture, date=MONDAY,
+                                starts_at=dt.time(8, 40), ends_at=dt.time(10, 15))
+        # another teacher
+        SingleLessonFactory(lesson=LessonFactory(students_group=groups[0]), date=MONDAY)
+        # out of range
+        SingleLessonFactory(lesson=lectures[0], date=MONDAY + dt.timedelta(days=7))
+        db_session.commit()
+
+        # lessons and their teachers
+        with query_budget(2):
+            lessons = get_teacher_lessons_between(db_session, teacher.id, MONDAY,
+                                                  MONDAY + dt.timedelta(days=6))
+        assert [lesson.lesson_id for lesson in lessons] == [lecture.id for lecture in lectures]
+        assert get_groups_names(db_session, [groups[0].id, groups[0].id]) == \
+               {groups[0].id: groups[0].name}
@@ -5,7 +5,8 @@ from typing import Dict, List, Optional, Tuple, Union
 import pytest
 
 from app.database import Faculty, Lesson, SingleLesson, StudentsGroup, Teacher
-from app.timetable_scrapper.worker import TimetableScrapper
+from app.tests.factories import TeacherFactory
+from app.timetable_scrapper.worker import TimetableScrapper, parse_teacher_name
 
 
 @dataclass
@@ -126,6 +127,36 @@ class TestTimetableScrapper:
         got = scrapper.get("0")
         assert got is None
 
+    def test_resolve_teachers(self, scrapper, db_session):
+        koval = TeacherFactory(last_name="Коваль", first_name="Юрій", middle_name="Віталійович")
+        db_session.commit()
+
+        names = [
+            ("Коваль", "Юрій", "Віталійович"),
+            ("Ставровський", "Андрій", "Борисович"),
+            ("Ставровський", "Андрій", "Борисович"),
+        ]
+        teachers = scrapper.resolve_teachers(names)
+
+        assert len(teachers) == 2
+        assert teachers[names[0]].id == koval.id
+        assert teachers[names[1]].id is not None
+        assert db_session.query(Teacher).filter_by(last_name="Ставровський").count() == 1
+
+        # already existing teachers are returned as well
+        assert scrapper.resolve_teachers(names) == teachers
+
+    def test_resolve_no_teachers(self, scrapper, db_session):
+        assert scrapper.resolve_teachers([]) == {}
+
+    @pytest.mark.parametrize("full_name,result", [
+        ("Коваль Юрій Віталійович", ("Коваль", "Юрій", "Віталійович")),
+        ("Коваль Ю. В.", ("Коваль", "Ю", "В")),
+        ("Коваль", ("Коваль", "", "")),
+    ])
+    def test_parse_teacher_name(self, full_name, result):
+        assert parse_teacher_name(full_name) == result
+
     def test_run(self, scrapper, db_session, mocker):
         routing = [
             ("https://api.mytimetable.live/rest/groups/?univ=1",
@@ -11,9 +11,11 @@ import json
 import logging
 import re
 import urllib.parse
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional, Tuple
 
 import requests
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql as pg
 from sqlalchemy.orm.session import Session as SqaSession
 
 from app.database import (
@@ -24,10 +26,21 @@ from app.database import (
     StudentsGroup,
     Teacher,
 )
+from app.timetable.cache import timetable_cache
 
 logger = logging.getLogger(__name__)
 full_name_mask = re.compile(r"^\s*?([а-яїєі']+)\s*?([а-яїєі']+)\.?\s*?([а-яїєі']+)\.?\s*?$", re.I)
 
+# (last_name, first_name, middle_name)
+TeacherName = Tuple[str, str, str]
+
+
+def parse_teacher_name(full_name: str) -> TeacherName:
+    match = full_name_mask.match(full_name)
+    if match is not None:
+        return match.groups()
+    return full_name, "", ""
+
 
 class TimetableScrapper:
 
@@ -44,6 +57,8 @@ class TimetableScrapper:
     def run(self):
         self.db.query(SingleLesson).delete()
 
+        # {faculty name: (raw_faculty, [(raw_group, raw_timetable), ...])}
+        faculties_timetables = dict()
         raw_groups = self.get("https://api.mytimetable.live/rest/groups/", {"univ": 1})
         for raw_group in raw_groups["results"]:
             try:
@@ -55,8 +70,16 @@ class TimetableScrapper:
                 if raw_timetable is None or "lessons" not in raw_timetable.keys():
                     continue
 
-                # Get/Create a faculty
                 raw_faculty = raw_timetable["lessons"][0]["faculty"]
+                faculties_timetables.setdefault(raw_faculty["name"], (raw_faculty, []))[1] \
+                    .append((raw_group, raw_timetable))
+            except Exception as e:
+                logger.error("got error while fetching %s: %s", raw_group.get("name", None), str(e))
+                continue
+
+        for raw_faculty, timetables in faculties_timetables.values():
+            try:
+                # Get/Create a faculty
                 faculty = self.db.query(Faculty).filter(Faculty.name == raw_faculty["name"]).first()
                 if faculty is None:
                     faculty = Faculty(
@@ -66,94 +89,117 @@ class TimetableScrapper:
                     self.db.add(faculty)
                     self.db.flush()
 
-                # Get/Create a group
-                group = self.db.query(StudentsGroup).filter_by(
-                    name=raw_group["name"],
-                    course=int(raw_group["course_name"]),
-                    faculty=faculty,
-                ).first()
-                if group is None:
-                    group = StudentsGroup(
-                        name=raw_group["name"],
-                        course=int(raw_group["course_name"]),
-                        faculty=faculty,
-                    )
-                    self.db.add(group)
-                    self.db.flush()
-                group_timetable = dict()  # {(theme, teachers, subgroup, format): [raw_lessons]}
-
-                for raw_lesson in raw_timetable["lessons"]:
-                    subgroup = (raw_lesson["subgroup"] or "").strip() or None
-
-                    # Unique Lesson key
-                    lesson_key = (raw_lesson["name_full"], subgroup, raw_lesson["format"])
-                    if group_timetable.get(lesson_key, None) is None:
-                        lesson = self.db.query(Lesson).filter_by(
-                            name=raw_lesson["name_full"],
-                            students_group=group,
-                            subgroup=subgroup,
-                            lesson_format=raw_lesson["format"],
-                        ).first()
-                        if lesson is None:
-                            lesson = Lesson(
-                                name=raw_lesson["name_full"],
-                                students_group=group,
-                                subgroup=subgroup,
-                                lesson_format=raw_lesson["format"],
-                            )
-                            self.db.add(lesson)
-                            # Attach teachers to the lesson
-                            for raw_teacher in raw_lesson["teachers"]:
-                                match = full_name_mask.match(raw_teacher["full_name"])
-                                if match is not None:
-                                    last_name, first_name, middle_name = match.groups()
-                                else:
-                                    last_name, first_name, middle_name = raw_teacher["full_name"], "", ""
-                                teacher = self.db.query(Teacher) \
-                                    .filter_by(last_name=last_name, first_name=first_name,
-                                               middle_name=middle_name) \
-                                    .first()
-                                if teacher is None:
-                                    teacher = Teacher(
-                                        last_name=last_name,
-                                        first_name=first_name,
-                                        middle_name=middle_name,
-                                    )
-                                    self.db.add(teacher)
-                                lesson.teachers.append(teacher)
-                            self.db.flush()
-                        group_timetable[lesson_key] = lesson
-
-                    starts_at = None
-                    ends_at = None
-                    for lesson_time in raw_timetable["lesson_time"]:
-                        if lesson_time["id"] == raw_lesson["lesson_time"]:
-                            starts_at = dt.datetime.strptime(lesson_time["start"], "%H:%M").time()
-                            ends_at = dt.datetime.strptime(lesson_time["end"], "%H:%M").time()
-                            break
-
-                    for date in raw_lesson["dates"]:
-                        single_lesson = SingleLesson(
-                            lesson=group_timetable[lesson_key],
-                            date=dt.datetime.strptime(date, "%Y-%m-%d").date(),
-                            starts_at=starts_at,
-                            ends_at=ends_at,
-                        )
-                        # l = group_timetable[lesson_key]
-                        # if dt.datetime.strptime(date, "%Y-%m-%d").date() == dt.date(2021, 1, 27) \
-                        #         and starts_at == dt.time(12, 20) \
-                        #         and ends_at == dt.time(13, 55) \
-                        #         and l.name == "Чисельний аналіз":
-                        #     logger.info("{} {} ({})".format(single_lesson.lesson,
-                        #     single_lesson, raw_lesson))
-                        self.db.add(single_lesson)
-                        self.db.flush()
+                # Get/Create all teachers of the faculty at once
+                teachers = self.resolve_teachers(
+                    parse_teacher_name(raw_teacher["full_name"])
+                    for _, raw_timetable in timetables
+                    for raw_lesson in raw_timetable["lessons"]
+                    for raw_teacher in raw_lesson["teachers"]
+                )
             except Exception as e:
-                logger.error("got error while parsing %s: %s", raw_group.get("name", None), str(e))
-                continue
-            else:
+                logger.error("got error while parsing %s: %s", raw_faculty.get("name", None), str(e))
                 continue
+
+            for raw_group, raw_timetable in timetables:
+                try:
+                    self.save_group_timetable(faculty, teachers, raw_group, raw_timetable)
+                except Exception as e:
+                    logger.error("got error while parsing %s: %s",
+                                 raw_group.get("name", None), str(e))
+                    continue
         self.db.commit()
+        # lessons of all groups were deleted and rewritten
+        timetable_cache.invalidate_groups(self.db.execute(select(StudentsGroup.id)).scalars())
+
+    def save_group_timetable(self, faculty: Faculty, teachers: Dict[TeacherName, Teacher],
+                             raw_group: Dict[str, Any], raw_timetable: Dict[str, Any]):
+        # Get/Create a group
+        group = self.db.query(StudentsGroup).filter_by(
+            name=raw_group["name"],
+            course=int(raw_group["course_name"]),
+            faculty=faculty,
+        ).first()
+        if group is None:
+            group = StudentsGroup(
+                name=raw_group["name"],
+                course=int(raw_group["course_name"]),
+                faculty=faculty,
+            )
+            self.db.add(group)
+            self.db.flush()
+        group_timetable = dict()  # {(theme, teachers, subgroup, format): [raw_lessons]}
+
+        for raw_lesson in raw_timetable["lessons"]:
+            subgroup = (raw_lesson["subgroup"] or "").strip() or None
+
+            # Unique Lesson key
+            lesson_key = (raw_lesson["name_full"], subgroup, raw_lesson["format"])
+            if group_timetable.get(lesson_key, None) is None:
+                lesson = self.db.query(Lesson).filter_by(
+                    name=raw_lesson["name_full"],
+                    students_group=group,
+                    subgroup=subgroup,
+                    lesson_format=raw_lesson["format"],
+                ).first()
+                if lesson is None:
+                    lesson = Lesson(
+                        name=raw_lesson["name_full"],
+                        students_group=group,
+                        subgroup=subgroup,
+                        lesson_format=raw_lesson["format"],
+                    )
+                    self.db.add(lesson)
+                    # Attach teachers to the lesson
+                    for raw_teacher in raw_lesson["teachers"]:
+                        teacher = teachers[parse_teacher_name(raw_teacher["full_name"])]
+                        lesson.teachers.append(teacher)
+                    self.db.flush()
+                group_timetable[lesson_key] = lesson
+
+            starts_at = None
+            ends_at = None
+            for lesson_time in raw_timetable["lesson_time"]:
+                if lesson_time["id"] == raw_lesson["lesson_time"]:
+                    starts_at = dt.datetime.strptime(lesson_time["start"], "%H:%M").time()
+                    ends_at = dt.datetime.strptime(lesson_time["end"], "%H:%M").time()
+                    break
+
+            for date in raw_lesson["dates"]:
+                single_lesson = SingleLesson(
+                    lesson=group_timetable[lesson_key],
+                    date=dt.datetime.strptime(date, "%Y-%m-%d").date(),
+                    starts_at=starts_at,
+                    ends_at=ends_at,
+                )
+                self.db.add(single_lesson)
+                self.db.flush()
+
+    def resolve_teachers(self, names: Iterable[TeacherName]) -> Dict[TeacherName, Teacher]:
+        """
+        Gets or creates teachers by their (last_name, first_name, middle_name)
+        with a single INSERT ... ON CONFLICT ... RETURNING statement
+        """
+        # sorted to lock rows in the same order, if runs overlap
+        names = sorted(set(names))
+        if not names:
+            return dict()
+
+        stmt = pg.insert(Teacher).values([
+            {"last_name": last_name, "first_name": first_name, "middle_name": middle_name}
+            for last_name, first_name, middle_name in names
+        ])
+        stmt = stmt.on_conflict_do_update(
+            constraint="teacher_full_name_key",
+            # no-op update, so that already existing teachers are returned too
+            set_={"last_name": stmt.excluded.last_name},
+        ).returning(*Teacher.__table__.columns)
+
+        teachers = self.db.execute(
+            select(Teacher)
+            .from_statement(stmt)
+            .execution_options(populate_existing=True)
+        ).scalars().all()
+        return {(t.last_name, t.first_name, t.middle_name): t for t in teachers}
 
     def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         if params is not None and len(params) > 0:
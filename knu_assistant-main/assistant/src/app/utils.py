@@ -1,6 +1,6 @@
 import datetime as dt
 import logging
-from typing import Union
+from typing import Tuple, Union
 
 logger = logging.getLogger(__name__)
 
@@ -9,3 +9,12 @@ def get_monday(date: Union[dt.date, dt.datetime]):
     if isinstance(date, dt.datetime):
         date = date.date()
     return date - dt.timedelta(days=date.weekday())
+
+
+def get_month_bounds(date: Union[dt.date, dt.datetime]) -> Tuple[dt.date, dt.date]:
+    """ The first and the last days of the date's month """
+    if isinstance(date, dt.datetime):
+        date = date.date()
+    first_day = date.replace(day=1)
+    next_month = (first_day + dt.timedelta(days=31)).replace(day=1)
+    return first_day, next_month - dt.timedelta(days=1)
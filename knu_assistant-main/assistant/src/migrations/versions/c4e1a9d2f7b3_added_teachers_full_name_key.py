@@ -0,0 +1,52 @@
+"""added teachers full name unique key
+
+Revision ID: c4e1a9d2f7b3
+Revises: 7f37e6641a37
+Create Date: 2026-10-19 15:02:11.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e1a9d2f7b3'
+down_revision = '7f37e6641a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # point lessons of duplicated teachers to the oldest one
+    op.execute("""
+        UPDATE lessons_teachers
+        SET teacher_id = duplicates.original_id
+        FROM (
+            SELECT id, MIN(id) OVER (PARTITION BY last_name, first_name, middle_name) AS original_id
+            FROM teachers
+        ) AS duplicates
+        WHERE lessons_teachers.teacher_id = duplicates.id
+            AND duplicates.id <> duplicates.original_id
+    """)
+    # remove links, duplicated after the previous step
+    op.execute("""
+        DELETE FROM lessons_teachers a
+        USING lessons_teachers b
+        WHERE a.ctid > b.ctid
+            AND a.lesson_id = b.lesson_id
+            AND a.teacher_id = b.teacher_id
+    """)
+    op.execute("""
+        DELETE FROM teachers a
+        USING teachers b
+        WHERE a.id > b.id
+            AND a.last_name = b.last_name
+            AND a.first_name = b.first_name
+            AND a.middle_name = b.middle_name
+    """)
+    op.create_unique_constraint('teacher_full_name_key', 'teachers',
+                                ['last_name', 'first_name', 'middle_name'])
+
+
+def downgrade():
+    op.drop_constraint('teacher_full_name_key', 'teachers', type_='unique')
@@ -0,0 +1,32 @@
+"""added teachers name search index
+
+Revision ID: d8f3b2a61c94
+Revises: c4e1a9d2f7b3
+Create Date: 2026-10-19 18:40:52.104233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f3b2a61c94'
+down_revision = 'c4e1a9d2f7b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # the expression must match app.timetable.teachers.TEACHER_SEARCH_NAME
+    op.execute("""
+        CREATE INDEX teachers_search_name_trgm_idx ON teachers
+        USING gin (lower(last_name || ' ' || first_name || ' ' || middle_name) gin_trgm_ops)
+    """)
+    op.create_index(op.f('ix_lessons_teachers_teacher_id'), 'lessons_teachers', ['teacher_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_lessons_teachers_teacher_id'), table_name='lessons_teachers')
+    op.execute("DROP INDEX teachers_search_name_trgm_idx")
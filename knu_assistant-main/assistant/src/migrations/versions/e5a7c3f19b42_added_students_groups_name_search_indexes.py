@@ -0,0 +1,34 @@
+"""added students groups name search indexes
+
+Revision ID: e5a7c3f19b42
+Revises: d8f3b2a61c94
+Create Date: 2026-10-19 19:55:07.630118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c3f19b42'
+down_revision = 'd8f3b2a61c94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm is created by d8f3b2a61c94
+    # the expressions must match app.timetable.groups.GROUP_SEARCH_NAME
+    op.execute("""
+        CREATE INDEX students_groups_search_name_prefix_idx ON students_groups
+        (lower(regexp_replace(name, '[^[:alnum:]]+', '', 'g')) text_pattern_ops)
+    """)
+    op.execute("""
+        CREATE INDEX students_groups_search_name_trgm_idx ON students_groups
+        USING gin (lower(regexp_replace(name, '[^[:alnum:]]+', '', 'g')) gin_trgm_ops)
+    """)
+
+
+def downgrade():
+    op.execute("DROP INDEX students_groups_search_name_trgm_idx")
+    op.execute("DROP INDEX students_groups_search_name_prefix_idx")
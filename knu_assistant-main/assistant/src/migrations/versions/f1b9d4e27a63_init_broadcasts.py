@@ -0,0 +1,49 @@
+"""init broadcasts
+
+Revision ID: f1b9d4e27a63
+Revises: e5a7c3f19b42
+Create Date: 2026-10-19 21:12:38.245790
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b9d4e27a63'
+down_revision = 'e5a7c3f19b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('broadcasts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('students_group_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['author_id'], ['users.tg_id'], ),
+    sa.ForeignKeyConstraint(['students_group_id'], ['students_groups.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('broadcast_recipients',
+    sa.Column('broadcast_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['broadcast_id'], ['broadcasts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.tg_id'], ),
+    sa.PrimaryKeyConstraint('broadcast_id', 'user_id')
+    )
+    op.create_index('broadcast_recipients_pending_idx', 'broadcast_recipients',
+                    ['broadcast_id', 'user_id'], unique=False,
+                    postgresql_where=sa.text("status = 'pending'"))
+
+
+def downgrade():
+    op.drop_index('broadcast_recipients_pending_idx', table_name='broadcast_recipients')
+    op.drop_table('broadcast_recipients')
+    op.drop_table('broadcasts')
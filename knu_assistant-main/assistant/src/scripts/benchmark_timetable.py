@@ -0,0 +1,150 @@
+"""
+Timetable micro-benchmarks
+Runs on an in-memory SQLite database, so it measures bot-side CPU overhead only.
+
+Usage:
+$ python -m poetry run python scripts/benchmark_timetable.py
+"""
+
+import datetime as dt
+import logging
+import re
+import timeit
+import tracemalloc
+from itertools import groupby
+from operator import attrgetter
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, contains_eager
+
+from app.database import (
+    Base,
+    Faculty,
+    Lesson,
+    LessonSubgroupMember,
+    LessonTeacher,
+    SingleLesson,
+    StudentsGroup,
+    Teacher,
+    User,
+)
+from app.bot.commands.timetable import week_lines
+from app.bot.dictionaries import week
+from app.bot.dictionaries.phrases import E_BOOKS, E_TEACHER
+from app.timetable.queries import get_day_lessons, get_lessons_between
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DATE = dt.date(2021, 2, 1)
+LESSONS_PER_DAY = 5
+
+
+def setup_database() -> Session:
+    """ Creates an in-memory database with a single user and a dense week """
+    engine = create_engine("sqlite://")
+    tables = [Faculty.__table__, StudentsGroup.__table__, User.__table__, Teacher.__table__,
+              Lesson.__table__, SingleLesson.__table__, LessonTeacher, LessonSubgroupMember]
+    Base.metadata.create_all(engine, tables=tables)
+
+    session = Session(bind=engine)
+    faculty = Faculty(name="Faculty", shortcut="F")
+    group = StudentsGroup(name="K-14", course=1, faculty=faculty)
+    user = User(tg_id=1, tg_username="user", students_group=group)
+    session.add(user)
+    for idx in range(LESSONS_PER_DAY):
+        teacher = Teacher(last_name="Teacher{}".format(idx), first_name="Name",
+                          middle_name="Middle")
+        lesson = Lesson(name="Lesson {}".format(idx), students_group=group, lesson_format=0,
+                        teachers=[teacher])
+        for day_idx in range(7):
+            session.add(SingleLesson(
+                lesson=lesson,
+                date=BENCHMARK_DATE + dt.timedelta(days=day_idx),
+                starts_at=dt.time(8 + idx * 2, 40),
+                ends_at=dt.time(10 + idx * 2, 15),
+            ))
+    session.commit()
+    return session
+
+
+def rebuilt_day_lessons(session: Session, user: User, date: dt.date):
+    """ The query built from ORM constructs on every call, as it was done before """
+    user_subgroups = (
+        select(LessonSubgroupMember.c.lesson_id)
+        .where(LessonSubgroupMember.c.user_id == user.tg_id)
+    )
+    return (
+        session.query(SingleLesson)
+        .join(SingleLesson.lesson)
+        .filter(
+            (Lesson.students_group_id == user.students_group_id) &
+            ((Lesson.subgroup == None) | (Lesson.id.in_(user_subgroups))) &
+            (SingleLesson.date == date)
+        )
+        .options(contains_eager(SingleLesson.lesson).selectinload(Lesson.teachers))
+        .order_by(SingleLesson.starts_at)
+        .all()
+    )
+
+
+ENDING_SPACES_MASK = re.compile(r"^(.*)(?<!\s)(\s+)$", flags=re.S)
+
+
+def concatenated_week(lessons) -> str:
+    """ The week rendered by string concatenation and trailing spaces removal, as it was before """
+    result_str = ""
+    for date, day_lessons in groupby(lessons, key=attrgetter("date")):
+        day_str = ""
+        for lesson in day_lessons:
+            lesson_str = "{} - {}\n{} <b>{}</b> ({})\n{} {}\n".format(
+                lesson.starts_at.strftime("%H:%M"), lesson.ends_at.strftime("%H:%M"),
+                E_BOOKS, lesson.lesson.name, lesson.lesson.represent_lesson_format(),
+                E_TEACHER, f"{E_TEACHER} ".join(t.short_name for t in lesson.lesson.teachers),
+            )
+            lesson_str += "Встановити посилання: /link@{}\n".format(lesson.lesson_id)
+            lesson_str = ENDING_SPACES_MASK.sub(r"\1", lesson_str)
+            day_str += "{}\n\n".format(lesson_str)
+        day_str = ENDING_SPACES_MASK.sub(r"\1", day_str)
+        result_str += "[ <b>{}</b> ]\n{}\n\n".format(week.LIST[date.weekday()].name, day_str)
+    return ENDING_SPACES_MASK.sub(r"\1", result_str)
+
+
+def joined_week(lessons) -> str:
+    return "\n".join(week_lines(lessons))
+
+
+def measure(name: str, func, number: int):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    print("{:<40} {:>10.1f} us/call".format(name, best / number * 1e6))
+
+
+def measure_allocations(name: str, func):
+    tracemalloc.start()
+    func()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:<40} {:>10.1f} KiB peak".format(name, peak / 1024))
+
+
+def run(number: int = 1000):
+    session = setup_database()
+    user = session.query(User).one()
+
+    print("Timetable day query ({} lessons):".format(LESSONS_PER_DAY))
+    measure("rebuilt ORM query",
+            lambda: rebuilt_day_lessons(session, user, BENCHMARK_DATE), number)
+    measure("cached statement",
+            lambda: get_day_lessons(session, user, BENCHMARK_DATE), number)
+
+    lessons = get_lessons_between(session, user, BENCHMARK_DATE,
+                                  BENCHMARK_DATE + dt.timedelta(days=6))
+    assert concatenated_week(lessons) == joined_week(lessons)
+    print("Timetable week rendering ({} lessons):".format(len(lessons)))
+    measure("concatenation and regex", lambda: concatenated_week(lessons), number)
+    measure("joined lines, lesson fragments", lambda: joined_week(lessons), number)
+    measure_allocations("concatenation and regex", lambda: concatenated_week(lessons))
+    measure_allocations("joined lines, lesson fragments", lambda: joined_week(lessons))
+
+
+if __name__ == "__main__":
+    run()